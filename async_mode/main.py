@@ -1,13 +1,23 @@
 """Includes the functions for get and process Nasa images in sync mode."""
 
 import asyncio
-import io
-from typing import Dict, List, Set
+from contextlib import nullcontext
+from functools import partial
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Set, Tuple
 
-from aiohttp import ClientSession
-from PIL import Image
+from aiohttp import ClientResponse, ClientSession
 
-from image import NasaImage
+from cache import NOT_MODIFIED, CacheEntry, ResponseCache, Validators, metadata_cache
+from colors import count_colors, decode_image
+from image import CHUNK_SIZE, DEFAULT_SPILL_THRESHOLD, BodyBuffer, NasaImage
+from memtrack import track_stage
+from metadata import DecodeError, aiter_images, loads, parse_images
+from options import RunOptions
+from planner import RunPlan, bound_workers
+from profiling import ProfiledCall
+from resolution import URL, resolve_url_async
+from scheduler import AsyncByteBudget, parse_content_length
+from sinks import make_writer
 
 
 async def get_metadata(api_url: str) -> List[Dict]:
@@ -20,11 +30,12 @@ async def get_metadata(api_url: str) -> List[Dict]:
     -------
         List[Dict]: List of decoded data containing images metadata.
     """
-    async with ClientSession() as session:
-        async with session.get(api_url) as response:
-            if response.status == 200:
-                return await response.json()
-            return []
+    with track_stage("metadata", "metadata"):
+        async with ClientSession() as session:
+            async with session.get(api_url) as response:
+                if response.status == 200:
+                    return loads(await response.read())
+                return []
 
 
 async def process_metadata(data: List[Dict]) -> List[NasaImage]:
@@ -37,49 +48,291 @@ async def process_metadata(data: List[Dict]) -> List[NasaImage]:
         Returns a list of NASA images objects.
     """
     return [
-        NasaImage(url=p["url"], media_type=p["media_type"], title=p["title"], date=p["date"])
+        NasaImage(
+            url=p["url"],
+            media_type=p["media_type"],
+            title=p["title"],
+            date=p["date"],
+            hdurl=p.get("hdurl"),
+        )
         for p in data
     ]
 
 
-async def get_content(images: List[NasaImage]):
-    """Get the binary content of a set of images using their URL.
+async def stream_images(
+    api_url: str, session: ClientSession, cache: ResponseCache | None = None
+) -> AsyncIterator[NasaImage]:
+    """Request the metadata and yield the images as their metadata arrives.
+
+    When the metadata response is cached, it is requested with the cached validators and the
+    cached body is decoded if the server answers that it has not been modified. A cached body
+    that cannot be decoded is requested again without validators. Otherwise the body is kept as
+    it streams and cached once it is complete.
 
     Args:
-        images (List[NasaImage]): List of NASA images objects.
+        api_url (str): NASA's api URL
+        session (ClientSession): An iohttp client session object.
+        cache (ResponseCache | None): Cache of the metadata responses, revalidated if given.
+
+    Yields:
+        Each NASA image object. Nothing if the metadata endpoint does not respond successfully,
+        and only the images decoded so far if the metadata is malformed.
     """
-    tasks = []
-    async with ClientSession() as session:
-        for image in images:
-            if image.media_type != "image":
-                print(f"Invalid media type for {image}")
-                continue
-            task = asyncio.ensure_future(get_image_bytes(image, session))
-            tasks.append(task)
-        await asyncio.gather(*tasks)
+    cached = cache.get(api_url) if cache is not None else None
+    headers = cached.validators.conditional_headers() if cached is not None else None
+    async with session.get(api_url, headers=headers) as response:
+        if cached is None or response.status != NOT_MODIFIED:
+            async for image in _stream_response(api_url, response, cache):
+                yield image
+            return
+        try:
+            images = parse_images(cached.body)
+        except (ValueError, DecodeError) as error:
+            print(f"Malformed cached pictures metadata: {error}")
+        else:
+            for image in images:
+                yield image
+            return
+
+    async with session.get(api_url) as response:
+        async for image in _stream_response(api_url, response, cache):
+            yield image
+
+
+async def _stream_response(
+    api_url: str, response: ClientResponse, cache: ResponseCache | None
+) -> AsyncIterator[NasaImage]:
+    if response.status != 200:
+        return
 
+    chunks: List[bytes] = []
 
-async def get_image_bytes(image: NasaImage, session: ClientSession):
-    """Get the binary content of an image using its URL.
+    async def read() -> AsyncIterator[bytes]:
+        async for chunk in response.content.iter_any():
+            if cache is not None:
+                chunks.append(chunk)
+            yield chunk
 
-    The binary content is loaded using an in-memory buffer and set to
-    the image bytes attribute.
+    try:
+        async for image in aiter_images(read()):
+            yield image
+    except ValueError as error:
+        print(f"Malformed pictures metadata: {error}")
+        return
+    if cache is not None:
+        cache.set(api_url, b"".join(chunks), Validators.from_headers(response.headers))
+
+
+async def get_content(
+    images: Iterable[NasaImage] | AsyncIterable[NasaImage],
+    io_workers: int | None,
+    budget: AsyncByteBudget,
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+    resolution: str = URL,
+    preview_scale: int = 1,
+) -> List[int | None]:
+    """Get the binary content of a set of images using their URL and count their colors.
+
+    Args:
+        images (Iterable[NasaImage] | AsyncIterable[NasaImage]): NASA images objects.
+        io_workers (int | None): Maximum number of concurrent downloads. Unbounded if None.
+        budget (AsyncByteBudget): Memory budget shared by the downloads.
+        spill_threshold (int): Size in bytes above which a body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        preview_scale (int): Divisor of the width and height of the decoded images.
+
+    Returns:
+        The number of unique colors of each image.
+    """
+    counts: Dict[int, int | None] = {}
+    async for index, _, entry in iter_content(
+        images, io_workers, budget, spill_threshold, resolution, preview_scale
+    ):
+        counts[index] = None if entry is None else entry.colors
+    return [counts[index] for index in range(len(counts))]
+
+
+async def iter_content(
+    images: Iterable[NasaImage] | AsyncIterable[NasaImage],
+    io_workers: int | None,
+    budget: AsyncByteBudget,
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+    resolution: str = URL,
+    preview_scale: int = 1,
+    plan: RunPlan | None = None,
+) -> AsyncIterator[Tuple[int, NasaImage, CacheEntry | None]]:
+    """Get and count the colors of a set of images, yielding each count as it completes.
+
+    The images are added to the plan as they are yielded, so they can be streamed while their
+    metadata is still arriving. Each download asks the plan for the next picture once it gets
+    its slot, and revalidates the pictures with a stale cached entry. The pending work is
+    cancelled if the iteration is abandoned.
+
+    Args:
+        images (Iterable[NasaImage] | AsyncIterable[NasaImage]): NASA images objects.
+        io_workers (int | None): Maximum number of concurrent downloads. Unbounded if None.
+        budget (AsyncByteBudget): Memory budget shared by the downloads.
+        spill_threshold (int): Size in bytes above which a body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        preview_scale (int): Divisor of the width and height of the decoded images.
+        plan (RunPlan | None): Plan of the pictures to launch, which may already hold some.
+            A plan without cache nor deadline is used if None.
+
+    Yields:
+        The index of each launched picture in the plan, the image, and its number of unique
+        colors with the validators of its response, in completion order.
+    """
+    plan = plan or RunPlan()
+    tasks: List[asyncio.Future] = []
+    completed: asyncio.Queue[asyncio.Future] = asyncio.Queue()
+    semaphore = asyncio.Semaphore(io_workers) if io_workers else None
+    async with ClientSession() as session:
+
+        async def launch() -> Tuple[int, CacheEntry | None] | None:
+            async with semaphore or nullcontext():
+                index = plan.next()  # type: ignore
+                if index is None:
+                    return None
+                entry = await get_image_bytes(
+                    plan.images[index],  # type: ignore
+                    session,
+                    budget,
+                    None,
+                    spill_threshold,
+                    resolution,
+                    preview_scale,
+                    plan.stale.get(index),  # type: ignore
+                )
+                return index, entry
+
+        def start():
+            task = asyncio.ensure_future(launch())
+            tasks.append(task)
+            task.add_done_callback(completed.put_nowait)
+
+        def add(image: NasaImage):
+            if plan.add(image) not in plan.cached:  # type: ignore
+                start()
+
+        async def produce():
+            for _ in range(plan.remaining):  # type: ignore
+                start()
+            if isinstance(images, AsyncIterable):
+                async for image in images:
+                    add(image)
+            else:
+                for image in images:
+                    add(image)
+
+        producer = asyncio.ensure_future(produce())
+        producer.add_done_callback(completed.put_nowait)
+        try:
+            produced = False
+            finished = 0
+            while not produced or finished < len(tasks):
+                task = await completed.get()
+                if task is producer:
+                    producer.result()
+                    produced = True
+                    continue
+                finished += 1
+                result = task.result()
+                if result is not None:
+                    index, entry = result
+                    yield index, plan.images[index], entry
+        finally:
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+
+
+async def get_image_bytes(
+    image: NasaImage,
+    session: ClientSession,
+    budget: AsyncByteBudget,
+    semaphore: asyncio.Semaphore | None = None,
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+    resolution: str = URL,
+    preview_scale: int = 1,
+    cached: CacheEntry | None = None,
+) -> CacheEntry | None:
+    """Get the binary content of an image using its URL and count its colors.
+
+    The binary content is streamed into a buffer and set to the image bytes attribute. Bodies
+    larger than the spill threshold are buffered in a memory-mapped temporary file. The room
+    reserved for the body in the budget is held until the colors are counted and the buffer is
+    dropped. The colors are counted in the default executor, so the event loop keeps the other
+    downloads flowing meanwhile. An image with a cached entry is requested with the entry
+    validators, and its cached count is reused if the server answers that it has not been
+    modified.
 
     Args:
     ----
         image (NasaImage): An image.
         session (ClientSession): An iohttp client session object.
-    """
-    async with session.get(image.url) as response:
-        if response.status == 200:
-            image.bytes = io.BytesIO(await response.read())
-
+        budget (AsyncByteBudget): Memory budget shared by the downloads.
+        semaphore (asyncio.Semaphore | None): Limits the number of concurrent downloads.
+        spill_threshold (int): Size in bytes above which the body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        preview_scale (int): Divisor of the width and height of the decoded image.
+        cached (CacheEntry | None): Cached entry of the image to revalidate.
 
-def process_image(image: NasaImage) -> int | None:
+    Returns:
+    -------
+        The number of unique colors of the image and the validators of its response, or None
+        if it could not be counted.
+    """
+    if image.media_type != "image":
+        return process_image(image)  # type: ignore
+
+    async with semaphore or nullcontext():
+        return await _download(
+            image, session, budget, spill_threshold, resolution, preview_scale, cached
+        )
+
+
+async def _download(
+    image: NasaImage,
+    session: ClientSession,
+    budget: AsyncByteBudget,
+    spill_threshold: int,
+    resolution: str,
+    preview_scale: int,
+    cached: CacheEntry | None,
+) -> CacheEntry | None:
+    url = await resolve_url_async(image, resolution, session)
+    headers = cached.validators.conditional_headers() if cached is not None else None
+    async with session.get(url, headers=headers) as response:
+        if cached is not None and response.status == NOT_MODIFIED:
+            print(f"Not modified: {image}")
+            return cached.revalidated(response.headers)
+        if response.status != 200:
+            print(f"Cannot get the content for image: {image}")
+            return None
+
+        content_length = parse_content_length(response.headers)
+        async with budget.reserve(content_length):
+            with track_stage(image.date, "download"):
+                body = BodyBuffer(spill_threshold, content_length)
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    body.write(chunk)
+            budget.observe(body.size)
+            image.bytes = body.getbuffer()
+            try:
+                colors = await asyncio.get_running_loop().run_in_executor(
+                    None, ProfiledCall(process_image), image, preview_scale
+                )
+            finally:
+                image.bytes = None
+        return CacheEntry.from_response(colors, response.headers)
+
+
+def process_image(image: NasaImage, preview_scale: int = 1) -> int | None:
     """Process a given image.
 
     Args:
         image (NasaImage): An image object.
+        preview_scale (int): Divisor of the width and height of the decoded image.
 
     Returns:
         The number of unique colors of the image.
@@ -92,8 +345,13 @@ def process_image(image: NasaImage) -> int | None:
         print(f"Corrupted bytes for image: {image}")
 
     print(f"Processing image: {image}")
-    img = Image.open(image.bytes)
-    return get_color_count(set(img.getdata()))
+    with track_stage(image.date, "decode"):
+        img = decode_image(image.bytes, preview_scale)  # type: ignore
+    with track_stage(image.date, "count"):
+        count = count_colors(img)
+        if count is not None:
+            return count
+        return get_color_count(set(img.getdata()))
 
 
 def get_color_count(unique_pixels: Set):
@@ -109,7 +367,13 @@ def get_color_count(unique_pixels: Set):
     return len(unique_pixels)
 
 
-async def main(api_url: str, start_date: str, end_date: str):
+async def main(
+    api_url: str,
+    start_date: str,
+    end_date: str,
+    options: RunOptions = RunOptions(),
+    images: List[NasaImage] | None = None,
+):
     """Process the images in the given date range.
 
     Args:
@@ -117,15 +381,48 @@ async def main(api_url: str, start_date: str, end_date: str):
         api_url (str): URL of the NASA's image metadata endpoint.
         start_date (str): Start date in format "YYYY-MM-DD"
         end_date (str): End date in format "YYYY-MM-DD"
+        options (RunOptions): Tuning options. Uses ``io_workers`` to bound the downloads and
+            ``memory_budget`` to bound the bytes they hold. Bodies larger than
+            ``spill_threshold`` are buffered on disk. The pictures are downloaded with the
+            ``resolution`` policy and decoded at ``preview_scale``. Pictures cached in
+            ``cache_dir`` are not downloaded again, unless they are within the last
+            ``revalidate_days`` and have been modified, and no picture is launched past the
+            ``deadline``. The results are written to ``sink`` as the images complete, or in date
+            order if ``ordered`` is set.
+        images (List[NasaImage] | None): Pictures of the date range, when their metadata has
+            already been processed. The metadata is fetched if None.
     """
     url = f"{api_url}&start_date={start_date}&end_date={end_date}"
-    data = await get_metadata(url)
-
-    if not data:
+    budget = AsyncByteBudget(options.memory_budget)
+    write = make_writer(options.sink, options.ordered)
+    io_workers = bound_workers(options.io_workers, options)
+    async with ClientSession() as session:
+        source: Iterable[NasaImage] | AsyncIterable[NasaImage] = []
+        if images is None and options.deadline is None:
+            source = stream_images(url, session, metadata_cache(options.cache_dir))
+            plan = RunPlan(options=options, write=write, workers=io_workers)
+        else:
+            if images is None:
+                # The pictures are launched by cost, so the whole metadata is needed to plan them.
+                metadata = stream_images(url, session, metadata_cache(options.cache_dir))
+                images = [image async for image in metadata]
+            # The sizes of the pictures are probed with blocking requests, off the event loop.
+            plan = await asyncio.get_running_loop().run_in_executor(
+                None, partial(RunPlan, images, options, write, workers=io_workers)
+            )
+
+        async for index, _, entry in iter_content(
+            source,
+            io_workers,
+            budget,
+            options.spill_threshold,
+            options.resolution,
+            options.preview_scale,
+            plan,
+        ):
+            plan.complete(index, entry)
+
+    if not plan.images:
         print("An error ocurred retrieving the pictures metadata.")
         return
-
-    images = await process_metadata(data)
-    await get_content(images)
-    for image in images:
-        print(process_image(image))
+    plan.finish()
@@ -0,0 +1 @@
+"""Auto mode package."""
\ No newline at end of file
@@ -0,0 +1,305 @@
+"""Includes the functions for choosing and running the fastest execution mode for a workload."""
+
+import asyncio
+import json
+import logging
+import math
+import os
+from dataclasses import replace
+from multiprocessing import cpu_count
+from time import time
+from timeit import default_timer
+from typing import Dict, List, NamedTuple
+
+from async_mode.main import main as main_async
+from cache import metadata_cache
+from image import NasaImage
+from multiprocessing_mode.main import main as main_processing
+from options import RunOptions
+from planner import RunPlan
+from sinks import make_writer
+from sync_mode.main import count_content, get_content, get_metadata, process_image, process_metadata
+from sync_mode.main import main as main_sync
+from thread_mode.main import main as main_thread
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_SAMPLES = 3
+CALIBRATION_MAX_AGE = 24 * 60 * 60
+DEFAULT_CALIBRATION_FILE = os.path.join("~", ".cache", "nasa-pod", "calibration.json")
+
+MAX_ASYNC_DOWNLOADS = 64
+MAX_DOWNLOAD_THREADS = 16
+POOL_STARTUP_SECONDS = 0.5
+
+
+class Calibration(NamedTuple):
+    """Measured costs of processing a single image.
+
+    Attributes:
+        download_seconds: Mean time for downloading an image.
+        decode_seconds: Mean time for decoding an image and counting its colors.
+        measured_at: Unix timestamp of the measurement.
+    """
+
+    download_seconds: float
+    decode_seconds: float
+    measured_at: float
+
+
+class Strategy(NamedTuple):
+    """Execution mode chosen for a workload.
+
+    Attributes:
+        mode: Name of the execution mode.
+        options: Options of the run, with the concurrency levels of the execution mode.
+        reason: Human readable explanation of the choice.
+    """
+
+    mode: str
+    options: RunOptions
+    reason: str
+
+
+DEFAULT_CALIBRATION = Calibration(download_seconds=1.0, decode_seconds=0.5, measured_at=0.0)
+
+
+def get_calibration_path() -> str:
+    """Get the path of the saved calibration data.
+
+    Returns:
+        The value of the ``CALIBRATION_FILE`` environment variable or a per-user default.
+    """
+    return os.path.expanduser(os.environ.get("CALIBRATION_FILE", DEFAULT_CALIBRATION_FILE))
+
+
+def load_calibration(path: str, max_age: float = CALIBRATION_MAX_AGE) -> Calibration | None:
+    """Load saved calibration data.
+
+    Args:
+        path (str): Path of the calibration file.
+        max_age (float): Maximum age in seconds of usable calibration data.
+
+    Returns:
+        The saved calibration, or None if it is missing, unreadable or too old.
+    """
+    try:
+        with open(path) as calibration_file:
+            calibration = Calibration(**json.load(calibration_file))
+    except (OSError, ValueError, TypeError):
+        return None
+
+    if time() - calibration.measured_at > max_age:
+        return None
+    return calibration
+
+
+def save_calibration(path: str, calibration: Calibration):
+    """Save calibration data so following runs can skip the measurement.
+
+    Args:
+        path (str): Path of the calibration file.
+        calibration (Calibration): Measured costs.
+    """
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as calibration_file:
+            json.dump(calibration._asdict(), calibration_file)
+    except OSError as error:
+        logger.warning(f"Cannot save calibration data to {path}: {error}")
+
+
+def calibrate(images: List[NasaImage], options: RunOptions = RunOptions()) -> Calibration:
+    """Measure the download and decode costs by fully processing a few images.
+
+    The images are processed in sync mode within the plan of the run options, like the rest
+    of the run, and their results are written to the sink of the options, so the calibration
+    work is not wasted. The cached pictures are not downloaded again and are left out of the
+    measurement.
+
+    Args:
+        images (List[NasaImage]): Sample of NASA images objects.
+        options (RunOptions): Options of the run, the sample is processed with its
+            ``spill_threshold``, ``resolution``, ``preview_scale``, ``cache_dir``,
+            ``revalidate_days``, ``deadline``, ``sink`` and ``ordered``.
+
+    Returns:
+        The measured costs, or the default costs if no picture of the sample was downloaded
+        and counted.
+    """
+    plan = RunPlan(images, options, make_writer(options.sink, options.ordered))
+    download_times = []
+    decode_times = []
+    for index in iter(plan.next, None):
+        image = plan.images[index]
+        if image.media_type != "image":
+            plan.complete(index, process_image(image))
+            continue
+
+        cached = plan.stale.get(index)
+        start_time = default_timer()
+        response = get_content(image, options.spill_threshold, options.resolution, cached)
+        download_times.append(default_timer() - start_time)
+        # A failed download and a picture that was not modified are not decoded.
+        decoded = image.bytes is not None
+        start_time = default_timer()
+        try:
+            entry = count_content(image, response, cached, options.preview_scale)
+        finally:
+            image.bytes = None
+        if decoded:
+            decode_times.append(default_timer() - start_time)
+        plan.complete(index, entry)
+    plan.finish()
+
+    if not download_times or not decode_times:
+        return DEFAULT_CALIBRATION
+
+    return Calibration(
+        download_seconds=sum(download_times) / len(download_times),
+        decode_seconds=sum(decode_times) / len(decode_times),
+        measured_at=time(),
+    )
+
+
+def estimate_durations(
+    n_images: int, calibration: Calibration, n_cores: int
+) -> Dict[str, tuple[float, RunOptions]]:
+    """Estimate the duration of each execution mode for a workload.
+
+    Args:
+        n_images (int): Number of images to process.
+        calibration (Calibration): Measured costs of a single image.
+        n_cores (int): Number of available CPU cores.
+
+    Returns:
+        The estimated duration in seconds and the concurrency levels for each mode.
+    """
+    download = calibration.download_seconds
+    decode = calibration.decode_seconds
+    async_io = min(n_images, MAX_ASYNC_DOWNLOADS)
+    thread_io = min(n_images, MAX_DOWNLOAD_THREADS)
+    processes = max(1, min(n_images, n_cores - 1))
+
+    return {
+        "sync": (n_images * (download + decode), RunOptions()),
+        "async": (
+            math.ceil(n_images / async_io) * download + n_images * decode,
+            RunOptions(io_workers=async_io),
+        ),
+        "threading": (
+            math.ceil(n_images / thread_io) * download + math.ceil(n_images / n_cores) * decode,
+            RunOptions(io_workers=thread_io, cpu_workers=n_cores),
+        ),
+        "multiprocessing": (
+            POOL_STARTUP_SECONDS + math.ceil(n_images / processes) * (download + decode),
+            RunOptions(cpu_workers=processes),
+        ),
+    }
+
+
+def choose_strategy(
+    n_images: int, calibration: Calibration, n_cores: int, options: RunOptions = RunOptions()
+) -> Strategy:
+    """Choose the execution mode with the lowest estimated duration.
+
+    Args:
+        n_images (int): Number of images to process.
+        calibration (Calibration): Measured costs of a single image.
+        n_cores (int): Number of available CPU cores.
+        options (RunOptions): Options of the run. Its ``io_workers`` and ``cpu_workers``
+            override the chosen ones when set.
+
+    Returns:
+        The chosen execution mode, the run options with its concurrency levels and the reason
+        of the choice.
+    """
+    estimates = estimate_durations(n_images, calibration, n_cores)
+    mode = min(estimates, key=lambda name: estimates[name][0])
+    _, estimated = estimates[mode]
+    options = replace(
+        options,
+        io_workers=options.io_workers or estimated.io_workers,
+        cpu_workers=options.cpu_workers or estimated.cpu_workers,
+    )
+    summary = ", ".join(f"{name} {value[0]:.2f}s" for name, value in estimates.items())
+    reason = (
+        f"Chose {mode} mode for {n_images} images (io_workers={options.io_workers},"
+        f" cpu_workers={options.cpu_workers}): download takes"
+        f" {calibration.download_seconds:.2f}s and decode {calibration.decode_seconds:.2f}s per"
+        f" image on {n_cores} cores. Estimates: {summary}."
+    )
+    return Strategy(mode=mode, options=options, reason=reason)
+
+
+def run_strategy(
+    strategy: Strategy,
+    api_url: str,
+    start_date: str,
+    end_date: str,
+    images: List[NasaImage] | None = None,
+):
+    """Run an execution mode over a date range.
+
+    Args:
+        strategy (Strategy): The execution mode to run.
+        api_url (str): URL of the image metadata API endpoint.
+        start_date (str): Start date of the date range.
+        end_date (str): End date of the date range.
+        images (List[NasaImage] | None): Pictures of the date range, handed to the execution
+            mode so it does not fetch their metadata again. The metadata is fetched if None.
+    """
+    kwargs = dict(
+        api_url=api_url,
+        start_date=start_date,
+        end_date=end_date,
+        options=strategy.options,
+        images=images,
+    )
+    match strategy.mode:  # noqa: E999
+        case "sync":
+            main_sync(**kwargs)
+        case "async":
+            asyncio.run(main_async(**kwargs))
+        case "threading":
+            main_thread(**kwargs)
+        case "multiprocessing":
+            main_processing(**kwargs)
+
+
+def main(api_url: str, start_date: str, end_date: str, options: RunOptions = RunOptions()):
+    """Calibrate, choose the fastest execution mode and process the images in a date range.
+
+    When no recent calibration data is saved, the first images of the range are processed in
+    sync mode to measure the costs, and the rest of the range is handed to the chosen mode.
+
+    Args:
+        api_url (str): URL of the image metadata API endpoint.
+        start_date (str): Start date of the date range.
+        end_date (str): End date of the date range.
+        options (RunOptions): Concurrency levels that override the chosen ones when set.
+    """
+    url = f"{api_url}&start_date={start_date}&end_date={end_date}"
+    data = get_metadata(url, metadata_cache(options.cache_dir))
+    if not data:
+        print("An error ocurred retrieving the pictures metadata.")
+        return
+
+    images = process_metadata(data)
+    path = get_calibration_path()
+    calibration = load_calibration(path)
+    if calibration is None:
+        sample, images = images[:CALIBRATION_SAMPLES], images[CALIBRATION_SAMPLES:]
+        calibration = calibrate(sample, options)
+        if calibration is not DEFAULT_CALIBRATION:
+            save_calibration(path, calibration)
+        logger.info(f"Calibrated with {len(sample)} images: {calibration}")
+    else:
+        logger.info(f"Using saved calibration from {path}: {calibration}")
+
+    if not images:
+        return
+
+    strategy = choose_strategy(len(images), calibration, cpu_count(), options)
+    logger.info(strategy.reason)
+    run_strategy(strategy, api_url, images[0].date, end_date, images)
@@ -0,0 +1,585 @@
+"""Includes the micro-benchmarks of the decode and count hot path.
+
+The benchmarks run over a corpus of generated pictures in the RGB, RGBA, palette and grayscale
+modes, at several sizes and color entropies, encoded as PNG and, for the modes JPEG supports,
+as JPEG. Each picture is decoded and then counted by every counting engine, and the two stages
+are timed apart. A separate traced run of each stage records its ``tracemalloc`` peak, so the
+tracing overhead does not skew the timings. Pillow allocates its pixel buffers outside the
+Python allocator, so the peaks cover the Python and NumPy allocations of each stage, and the
+same run counts the blocks of pixels the stage takes from Pillow's allocator.
+
+The results are compared with a baseline saved by a previous run on the same machine: a stage
+that got slower, allocates more or takes more pixel blocks than the tolerance allows is flagged
+as a regression, and so is a count that changed. Every engine, and the decode and count path
+of every mode, must return the same count for a picture.
+
+Run ``python -m benchmarks.main --save`` to store a baseline and ``python -m benchmarks.main``
+to compare with it. The command exits with status 1 when it finds a regression or a
+disagreement.
+"""
+
+import io
+import json
+import logging
+import os
+import sys
+import tracemalloc
+from contextlib import redirect_stdout
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import click
+import numpy as np
+from log.logging import setup_logger
+from PIL import Image
+
+from async_mode.main import process_image as process_image_async
+from colors import count_colors, count_colors_array, count_colors_fast, decode_image
+from counter import count_bytes
+from image import NasaImage
+from multiprocessing_mode.main import process_image as process_image_processes
+from sync_mode.main import process_image as process_image_sync
+from thread_mode.main import process_image as process_image_threads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (256, 1024)
+DEFAULT_MODES = ("RGB", "RGBA", "P", "L")
+ENTROPIES: Dict[str, int | None] = {"low": 16, "medium": 4096, "high": None}
+JPEG_MODES = {"RGB", "L"}
+BANDS = {"RGB": 3, "RGBA": 4, "P": 1, "L": 1}
+BLOCK_SIZE = 8
+SEED = 0
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MEMORY_TOLERANCE = 0.1
+TIME_SLACK = 0.001
+MEMORY_SLACK = 64 * 1024
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DECODE = "decode"
+
+
+class CorpusImage(NamedTuple):
+    """Generated picture of the benchmark corpus.
+
+    Attributes:
+        name: Name of the picture, made of its mode, size, entropy and format.
+        mode: Pillow mode of the picture.
+        size: Width and height of the picture.
+        entropy: Color entropy of the picture, one of ``low``, ``medium`` or ``high``.
+        format: Format the picture is encoded in, ``PNG`` or ``JPEG``.
+        data: Encoded picture.
+    """
+
+    name: str
+    mode: str
+    size: int
+    entropy: str
+    format: str
+    data: bytes
+
+    @property
+    def megapixels(self) -> float:
+        """Get the number of pixels of the picture.
+
+        Returns:
+            The number of pixels, in millions.
+        """
+        return self.size * self.size / 1e6
+
+
+class Measurement(NamedTuple):
+    """Cost of a stage of the hot path over a picture.
+
+    Attributes:
+        case: Name of the picture.
+        stage: Name of the stage, ``decode`` or ``count/`` followed by the counting engine.
+        seconds: Best duration of the stage over the repetitions.
+        peak: Peak of the memory traced while the stage ran, in bytes.
+        megapixels: Number of pixels of the picture, in millions.
+        colors: Number of unique colors counted by the stage, or None for the decode stage.
+        blocks: Number of blocks of pixels taken from Pillow's allocator while the stage ran.
+    """
+
+    case: str
+    stage: str
+    seconds: float
+    peak: int
+    megapixels: float
+    colors: int | None = None
+    blocks: int = 0
+
+    @property
+    def key(self) -> str:
+        """Get the key of the measurement in a baseline.
+
+        Returns:
+            The case and stage of the measurement.
+        """
+        return f"{self.case}/{self.stage}"
+
+    @property
+    def throughput(self) -> float:
+        """Get the throughput of the stage.
+
+        Returns:
+            The number of megapixels processed per second.
+        """
+        return self.megapixels / self.seconds if self.seconds else float("inf")
+
+
+def count_with_getcolors(img: Image.Image) -> int:
+    """Count the unique colors of an image with ``Image.getcolors``.
+
+    Args:
+        img (Image.Image): A decoded image.
+
+    Returns:
+        The number of unique colors.
+    """
+    return len(img.getcolors(img.width * img.height))  # type: ignore
+
+
+def count_with_set(img: Image.Image) -> int:
+    """Count the unique colors of an image with a set of its pixels, the general engine.
+
+    Args:
+        img (Image.Image): A decoded image.
+
+    Returns:
+        The number of unique colors.
+    """
+    return len(set(img.getdata()))
+
+
+COUNTERS: Dict[str, Callable[[Image.Image], int | None]] = {
+    "engine": count_colors,
+    "fast": count_colors_fast,
+    "array": count_colors_array,
+    "getcolors": count_with_getcolors,
+    "set": count_with_set,
+}
+
+MODE_COUNTERS: Dict[str, Callable[[NasaImage], int | None]] = {
+    "sync": process_image_sync,
+    "async": process_image_async,
+    "threading": process_image_threads,
+    "multiprocessing": process_image_processes,
+}
+
+
+def generate_image(mode: str, size: int, entropy: str, rng: np.random.Generator) -> Image.Image:
+    """Generate the pixels of a picture.
+
+    Low and medium entropy pictures are made of blocks of colors drawn from a small set, like
+    the flat areas of a picture, while high entropy pictures are random noise.
+
+    Args:
+        mode (str): Pillow mode of the picture, one of ``RGB``, ``RGBA``, ``P`` or ``L``.
+        size (int): Width and height of the picture.
+        entropy (str): Color entropy, one of ``low``, ``medium`` or ``high``.
+        rng (np.random.Generator): Source of the random pixels.
+
+    Returns:
+        The picture.
+    """
+    bands = BANDS[mode]
+    colors = ENTROPIES[entropy]
+    if colors is None:
+        pixels = rng.integers(0, 256, (size, size, bands), dtype=np.uint8)
+    else:
+        blocks = -(-size // BLOCK_SIZE)
+        palette = rng.integers(0, 256, (colors, bands), dtype=np.uint8)
+        indexes = rng.integers(0, colors, (blocks, blocks))
+        indexes = indexes.repeat(BLOCK_SIZE, axis=0).repeat(BLOCK_SIZE, axis=1)[:size, :size]
+        pixels = palette[indexes]
+
+    img = Image.frombytes(mode, (size, size), pixels.tobytes())
+    if mode == "P":
+        img.putpalette(rng.integers(0, 256, 768, dtype=np.uint8).tobytes())
+    return img
+
+
+def generate_corpus(
+    sizes: Tuple[int, ...] = DEFAULT_SIZES,
+    modes: Tuple[str, ...] = DEFAULT_MODES,
+    entropies: Tuple[str, ...] = tuple(ENTROPIES),
+    seed: int = SEED,
+) -> List[CorpusImage]:
+    """Generate the corpus of the benchmarks.
+
+    The corpus only depends on its parameters, so the pictures of two runs are the same.
+
+    Args:
+        sizes (Tuple[int, ...]): Widths and heights of the pictures.
+        modes (Tuple[str, ...]): Pillow modes of the pictures.
+        entropies (Tuple[str, ...]): Color entropies of the pictures.
+        seed (int): Seed of the random pixels.
+
+    Returns:
+        A picture for each combination of the parameters, as PNG and, for the RGB and grayscale
+        modes, as JPEG too.
+    """
+    corpus = []
+    for mode in modes:
+        for size in sizes:
+            for entropy in entropies:
+                rng = np.random.default_rng([seed, DEFAULT_MODES.index(mode), size, len(entropy)])
+                img = generate_image(mode, size, entropy, rng)
+                formats = ("PNG", "JPEG") if mode in JPEG_MODES else ("PNG",)
+                for image_format in formats:
+                    buffer = io.BytesIO()
+                    img.save(buffer, image_format)
+                    name = f"{mode}-{size}-{entropy}-{image_format}".lower()
+                    corpus.append(
+                        CorpusImage(name, mode, size, entropy, image_format, buffer.getvalue())
+                    )
+    return corpus
+
+
+def get_pillow_blocks() -> int:
+    """Get the number of blocks of pixels Pillow's allocator has handed out.
+
+    Returns:
+        The number of blocks allocated or reused since the statistics were last reset.
+    """
+    stats = Image.core.get_stats()
+    return stats["allocated_blocks"] + stats["reused_blocks"]
+
+
+def measure(func: Callable[[], Any], repeat: int = DEFAULT_REPEAT) -> Tuple[float, int, int, Any]:
+    """Measure the duration and the memory used by a function.
+
+    Args:
+        func (Callable[[], Any]): The function.
+        repeat (int): Number of timed runs.
+
+    Returns:
+        The best duration of the timed runs in seconds, the peak of the memory traced during
+        another run in bytes, the number of Pillow blocks of pixels taken during that run, and
+        the value of the function.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        value = func()
+        timings.append(perf_counter() - start)
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_memory, _ = tracemalloc.get_traced_memory()
+    start_blocks = get_pillow_blocks()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    blocks = get_pillow_blocks() - start_blocks
+    return min(timings), max(0, peak - start_memory), blocks, value
+
+
+def benchmark_image(image: CorpusImage, repeat: int = DEFAULT_REPEAT) -> List[Measurement]:
+    """Measure the decode stage of a picture and its count by every counting engine.
+
+    Args:
+        image (CorpusImage): A picture of the corpus.
+        repeat (int): Number of timed runs of each stage.
+
+    Returns:
+        The measurement of each stage. The engines that do not support the mode of the picture
+        are left out.
+    """
+    seconds, peak, blocks, img = measure(lambda: decode_image(io.BytesIO(image.data)), repeat)
+    measurements = [Measurement(image.name, DECODE, seconds, peak, image.megapixels, blocks=blocks)]
+    for name, counter in COUNTERS.items():
+        if counter(img) is None:
+            continue
+        seconds, peak, blocks, colors = measure(lambda: counter(img), repeat)  # noqa: B023
+        measurements.append(
+            Measurement(
+                image.name, f"count/{name}", seconds, peak, image.megapixels, colors, blocks
+            )
+        )
+    return measurements
+
+
+def count_modes(image: CorpusImage) -> Dict[str, int | None]:
+    """Count the colors of a picture with the decode and count path of every mode.
+
+    Args:
+        image (CorpusImage): A picture of the corpus.
+
+    Returns:
+        The number of unique colors counted by each mode.
+    """
+    counts: Dict[str, int | None] = {"counter": count_bytes(image.data)}
+    with redirect_stdout(io.StringIO()):
+        for name, process_image in MODE_COUNTERS.items():
+            picture = NasaImage("", "image", image.name, "")
+            picture.bytes = io.BytesIO(image.data)
+            counts[name] = process_image(picture)
+    return counts
+
+
+def find_disagreements(counts: Dict[str, Dict[str, int | None]]) -> List[str]:
+    """Find the pictures whose colors are not counted the same by every implementation.
+
+    Args:
+        counts (Dict[str, Dict[str, int | None]]): Number of unique colors of each picture,
+            by implementation.
+
+    Returns:
+        A message for each picture whose counts differ.
+    """
+    messages = []
+    for case, implementations in counts.items():
+        if len(set(implementations.values())) > 1:
+            detail = ", ".join(f"{name}={colors}" for name, colors in implementations.items())
+            messages.append(f"{case}: the implementations disagree ({detail})")
+    return messages
+
+
+def run_benchmarks(
+    corpus: List[CorpusImage], repeat: int = DEFAULT_REPEAT
+) -> Tuple[List[Measurement], List[str]]:
+    """Benchmark the hot path over a corpus and check that the implementations agree.
+
+    Args:
+        corpus (List[CorpusImage]): The pictures to benchmark.
+        repeat (int): Number of timed runs of each stage.
+
+    Returns:
+        The measurements of every picture and stage, and a message for each picture whose
+        counts differ.
+    """
+    measurements = []
+    counts: Dict[str, Dict[str, int | None]] = {}
+    for image in corpus:
+        image_measurements = benchmark_image(image, repeat)
+        measurements.extend(image_measurements)
+        counts[image.name] = {
+            measurement.stage: measurement.colors
+            for measurement in image_measurements
+            if measurement.stage != DECODE
+        }
+        counts[image.name].update(count_modes(image))
+    return measurements, find_disagreements(counts)
+
+
+def save_baseline(path: str, measurements: List[Measurement]):
+    """Save measurements as the baseline of the next runs.
+
+    Args:
+        path (str): Path of the baseline file.
+        measurements (List[Measurement]): The measurements.
+    """
+    baseline = {
+        measurement.key: {
+            "seconds": measurement.seconds,
+            "peak": measurement.peak,
+            "blocks": measurement.blocks,
+            "colors": measurement.colors,
+        }
+        for measurement in measurements
+    }
+    with open(path, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+
+
+def load_baseline(path: str) -> Dict[str, Dict] | None:
+    """Load the baseline saved by a previous run.
+
+    Args:
+        path (str): Path of the baseline file.
+
+    Returns:
+        The baseline of each picture and stage, or None if there is no valid baseline.
+    """
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except (OSError, ValueError):
+        return None
+
+
+def compare(
+    measurements: List[Measurement],
+    baseline: Dict[str, Dict],
+    tolerance: float = DEFAULT_TOLERANCE,
+    memory_tolerance: float = DEFAULT_MEMORY_TOLERANCE,
+) -> List[str]:
+    """Compare measurements with a baseline.
+
+    The stages missing from the baseline are not compared, and neither are the Pillow blocks of
+    a baseline saved before they were counted.
+
+    Args:
+        measurements (List[Measurement]): The measurements.
+        baseline (Dict[str, Dict]): The baseline of each picture and stage.
+        tolerance (float): Fraction of the baseline duration a stage may take on top of it.
+            Slowdowns below a millisecond are ignored as noise.
+        memory_tolerance (float): Fraction of the baseline peak a stage may allocate, and of
+            the baseline Pillow blocks it may take, on top of them. Peak increases below 64 KiB
+            are ignored as noise.
+
+    Returns:
+        A message for each regression.
+    """
+    regressions = []
+    for measurement in measurements:
+        expected = baseline.get(measurement.key)
+        if expected is None:
+            continue
+
+        if measurement.colors != expected["colors"]:
+            regressions.append(
+                f"{measurement.key}: counted {measurement.colors} colors instead of "
+                f"{expected['colors']}"
+            )
+        if measurement.seconds > expected["seconds"] * (1 + tolerance) + TIME_SLACK:
+            slowdown = measurement.seconds / expected["seconds"] - 1
+            regressions.append(
+                f"{measurement.key}: {slowdown:.0%} slower, {measurement.seconds * 1000:.2f} ms "
+                f"instead of {expected['seconds'] * 1000:.2f} ms"
+            )
+        if measurement.peak > expected["peak"] * (1 + memory_tolerance) + MEMORY_SLACK:
+            regressions.append(
+                f"{measurement.key}: allocates {measurement.peak // 1024} KiB instead of "
+                f"{expected['peak'] // 1024} KiB"
+            )
+        expected_blocks = expected.get("blocks")
+        if expected_blocks is not None and measurement.blocks > expected_blocks * (
+            1 + memory_tolerance
+        ):
+            regressions.append(
+                f"{measurement.key}: takes {measurement.blocks} Pillow blocks instead of "
+                f"{expected_blocks}"
+            )
+    return regressions
+
+
+def format_report(measurements: List[Measurement]) -> str:
+    """Build a table of measurements.
+
+    Args:
+        measurements (List[Measurement]): The measurements.
+
+    Returns:
+        A line per measurement with its duration, throughput, memory peak, Pillow blocks and
+        count.
+    """
+    lines = [
+        f"{'case':<24} {'stage':<16} {'ms':>9} {'MP/s':>9} {'peak KiB':>9} {'blocks':>6} "
+        f"{'colors':>8}"
+    ]
+    for measurement in measurements:
+        colors = "" if measurement.colors is None else measurement.colors
+        lines.append(
+            f"{measurement.case:<24} {measurement.stage:<16} {measurement.seconds * 1000:>9.2f} "
+            f"{measurement.throughput:>9.1f} {measurement.peak // 1024:>9} "
+            f"{measurement.blocks:>6} {colors:>8}"
+        )
+    return "\n".join(lines)
+
+
+@click.command()
+@click.option(
+    "--baseline",
+    "baseline_path",
+    type=click.Path(dir_okay=False),
+    default=DEFAULT_BASELINE,
+    help="File of the baseline the results are compared with.",
+)
+@click.option("--save", "save", is_flag=True, default=False, help="Save the results as baseline.")
+@click.option(
+    "--size",
+    "sizes",
+    type=click.IntRange(min=1),
+    multiple=True,
+    default=DEFAULT_SIZES,
+    help="Width and height of the generated pictures, can be repeated.",
+)
+@click.option(
+    "--mode",
+    "modes",
+    type=click.Choice(DEFAULT_MODES),
+    multiple=True,
+    default=DEFAULT_MODES,
+    help="Mode of the generated pictures, can be repeated.",
+)
+@click.option(
+    "--repeat",
+    "repeat",
+    type=click.IntRange(min=1),
+    default=DEFAULT_REPEAT,
+    help="Number of timed runs of each stage, the best one is kept.",
+)
+@click.option(
+    "--tolerance",
+    "tolerance",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_TOLERANCE,
+    help="Slowdown over the baseline flagged as a regression, as a fraction.",
+)
+@click.option(
+    "--memory_tolerance",
+    "memory_tolerance",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_MEMORY_TOLERANCE,
+    help="Memory peak and Pillow blocks increase over the baseline flagged as a regression, as "
+    "a fraction.",
+)
+def command(
+    baseline_path: str,
+    save: bool,
+    sizes: Tuple[int, ...],
+    modes: Tuple[str, ...],
+    repeat: int,
+    tolerance: float,
+    memory_tolerance: float,
+):
+    """Benchmark the decode and count hot path.
+
+    Args:
+        baseline_path: File of the baseline.
+        save: Whether the results are saved as the baseline instead of compared with it.
+        sizes: Widths and heights of the generated pictures.
+        modes: Modes of the generated pictures.
+        repeat: Number of timed runs of each stage.
+        tolerance: Slowdown flagged as a regression.
+        memory_tolerance: Memory peak increase flagged as a regression.
+    """
+    setup_logger()
+    corpus = generate_corpus(tuple(sizes), tuple(modes))
+    logger.info(f"Benchmarking {len(corpus)} pictures, best of {repeat} runs")
+
+    measurements, disagreements = run_benchmarks(corpus, repeat)
+    logger.info(f"Results:\n{format_report(measurements)}")
+    for message in disagreements:
+        logger.error(message)
+    if disagreements:
+        sys.exit(1)
+
+    if save:
+        save_baseline(baseline_path, measurements)
+        logger.info(f"Baseline written to {baseline_path}")
+        return
+
+    baseline = load_baseline(baseline_path)
+    if baseline is None:
+        logger.warning(f"No baseline in {baseline_path}, run with --save to write one.")
+        return
+
+    regressions = compare(measurements, baseline, tolerance, memory_tolerance)
+    for message in regressions:
+        logger.warning(message)
+    if regressions:
+        sys.exit(1)
+    logger.info("No regression against the baseline.")
+
+
+if __name__ == "__main__":
+    command()
@@ -0,0 +1,275 @@
+"""Includes the objects for caching the color counts of NASA's APOD.
+
+The entries keep the ``ETag`` and ``Last-Modified`` validators of the responses they were made
+from, so a cached picture or metadata response can be revalidated with a conditional request.
+A ``304 Not Modified`` answer reuses the cached entry instead of downloading it again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, Mapping, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+NOT_MODIFIED = 304
+DEFAULT_REVALIDATE_DAYS = 7
+
+
+class Validators(NamedTuple):
+    """Validators of a response, sent back to the server to revalidate its cached content."""
+
+    etag: str | None = None
+    last_modified: str | None = None
+
+    @classmethod
+    def from_headers(cls, headers: Mapping[str, str]) -> "Validators":
+        """Read the validators of a response.
+
+        Args:
+            headers (Mapping[str, str]): Case-insensitive headers of the response.
+
+        Returns:
+            The ``ETag`` and ``Last-Modified`` headers, or None for the missing ones.
+        """
+        return cls(headers.get("ETag"), headers.get("Last-Modified"))
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Build the headers of a conditional request.
+
+        Returns:
+            The ``If-None-Match`` and ``If-Modified-Since`` headers of the known validators.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def update(self, headers: Mapping[str, str]) -> "Validators":
+        """Update the validators with the headers of a ``304 Not Modified`` response.
+
+        Args:
+            headers (Mapping[str, str]): Case-insensitive headers of the response.
+
+        Returns:
+            The validators of the response, keeping the current ones it does not repeat.
+        """
+        etag, last_modified = Validators.from_headers(headers)
+        return Validators(etag or self.etag, last_modified or self.last_modified)
+
+
+class CacheEntry(NamedTuple):
+    """Color count of a picture and the validators of the response it was counted from."""
+
+    colors: int
+    validators: Validators = Validators()
+
+    @classmethod
+    def from_response(cls, colors: int | None, headers: Mapping[str, str]) -> "CacheEntry | None":
+        """Build the entry of a picture counted from a response.
+
+        Args:
+            colors (int | None): Number of unique colors of the picture.
+            headers (Mapping[str, str]): Case-insensitive headers of the response.
+
+        Returns:
+            The entry, or None if the picture could not be counted.
+        """
+        if colors is None:
+            return None
+        return cls(colors, Validators.from_headers(headers))
+
+    def revalidated(self, headers: Mapping[str, str]) -> "CacheEntry":
+        """Reuse the entry after a ``304 Not Modified`` response.
+
+        Args:
+            headers (Mapping[str, str]): Case-insensitive headers of the response.
+
+        Returns:
+            The entry with the validators of the response.
+        """
+        return CacheEntry(self.colors, self.validators.update(headers))
+
+
+class ResultCache:
+    """Thread-safe cache of color counts keyed by image URL.
+
+    Entries are kept in memory and, when a directory is given, also written to one JSON file per
+    URL so they survive across processes and runs. Entries written before the validators were
+    kept are read without them.
+    """
+
+    def __init__(self, directory: str | None = None):
+        """Initialize the cache.
+
+        Args:
+            directory (str | None): Directory where the entries are persisted. In-memory only if
+                None.
+        """
+        self.directory = os.path.expanduser(directory) if directory else None
+        self._entries: Dict[str, CacheEntry] = {}
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")  # type: ignore
+
+    def get(self, url: str) -> int | None:
+        """Get the color count of an image.
+
+        Args:
+            url (str): URL of the image.
+
+        Returns:
+            The cached number of colors, or None if the image is not cached.
+        """
+        entry = self.get_entry(url)
+        return None if entry is None else entry.colors
+
+    def get_entry(self, url: str) -> CacheEntry | None:
+        """Get the color count of an image with the validators of its response.
+
+        Args:
+            url (str): URL of the image.
+
+        Returns:
+            The cached entry, or None if the image is not cached.
+        """
+        with self._lock:
+            if url in self._entries:
+                return self._entries[url]
+
+        if not self.directory:
+            return None
+
+        try:
+            with open(self._path(url)) as entry_file:
+                data = json.load(entry_file)
+            entry = CacheEntry(
+                data["colors"], Validators(data.get("etag"), data.get("last_modified"))
+            )
+        except (OSError, ValueError, KeyError):
+            return None
+
+        with self._lock:
+            self._entries[url] = entry
+        return entry
+
+    def __contains__(self, url: str) -> bool:
+        """Check whether an image is cached.
+
+        Args:
+            url (str): URL of the image.
+
+        Returns:
+            True if the image is cached otherwise False.
+        """
+        return self.get(url) is not None
+
+    def set(self, url: str, colors: int, validators: Validators = Validators()):
+        """Store the color count of an image.
+
+        Args:
+            url (str): URL of the image.
+            colors (int): Number of unique colors.
+            validators (Validators): Validators of the response the image was counted from.
+        """
+        with self._lock:
+            self._entries[url] = CacheEntry(colors, validators)
+
+        if not self.directory:
+            return
+
+        data = {"url": url, "colors": colors, **validators._asdict()}
+        try:
+            with open(self._path(url), "w") as entry_file:
+                json.dump(data, entry_file)
+        except OSError as error:
+            logger.warning(f"Cannot write the cache entry for {url}: {error}")
+
+
+class CachedResponse(NamedTuple):
+    """Body of a response and its validators."""
+
+    body: bytes
+    validators: Validators
+
+
+class ResponseCache:
+    """Thread-safe cache of response bodies keyed by request URL, such as metadata responses.
+
+    Only the responses with validators are worth keeping, since they are requested again on
+    every run and only a conditional request can skip their download. Each entry is written to
+    a directory as a body file and a JSON file with its validators. The files are named after
+    a digest of the URL, which is not stored since it holds the API key.
+    """
+
+    def __init__(self, directory: str):
+        """Initialize the cache.
+
+        Args:
+            directory (str): Directory where the entries are persisted.
+        """
+        self.directory = os.path.expanduser(directory)
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, url: str, extension: str) -> str:
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}{extension}")
+
+    def get(self, url: str) -> CachedResponse | None:
+        """Get the cached response of a request.
+
+        Args:
+            url (str): URL of the request.
+
+        Returns:
+            The cached body and validators, or None if the response is not cached.
+        """
+        with self._lock:
+            try:
+                with open(self._path(url, ".json")) as validators_file:
+                    validators = Validators(**json.load(validators_file))
+                with open(self._path(url, ".body"), "rb") as body_file:
+                    return CachedResponse(body_file.read(), validators)
+            except (OSError, ValueError, TypeError):
+                return None
+
+    def set(self, url: str, body: bytes, validators: Validators):
+        """Store the response of a request, if it has validators.
+
+        Args:
+            url (str): URL of the request.
+            body (bytes): Body of the response.
+            validators (Validators): Validators of the response.
+        """
+        if not validators.conditional_headers():
+            return
+
+        with self._lock:
+            try:
+                with open(self._path(url, ".body"), "wb") as body_file:
+                    body_file.write(body)
+                with open(self._path(url, ".json"), "w") as validators_file:
+                    json.dump(validators._asdict(), validators_file)
+            except OSError as error:
+                logger.warning(f"Cannot write the cached response: {error}")
+
+
+def metadata_cache(cache_dir: str | None) -> ResponseCache | None:
+    """Open the cache of the metadata responses kept in a cache directory.
+
+    Args:
+        cache_dir (str | None): Directory of the cache, or None.
+
+    Returns:
+        The cache, in a ``metadata`` subdirectory, or None if there is no cache directory.
+    """
+    return ResponseCache(os.path.join(cache_dir, "metadata")) if cache_dir else None
@@ -0,0 +1,161 @@
+"""Includes the functions for counting the colors of an image without expanding its pixels.
+
+Palette, grayscale and 16-bit images have a bounded number of possible colors, so Pillow can
+count them in C with ``Image.histogram`` or ``Image.getcolors`` instead of building a Python
+tuple for every pixel. Images with three or four 8-bit bands are counted with NumPy over the raw
+pixel buffer; its array operations release the GIL, so several threads can count at once.
+
+Images can also be decoded at a reduced preview scale, which trades precision for speed: the
+counts of a preview are lower than the counts of the full picture and are only comparable with
+counts taken at the same scale.
+"""
+
+from typing import BinaryIO
+
+import numpy as np
+from PIL import Image
+
+HISTOGRAM_MODES = {"1", "L", "P"}
+GETCOLORS_MODES = {"LA", "La", "PA"}
+SIXTEEN_BIT_MODES = {"I;16", "I;16B", "I;16L", "I;16N"}
+MAX_SIXTEEN_BIT_COLORS = 1 << 16
+THREE_BAND_MODES = {"RGB", "YCbCr", "LAB", "HSV"}
+FOUR_BAND_MODES = {"RGBA", "RGBa", "RGBX", "CMYK"}
+REDUCIBLE_MODES = THREE_BAND_MODES | FOUR_BAND_MODES | {"L", "LA"}
+PREVIEW_SCALES = (1, 2, 4, 8)
+COLOR_TABLE_PIXELS = 1 << 22
+
+
+def count_colors_fast(img: Image.Image) -> int | None:
+    """Count the unique colors of an image using the fast path of its mode.
+
+    Args:
+        img (Image.Image): A decoded image.
+
+    Returns:
+        The number of unique colors, or None if the mode has no fast path and the pixels must
+        be counted by the general engine.
+    """
+    mode = img.mode
+    if mode in HISTOGRAM_MODES:
+        return sum(1 for count in img.histogram() if count)
+
+    if mode in GETCOLORS_MODES:
+        return len(img.getcolors(MAX_SIXTEEN_BIT_COLORS))  # type: ignore
+
+    if mode in SIXTEEN_BIT_MODES:
+        return len(img.convert("I").getcolors(MAX_SIXTEEN_BIT_COLORS))  # type: ignore
+
+    return None
+
+
+def count_colors_array(img: Image.Image) -> int | None:
+    """Count the unique colors of an image with three or four 8-bit bands using NumPy.
+
+    Three-band pixels are packed into 24-bit integers and four-band pixels are read as 32-bit
+    integers. The pixels are sorted and compared with their neighbours, except the three-band
+    pixels of images of at least ``COLOR_TABLE_PIXELS`` pixels, which are marked in a 16 MiB
+    table of every possible color: the table costs as much memory as sorting that many pixels
+    and takes a single pass.
+
+    Args:
+        img (Image.Image): A decoded image.
+
+    Returns:
+        The number of unique colors, or None if the mode is not supported.
+    """
+    mode = img.mode
+    if mode in THREE_BAND_MODES:
+        channels = np.frombuffer(img.tobytes(), dtype=np.uint8).reshape(-1, 3)
+        packed = channels[:, 0].astype(np.uint32) << 16
+        packed |= channels[:, 1].astype(np.uint32) << 8
+        packed |= channels[:, 2]
+        if packed.size < COLOR_TABLE_PIXELS:
+            packed.sort()
+            return _count_sorted(packed)
+        seen = np.zeros(1 << 24, dtype=np.bool_)
+        seen[packed] = True
+        return int(np.count_nonzero(seen))
+
+    if mode in FOUR_BAND_MODES:
+        return _count_sorted(np.sort(np.frombuffer(img.tobytes(), dtype=np.uint32)))
+
+    return None
+
+
+def _count_sorted(pixels: np.ndarray) -> int:
+    if not pixels.size:
+        return 0
+    return int(np.count_nonzero(pixels[1:] != pixels[:-1])) + 1
+
+
+def count_colors(img: Image.Image) -> int | None:
+    """Count the unique colors of an image with the fastest engine for its mode.
+
+    Args:
+        img (Image.Image): A decoded image.
+
+    Returns:
+        The number of unique colors, or None if the pixels must be counted by the general
+        engine.
+    """
+    count = count_colors_fast(img)
+    if count is None:
+        count = count_colors_array(img)
+    return count
+
+
+def decode_image(buffer: BinaryIO, preview_scale: int = 1) -> Image.Image:
+    """Decode an image, optionally at a reduced preview scale.
+
+    JPEG pictures are decoded straight at 1/2, 1/4 or 1/8 of their size with ``Image.draft``,
+    which skips most of the IDCT work. Other pictures are decoded at full size and shrunk with
+    ``Image.reduce``, except palette, bilevel and 16-bit ones, which are cheap to count anyway.
+
+    Args:
+        buffer (BinaryIO): Binary content of the image.
+        preview_scale (int): Divisor of the width and height of the decoded image, one of 1, 2,
+            4 or 8.
+
+    Returns:
+        The decoded image.
+
+    Raises:
+        ValueError: If the preview scale is not supported.
+    """
+    if preview_scale not in PREVIEW_SCALES:
+        raise ValueError(f"Unsupported preview scale {preview_scale}, use one of {PREVIEW_SCALES}")
+
+    img = Image.open(buffer)
+    if preview_scale == 1:
+        img.load()
+        return img
+
+    width = img.width
+    if img.format == "JPEG":
+        img.draft(None, (max(width // preview_scale, 1), max(img.height // preview_scale, 1)))
+    img.load()
+
+    # The draft sizes are rounded up, so 1001 pixels at 1/2 are 501.
+    reached = max(round(width / max(img.width, 1)), 1)
+    remaining = preview_scale // reached
+    if remaining > 1 and img.mode in REDUCIBLE_MODES:
+        img = img.reduce(remaining)
+    return img
+
+
+def count_image_colors(buffer: BinaryIO, preview_scale: int = 1) -> int:
+    """Decode an image and count its unique colors.
+
+    Args:
+        buffer (BinaryIO): Binary content of the image.
+        preview_scale (int): Divisor of the width and height of the decoded image.
+
+    Returns:
+        The number of unique colors.
+    """
+    img = decode_image(buffer, preview_scale)
+    count = count_colors(img)
+    if count is None:
+        count = len(set(img.getdata()))
+    return count
@@ -0,0 +1,513 @@
+"""Includes the objects for counting the colors of NASA's APOD from other applications.
+
+The counters own their HTTP session, their process pool and their cache, and keep them warm
+across calls, so embedding applications do not pay the setup cost of the execution modes on
+every call.
+"""
+
+import asyncio
+import io
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, as_completed
+from contextlib import closing
+from datetime import date, timedelta
+from functools import partial
+from multiprocessing import cpu_count
+from typing import AsyncIterator, Dict, Iterator, List, Tuple
+
+import requests
+from aiohttp import ClientSession
+
+from cache import ResultCache
+from colors import count_image_colors
+from image import CHUNK_SIZE, BodyBuffer, NasaImage
+from metadata import parse_images
+from options import RunOptions
+from resolution import URL, resolve_url, resolve_url_async
+from results import ColorCount, to_result
+from scheduler import AsyncByteBudget, parse_content_length
+
+logger = logging.getLogger(__name__)
+
+_worker_session: requests.Session | None = None
+
+
+def get_worker_session() -> requests.Session:
+    """Get the HTTP session of the current process, creating it on first use.
+
+    Returns:
+        A session that keeps its connections open across the tasks run by a pool worker.
+    """
+    global _worker_session
+    if _worker_session is None:
+        _worker_session = requests.Session()
+    return _worker_session
+
+
+def count_url(
+    image: NasaImage, spill_threshold: int, resolution: str = URL, preview_scale: int = 1
+) -> int | None:
+    """Download an image with the session of the current process and count its colors.
+
+    Args:
+        image (NasaImage): An image object.
+        spill_threshold (int): Size in bytes above which the body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        preview_scale (int): Divisor of the width and height of the decoded image.
+
+    Returns:
+        The number of unique colors, or None if the image could not be downloaded.
+    """
+    session = get_worker_session()
+    response = session.get(resolve_url(image, resolution, session), stream=True)
+    with closing(response):
+        if response.status_code != 200:
+            return None
+
+        body = BodyBuffer(spill_threshold, parse_content_length(response.headers))
+        for chunk in response.iter_content(CHUNK_SIZE):
+            body.write(chunk)
+    return count_image_colors(body.getbuffer(), preview_scale)
+
+
+def count_bytes(data: bytes, preview_scale: int = 1) -> int:
+    """Count the colors of a downloaded image.
+
+    Args:
+        data (bytes): Binary content of the image.
+        preview_scale (int): Divisor of the width and height of the decoded image.
+
+    Returns:
+        The number of unique colors.
+    """
+    return count_image_colors(io.BytesIO(data), preview_scale)
+
+
+def cache_key(image: NasaImage, resolution: str = URL, preview_scale: int = 1) -> str:
+    """Build the cache key of the count of an image.
+
+    Counts taken with another resolution policy or at a preview scale are kept apart from the
+    counts of the standard pictures.
+
+    Args:
+        image (NasaImage): An image object.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        preview_scale (int): Divisor of the width and height of the decoded image.
+
+    Returns:
+        The cache key.
+    """
+    if resolution == URL and preview_scale == 1:
+        return image.url
+    return f"{image.url}#resolution={resolution}&scale={preview_scale}"
+
+
+def iter_dates(start_date: str, end_date: str) -> Iterator[str]:
+    """Iterate over the days of a date range.
+
+    Args:
+        start_date (str): Start date in format "YYYY-MM-DD".
+        end_date (str): End date in format "YYYY-MM-DD", included in the range.
+
+    Yields:
+        Each date in format "YYYY-MM-DD".
+
+    Raises:
+        ValueError: If a date is not in format "YYYY-MM-DD".
+    """
+    day = date.fromisoformat(start_date)
+    last = date.fromisoformat(end_date)
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+class ApodColorCounter:
+    """Counts the colors of NASA's APOD, keeping its resources warm across calls.
+
+    The metadata is requested with a persistent session, and the pictures are downloaded and
+    counted in a process pool whose workers keep their own sessions. The pool is started on the
+    first count and shut down by ``close``.
+
+    The counter is thread-safe. The metadata of past days is kept in memory, and concurrent
+    counts of the same picture share a single download and count while it is in flight.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        options: RunOptions = RunOptions(),
+        cache: ResultCache | None = None,
+        executor: Executor | None = None,
+    ):
+        """Initialize the counter.
+
+        Args:
+            api_url (str): URL of the image metadata API endpoint, including the API key.
+            options (RunOptions): Tuning options. Uses ``cpu_workers`` as the pool size, and
+                downloads with the ``resolution`` policy and decodes at ``preview_scale``.
+            cache (ResultCache | None): Cache of the color counts. Persisted to
+                ``options.cache_dir`` if None.
+            executor (Executor | None): Executor for the downloads and counts. A process pool
+                owned by the counter if None.
+        """
+        self.api_url = api_url
+        self.options = options
+        self.cache = cache or ResultCache(options.cache_dir)
+        self.session = requests.Session()
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._lock = threading.RLock()
+        self._metadata: Dict[str, NasaImage | None] = {}
+        self._inflight: Dict[str, Future] = {}
+        self._waiters: Counter = Counter()
+
+    @property
+    def executor(self) -> Executor:
+        """Executor for the downloads and counts, started on first use."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.options.cpu_workers or cpu_count())
+        return self._executor
+
+    def get_images(self, start_date: str, end_date: str) -> List[NasaImage]:
+        """Get the images of a date range.
+
+        The endpoint is only requested when a day of the range has not been seen before or is
+        not over yet, as the picture of the current day may still change.
+
+        Args:
+            start_date (str): Start date in format "YYYY-MM-DD".
+            end_date (str): End date in format "YYYY-MM-DD".
+
+        Returns:
+            List[NasaImage]: List of NASA images objects.
+
+        Raises:
+            requests.HTTPError: If the metadata endpoint does not respond successfully.
+        """
+        dates = list(iter_dates(start_date, end_date))
+        with self._lock:
+            if all(day in self._metadata for day in dates):
+                return [self._metadata[day] for day in dates if self._metadata[day]]  # type: ignore
+
+        url = f"{self.api_url}&start_date={start_date}&end_date={end_date}"
+        response = self.session.get(url)
+        response.raise_for_status()
+        images = parse_images(response.content)
+
+        by_date = {image.date: image for image in images}
+        today = date.today().isoformat()
+        with self._lock:
+            for day in dates:
+                if day < today:
+                    self._metadata[day] = by_date.get(day)
+        return images
+
+    def submit(self, image: NasaImage) -> Future | int | None:
+        """Start counting the colors of an image.
+
+        Every call must be paired with a call to ``release`` with the same image.
+
+        Args:
+            image (NasaImage): An image object.
+
+        Returns:
+            The cached number of colors, None if the image is not a picture, or a future of the
+            count. The future is shared by the callers counting the same picture at once.
+        """
+        if image.media_type != "image":
+            return None
+
+        key = cache_key(image, self.options.resolution, self.options.preview_scale)
+        colors = self.cache.get(key)
+        if colors is not None:
+            return colors
+
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self.executor.submit(
+                    count_url,
+                    image,
+                    self.options.spill_threshold,
+                    self.options.resolution,
+                    self.options.preview_scale,
+                )
+                self._inflight[key] = future
+                future.add_done_callback(partial(self._settle, key))
+            self._waiters[key] += 1
+        return future
+
+    def release(self, image: NasaImage, pending: Future | int | None):
+        """Stop waiting for the count of an image, cancelling it if nobody else waits for it.
+
+        Args:
+            image (NasaImage): An image object.
+            pending (Future | int | None): The value returned by ``submit`` for the image.
+        """
+        if not isinstance(pending, Future):
+            return
+
+        key = cache_key(image, self.options.resolution, self.options.preview_scale)
+        with self._lock:
+            self._waiters[key] -= 1
+            if self._waiters[key] <= 0:
+                del self._waiters[key]
+                pending.cancel()
+
+    def result(self, image: NasaImage, pending: Future | int | None) -> int | None:
+        """Wait for the count of an image.
+
+        Args:
+            image (NasaImage): An image object.
+            pending (Future | int | None): The value returned by ``submit`` for the image.
+
+        Returns:
+            The number of colors of the image, or None if it is not a picture or its count
+            failed.
+        """
+        if not isinstance(pending, Future):
+            return pending
+        try:
+            return pending.result()
+        except Exception as error:
+            logger.warning(f"Cannot count the colors of {image}: {error}")
+            return None
+
+    def _settle(self, key: str, future: Future):
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            self.cache.set(key, future.result())
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def count(self, start_date: str, end_date: str, ordered: bool = True) -> Iterator[ColorCount]:
+        """Count the colors of the images of a date range.
+
+        Nothing is requested until the iteration starts. Cached images are not downloaded again,
+        and the pending work is cancelled if the iteration is abandoned. An image whose count
+        fails is yielded without colors.
+
+        Args:
+            start_date (str): Start date in format "YYYY-MM-DD".
+            end_date (str): End date in format "YYYY-MM-DD".
+            ordered (bool): Whether the results are yielded in date order. Otherwise each one
+                is yielded as soon as its image is counted, cached images first.
+
+        Yields:
+            The result of each image.
+        """
+        images = self.get_images(start_date, end_date)
+        pending: List[Future | int | None] = []
+        try:
+            for image in images:
+                pending.append(self.submit(image))
+            if ordered:
+                for image, result in zip(images, pending):
+                    colors = self.result(image, result)
+                    yield to_result(image, colors, self.options.preview_scale)
+                return
+
+            # Images sharing a URL share their future.
+            waiting: Dict[Future, List[NasaImage]] = {}
+            for image, result in zip(images, pending):
+                if isinstance(result, Future):
+                    waiting.setdefault(result, []).append(image)
+                else:
+                    yield to_result(image, result, self.options.preview_scale)
+            for future in as_completed(waiting):
+                colors = self.result(waiting[future][0], future)
+                for image in waiting[future]:
+                    yield to_result(image, colors, self.options.preview_scale)
+        finally:
+            for image, result in zip(images, pending):
+                self.release(image, result)
+
+    def close(self):
+        """Close the session and shut down the owned process pool."""
+        self.session.close()
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self) -> "ApodColorCounter":
+        """Use the counter as a context manager that closes it on exit.
+
+        Returns:
+            The counter.
+        """
+        return self
+
+    def __exit__(self, *args):
+        """Close the counter."""
+        self.close()
+
+
+class AsyncApodColorCounter:
+    """Counts the colors of NASA's APOD from asyncio code, keeping its resources warm.
+
+    The metadata and the pictures are requested with a persistent aiohttp session, and the
+    colors are counted in a process pool. The session is created on the first count, so a
+    counter must be used from a single event loop.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        options: RunOptions = RunOptions(),
+        cache: ResultCache | None = None,
+        executor: Executor | None = None,
+    ):
+        """Initialize the counter.
+
+        Args:
+            api_url (str): URL of the image metadata API endpoint, including the API key.
+            options (RunOptions): Tuning options. Uses ``io_workers`` to bound the downloads,
+                ``memory_budget`` to bound the bytes they hold and ``cpu_workers`` as the pool
+                size, and downloads with the ``resolution`` policy and decodes at
+                ``preview_scale``.
+            cache (ResultCache | None): Cache of the color counts. Persisted to
+                ``options.cache_dir`` if None.
+            executor (Executor | None): Executor for the counts. A process pool owned by the
+                counter if None.
+        """
+        self.api_url = api_url
+        self.options = options
+        self.cache = cache or ResultCache(options.cache_dir)
+        self._session: ClientSession | None = None
+        self._budget: AsyncByteBudget | None = None
+        self._executor = executor
+        self._owns_executor = executor is None
+
+    @property
+    def executor(self) -> Executor:
+        """Executor for the counts, started on first use."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.options.cpu_workers or cpu_count())
+        return self._executor
+
+    @property
+    def session(self) -> ClientSession:
+        """HTTP session, created on first use."""
+        if self._session is None:
+            self._session = ClientSession()
+            self._budget = AsyncByteBudget(self.options.memory_budget)
+        return self._session
+
+    async def get_images(self, start_date: str, end_date: str) -> List[NasaImage]:
+        """Get the images of a date range.
+
+        Args:
+            start_date (str): Start date in format "YYYY-MM-DD".
+            end_date (str): End date in format "YYYY-MM-DD".
+
+        Returns:
+            List[NasaImage]: List of NASA images objects.
+
+        Raises:
+            aiohttp.ClientResponseError: If the metadata endpoint does not respond successfully.
+        """
+        url = f"{self.api_url}&start_date={start_date}&end_date={end_date}"
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            return parse_images(await response.read())
+
+    async def count_image(
+        self, image: NasaImage, semaphore: asyncio.Semaphore | None = None
+    ) -> int | None:
+        """Count the colors of an image, using the cache when possible.
+
+        Args:
+            image (NasaImage): An image object.
+            semaphore (asyncio.Semaphore | None): Limits the number of concurrent downloads.
+
+        Returns:
+            The number of unique colors, or None if the image could not be counted.
+        """
+        if image.media_type != "image":
+            return None
+
+        key = cache_key(image, self.options.resolution, self.options.preview_scale)
+        colors = self.cache.get(key)
+        if colors is not None:
+            return colors
+
+        if semaphore is None:
+            colors = await self._download_and_count(image)
+        else:
+            async with semaphore:
+                colors = await self._download_and_count(image)
+
+        if colors is not None:
+            self.cache.set(key, colors)
+        return colors
+
+    async def _count_tagged(
+        self, image: NasaImage, semaphore: asyncio.Semaphore | None
+    ) -> Tuple[NasaImage, int | None]:
+        return image, await self.count_image(image, semaphore)
+
+    async def _download_and_count(self, image: NasaImage) -> int | None:
+        url = await resolve_url_async(image, self.options.resolution, self.session)
+        async with self.session.get(url) as response:
+            if response.status != 200:
+                return None
+
+            async with self._budget.reserve(parse_content_length(response.headers)):  # type: ignore
+                data = await response.read()
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self.executor, count_bytes, data, self.options.preview_scale
+                )
+
+    async def count(
+        self, start_date: str, end_date: str, ordered: bool = True
+    ) -> AsyncIterator[ColorCount]:
+        """Count the colors of the images of a date range.
+
+        Nothing is requested until the iteration starts, and the pending work is cancelled if
+        the iteration is abandoned.
+
+        Args:
+            start_date (str): Start date in format "YYYY-MM-DD".
+            end_date (str): End date in format "YYYY-MM-DD".
+            ordered (bool): Whether the results are yielded in date order. Otherwise each one
+                is yielded as soon as its image is counted.
+
+        Yields:
+            The result of each image.
+        """
+        images = await self.get_images(start_date, end_date)
+        io_workers = self.options.io_workers
+        semaphore = asyncio.Semaphore(io_workers) if io_workers else None
+        tasks = [asyncio.ensure_future(self._count_tagged(image, semaphore)) for image in images]
+        try:
+            for task in tasks if ordered else asyncio.as_completed(tasks):
+                image, colors = await task
+                yield to_result(image, colors, self.options.preview_scale)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def close(self):
+        """Close the session and shut down the owned process pool."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def __aenter__(self) -> "AsyncApodColorCounter":
+        """Use the counter as an async context manager that closes it on exit.
+
+        Returns:
+            The counter.
+        """
+        return self
+
+    async def __aexit__(self, *args):
+        """Close the counter."""
+        await self.close()
@@ -0,0 +1 @@
+"""Distributed mode package."""
\ No newline at end of file
@@ -0,0 +1,447 @@
+"""Includes the functions for counting the colors of Nasa images with distributed workers.
+
+A coordinator splits the pictures of the date range into work units and serves them through a
+``multiprocessing.managers`` channel. Workers on any number of nodes connect to it, take units,
+count their colors and send back the results, beating a heartbeat while they work. The units of
+a worker whose heartbeat stops are handed to another worker.
+"""
+
+import ipaddress
+import os
+import socket
+import threading
+import time
+from collections import deque
+from itertools import accumulate
+from multiprocessing.managers import BaseManager, Server
+from typing import Callable, Collection, Deque, Dict, List, NamedTuple, Set
+
+import requests
+
+from counter import ApodColorCounter
+from image import NasaImage
+from options import RunOptions
+from results import to_result
+from sinks import make_writer
+
+UNIT_SIZE = 8
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 10.0
+POLL_INTERVAL = 0.5
+MAX_ATTEMPTS = 3
+DEFAULT_AUTHKEY = "nasa-pod"
+
+
+class WorkUnit(NamedTuple):
+    """A batch of consecutive pictures counted by a single worker.
+
+    Attributes:
+        unit_id: Position of the unit in the date range.
+        images: Pictures of the unit, in date order.
+    """
+
+    unit_id: int
+    images: List[NasaImage]
+
+
+class WorkQueue:
+    """Thread-safe queue of the work units of a coordinator.
+
+    Workers call it through a manager proxy, so every public method is exposed to them.
+    """
+
+    def __init__(
+        self,
+        units: List[WorkUnit],
+        heartbeat_timeout: float = HEARTBEAT_TIMEOUT,
+        max_attempts: int = MAX_ATTEMPTS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the queue.
+
+        Args:
+            units (List[WorkUnit]): Units to hand out, in date order.
+            heartbeat_timeout (float): Seconds without a heartbeat after which a worker is
+                considered lost.
+            max_attempts (int): Number of times a unit is handed out before it is given up.
+            clock (Callable[[], float]): Source of the current time in seconds.
+        """
+        self._units = {unit.unit_id: unit for unit in units}
+        self._pending: Deque[int] = deque(self._units)
+        self._assigned: Dict[int, str] = {}
+        self._attempts: Dict[int, int] = {}
+        self._heartbeats: Dict[str, float] = {}
+        self._results: Dict[int, List[int | None]] = {}
+        self._heartbeat_timeout = heartbeat_timeout
+        self._max_attempts = max_attempts
+        self._clock = clock
+        self._condition = threading.Condition()
+
+    def heartbeat(self, worker_id: str):
+        """Record that a worker is alive.
+
+        Args:
+            worker_id (str): Identifier of the worker.
+        """
+        with self._condition:
+            self._heartbeats[worker_id] = self._clock()
+
+    def get_unit(self, worker_id: str) -> WorkUnit | None:
+        """Hand out the next pending unit to a worker.
+
+        Args:
+            worker_id (str): Identifier of the worker.
+
+        Returns:
+            The unit, or None if no unit is pending right now.
+        """
+        with self._condition:
+            self._heartbeats[worker_id] = self._clock()
+            self.requeue_lost()
+            if not self._pending:
+                return None
+
+            unit_id = self._pending.popleft()
+            self._assigned[unit_id] = worker_id
+            self._attempts[unit_id] = self._attempts.get(unit_id, 0) + 1
+            return self._units[unit_id]
+
+    def complete(self, worker_id: str, unit_id: int, counts: List[int | None]):
+        """Store the results of a unit.
+
+        Results of units that were already completed, for example by a worker considered lost
+        that comes back, are ignored.
+
+        Args:
+            worker_id (str): Identifier of the worker.
+            unit_id (int): Identifier of the unit.
+            counts (List[int | None]): Number of colors of each picture of the unit.
+        """
+        with self._condition:
+            self._heartbeats[worker_id] = self._clock()
+            if unit_id in self._results:
+                return
+
+            self._results[unit_id] = counts
+            self._assigned.pop(unit_id, None)
+            if unit_id in self._pending:
+                self._pending.remove(unit_id)
+            self._condition.notify_all()
+
+    def requeue_lost(self) -> List[str]:
+        """Put back in the queue the units of the workers whose heartbeat stopped.
+
+        A unit handed out ``max_attempts`` times is given up and its pictures are reported
+        without colors.
+
+        Returns:
+            The identifiers of the lost workers.
+        """
+        with self._condition:
+            now = self._clock()
+            lost = [
+                worker_id
+                for worker_id, beat in self._heartbeats.items()
+                if now - beat > self._heartbeat_timeout
+            ]
+            for worker_id in lost:
+                del self._heartbeats[worker_id]
+                units = [u for u, owner in self._assigned.items() if owner == worker_id]
+                for unit_id in units:
+                    del self._assigned[unit_id]
+                    if self._attempts[unit_id] >= self._max_attempts:
+                        print(f"Giving up unit {unit_id} after {self._attempts[unit_id]} attempts")
+                        self._results[unit_id] = [None] * len(self._units[unit_id].images)
+                    else:
+                        self._pending.appendleft(unit_id)
+                print(f"Worker {worker_id} lost, re-queued units: {units}")
+            if lost:
+                self._condition.notify_all()
+            return lost
+
+    def is_done(self) -> bool:
+        """Check whether every unit has its results.
+
+        Returns:
+            True if every unit is completed otherwise False.
+        """
+        with self._condition:
+            return len(self._results) == len(self._units)
+
+    def wait(self, timeout: float) -> bool:
+        """Wait for every unit to be completed.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            True if every unit is completed otherwise False.
+        """
+        with self._condition:
+            return self._condition.wait_for(self.is_done, timeout)
+
+    def wait_completed(
+        self, reported: Collection[int], timeout: float
+    ) -> Dict[int, List[int | None]]:
+        """Wait for units completed since they were last reported.
+
+        Args:
+            reported (Collection[int]): Identifiers of the units already reported.
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            The number of colors of each picture of the units not reported yet, by unit
+            identifier. Empty if no unit was completed before the timeout.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._results) > len(reported), timeout)
+            return {
+                unit_id: counts
+                for unit_id, counts in self._results.items()
+                if unit_id not in reported
+            }
+
+    def results(self) -> List[int | None]:
+        """Gather the results of the completed units.
+
+        Returns:
+            The number of colors of each picture, in date order.
+        """
+        with self._condition:
+            return [count for unit_id in sorted(self._results) for count in self._results[unit_id]]
+
+
+class CoordinatorManager(BaseManager):
+    """Manager serving the work queue of a coordinator to the workers."""
+
+
+class WorkerManager(BaseManager):
+    """Manager connecting a worker to the work queue of a coordinator."""
+
+
+WorkerManager.register("get_queue")
+
+
+def serve(server: Server):
+    """Serve the work queue until the stop event of the server is set.
+
+    Args:
+        server (Server): Server of a coordinator manager.
+    """
+    try:
+        server.serve_forever()
+    except SystemExit:
+        # The manager server exits the interpreter when stopped; only end this thread.
+        pass
+
+
+def is_loopback(host: str) -> bool:
+    """Check whether a host is only reachable from the same machine.
+
+    Args:
+        host (str): Host name or IP address.
+
+    Returns:
+        True if the host is ``localhost`` or a loopback address otherwise False.
+    """
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def get_authkey(host: str) -> bytes | None:
+    """Get the key shared by the coordinator and the workers to authenticate the channel.
+
+    The manager unpickles what it receives, so anyone holding the key can run code on the
+    coordinator. The public default key is only used on loopback hosts.
+
+    Args:
+        host (str): Host the coordinator listens on.
+
+    Returns:
+        The value of the ``COORDINATOR_AUTHKEY`` environment variable, the default key on a
+        loopback host, or None if the key is not set for another host.
+    """
+    authkey = os.environ.get("COORDINATOR_AUTHKEY")
+    if authkey:
+        return authkey.encode()
+    if is_loopback(host):
+        return DEFAULT_AUTHKEY.encode()
+    return None
+
+
+def split_units(images: List[NasaImage], unit_size: int = UNIT_SIZE) -> List[WorkUnit]:
+    """Split the pictures of a date range into work units.
+
+    Args:
+        images (List[NasaImage]): Pictures in date order.
+        unit_size (int): Number of pictures of each unit.
+
+    Returns:
+        The work units, in date order.
+    """
+    return [
+        WorkUnit(unit_id, images[start : start + unit_size])
+        for unit_id, start in enumerate(range(0, len(images), unit_size))
+    ]
+
+
+def count_unit(counter: ApodColorCounter, unit: WorkUnit) -> List[int | None]:
+    """Count the colors of the pictures of a unit.
+
+    Args:
+        counter (ApodColorCounter): Counter of the worker.
+        unit (WorkUnit): A work unit.
+
+    Returns:
+        The number of colors of each picture of the unit, None for the pictures whose count
+        failed.
+    """
+    pending = [counter.submit(image) for image in unit.images]
+    try:
+        return [counter.result(image, p) for image, p in zip(unit.images, pending)]
+    finally:
+        for image, p in zip(unit.images, pending):
+            counter.release(image, p)
+
+
+def beat(queue: WorkQueue, worker_id: str, stop: threading.Event):
+    """Send heartbeats to the coordinator until stopped.
+
+    Args:
+        queue (WorkQueue): Proxy of the work queue.
+        worker_id (str): Identifier of the worker.
+        stop (threading.Event): Event that stops the heartbeats.
+    """
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            queue.heartbeat(worker_id)
+        except (EOFError, ConnectionError):
+            return
+
+
+def work(queue: WorkQueue, worker_id: str, counter: ApodColorCounter) -> int:
+    """Take and count units until the coordinator has no more work.
+
+    Args:
+        queue (WorkQueue): Proxy of the work queue.
+        worker_id (str): Identifier of the worker.
+        counter (ApodColorCounter): Counter of the worker.
+
+    Returns:
+        The number of units counted by the worker.
+    """
+    done = 0
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=beat, args=(queue, worker_id, stop), daemon=True)
+    heartbeat.start()
+    try:
+        while True:
+            unit = queue.get_unit(worker_id)
+            if unit is None:
+                if queue.is_done():
+                    return done
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            print(f"Counting unit {unit.unit_id} with {len(unit.images)} pictures")
+            queue.complete(worker_id, unit.unit_id, count_unit(counter, unit))
+            done += 1
+    except (EOFError, ConnectionError):
+        print("The coordinator is gone.")
+        return done
+    finally:
+        stop.set()
+
+
+def coordinator_main(
+    api_url: str,
+    start_date: str,
+    end_date: str,
+    options: RunOptions = RunOptions(),
+    host: str = "127.0.0.1",
+    port: int = 0,
+):
+    """Split a date range into work units and gather their results from the workers.
+
+    Args:
+        api_url (str): URL of the image metadata API endpoint.
+        start_date (str): Start date of the date range.
+        end_date (str): End date of the date range.
+        options (RunOptions): Tuning options. The coordinator only writes the results to
+            ``sink``, as the units complete or in date order if ``ordered`` is set.
+        host (str): Host to listen on for the workers.
+        port (int): Port to listen on for the workers.
+    """
+    authkey = get_authkey(host)
+    if authkey is None:
+        print(f"Set COORDINATOR_AUTHKEY to a secret to listen on {host}.")
+        return
+
+    with ApodColorCounter(api_url, options) as counter:
+        try:
+            images = counter.get_images(start_date, end_date)
+        except requests.RequestException:
+            print("An error ocurred retrieving the pictures metadata.")
+            return
+
+    units = split_units(images)
+    queue = WorkQueue(units)
+    CoordinatorManager.register("get_queue", callable=lambda: queue)
+    server = CoordinatorManager(address=(host, port), authkey=authkey).get_server()
+    threading.Thread(target=serve, args=(server,), daemon=True).start()
+    print(f"Coordinating {len(units)} units on {server.address[0]}:{server.address[1]}")
+
+    write = make_writer(options.sink, options.ordered)
+    offsets = list(accumulate((len(unit.images) for unit in units), initial=0))
+    reported: Set[int] = set()
+    while len(reported) < len(units):
+        for unit_id, counts in queue.wait_completed(reported, HEARTBEAT_INTERVAL).items():
+            reported.add(unit_id)
+            for position, (image, count) in enumerate(zip(units[unit_id].images, counts)):
+                write(offsets[unit_id] + position, to_result(image, count, options.preview_scale))
+        queue.requeue_lost()
+
+    # Give the polling workers a chance to see that the work is done before closing.
+    time.sleep(POLL_INTERVAL * 2)
+    server.stop_event.set()
+
+
+def worker_main(
+    api_url: str,
+    start_date: str,
+    end_date: str,
+    options: RunOptions = RunOptions(),
+    host: str = "127.0.0.1",
+    port: int = 0,
+):
+    """Count the work units of a coordinator until it has no more work.
+
+    Args:
+        api_url (str): URL of the image metadata API endpoint.
+        start_date (str): Not used by the workers, the coordinator sets the date range.
+        end_date (str): Not used by the workers, the coordinator sets the date range.
+        options (RunOptions): Tuning options. Uses ``cpu_workers`` as the pool size. The counts
+            are persisted to ``cache_dir`` when set.
+        host (str): Host of the coordinator.
+        port (int): Port of the coordinator.
+    """
+    authkey = get_authkey(host)
+    if authkey is None:
+        print(f"Set COORDINATOR_AUTHKEY to the key of the coordinator on {host}.")
+        return
+
+    manager = WorkerManager(address=(host, port), authkey=authkey)
+    try:
+        manager.connect()
+    except OSError as error:
+        print(f"Cannot connect to the coordinator: {error}")
+        return
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    with ApodColorCounter(api_url, options) as counter:
+        done = work(manager.get_queue(), worker_id, counter)  # type: ignore
+    print(f"Worker {worker_id} counted {done} units")
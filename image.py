@@ -1,12 +1,28 @@
 """Holds the class for Nasa image manipulation."""
 
 import io
+import mmap
+import tempfile
+from typing import BinaryIO
+
+DEFAULT_SPILL_THRESHOLD = 16 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
 
 
 class NasaImage:
-    """Class for manipulation NASA's APOD."""
+    """Class for manipulation NASA's APOD.
+
+    The metadata and the binary payload are kept in slots, so archive-wide runs do not pay
+    for a dictionary per picture. The payload is only attached while the picture is counted,
+    and it is left out of the pickled state and of the comparisons, so the pictures sent to
+    pool workers or other nodes only carry their metadata.
+    """
 
-    def __init__(self, url: str, media_type: str, title: str, date: str) -> None:
+    __slots__ = ("url", "media_type", "title", "date", "hdurl", "bytes")
+
+    def __init__(
+        self, url: str, media_type: str, title: str, date: str, hdurl: str | None = None
+    ) -> None:
         """Initialize method for NASA's APOD object.
 
         Args:
@@ -14,12 +30,31 @@ class NasaImage:
             media_type (str): Expected media type.
             title (str): Title of the picture.
             date (str): Date of the picture.
+            hdurl (str | None): URL of the resource in high resolution, if any.
         """
         self.url = url
         self.media_type = media_type
         self.title = title
         self.date = date
-        self.bytes: io.BytesIO | None = None
+        self.hdurl = hdurl
+        self.bytes: BinaryIO | None = None
+
+    def __getstate__(self) -> tuple:
+        """Get the state to pickle, without the binary payload.
+
+        Returns:
+            The metadata of the picture.
+        """
+        return (self.url, self.media_type, self.title, self.date, self.hdurl)
+
+    def __setstate__(self, state: tuple):
+        """Restore the pickled metadata of a picture.
+
+        Args:
+            state (tuple): The metadata of the picture.
+        """
+        self.url, self.media_type, self.title, self.date, self.hdurl = state
+        self.bytes = None
 
     def __repr__(self) -> str:
         """Build the string representation for NASA's APOD object.
@@ -47,3 +82,63 @@ class NasaImage:
             and self.title == other.title
             and self.date == other.date
         )
+
+
+class BodyBuffer:
+    """Buffer for the binary content of an image while it is downloaded.
+
+    Bodies up to the spill threshold are kept in memory. Larger bodies are streamed to an
+    anonymous temporary file and mapped in memory once complete, so the OS page cache holds
+    them instead of the process heap.
+    """
+
+    def __init__(self, spill_threshold: int = DEFAULT_SPILL_THRESHOLD, size: int | None = None):
+        """Initialize the buffer.
+
+        Args:
+            spill_threshold (int): Size in bytes above which the body is written to disk.
+            size (int | None): Announced size of the body, if any. A body announced above the
+                threshold is written to disk from the first chunk.
+        """
+        self.spill_threshold = spill_threshold
+        self.size = 0
+        self._file: BinaryIO = io.BytesIO()
+        if size is not None and size > spill_threshold:
+            self._spill()
+
+    @property
+    def spilled(self) -> bool:
+        """Whether the body is written to a temporary file."""
+        return not isinstance(self._file, io.BytesIO)
+
+    def _spill(self):
+        spill_file = tempfile.TemporaryFile()
+        spill_file.write(self._file.getbuffer())
+        self._file = spill_file  # type: ignore
+
+    def write(self, chunk: bytes):
+        """Append a chunk of the body.
+
+        Args:
+            chunk (bytes): Chunk of the body.
+        """
+        self._file.write(chunk)
+        self.size += len(chunk)
+        if not self.spilled and self.size > self.spill_threshold:
+            self._spill()
+
+    def getbuffer(self) -> BinaryIO:
+        """Get a readable buffer with the complete body.
+
+        Returns:
+            An in-memory buffer, or a read-only memory map of the temporary file. Both can be
+            opened by Pillow.
+        """
+        if not self.spilled or not self.size:
+            self._file.seek(0)
+            return self._file
+
+        self._file.flush()
+        mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._file.close()
+        return mapped  # type: ignore
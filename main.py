@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+from time import time
 from timeit import default_timer
 import os
 import logging
@@ -6,11 +7,25 @@ import logging
 import asyncio
 import click
 
+from auto_mode.main import main as main_auto
+from distributed_mode.main import coordinator_main, worker_main
 from sync_mode.main import main as main_sync
 from async_mode.main import main as main_async
 from thread_mode.main import main as main_thread
 from multiprocessing_mode.main import main as main_processing
+from serve_mode.main import DEFAULT_HOST, DEFAULT_PORT, main as main_serve
+from cache import DEFAULT_REVALIDATE_DAYS
+from colors import PREVIEW_SCALES
+from image import DEFAULT_SPILL_THRESHOLD
 from log.logging import setup_logger
+import memtrack
+import profiling
+from options import RunOptions
+from resolution import RESOLUTIONS, URL
+from scheduler import DEFAULT_MEMORY_BUDGET
+from sinks import open_sink
+
+MEGABYTE = 1024 * 1024
 
 logger = logging.getLogger(__name__)
 
@@ -28,13 +43,136 @@ def get_api_url() -> str | None:
     default=datetime.strftime(datetime.now() - timedelta(days=10), "%Y-%m-%d"),
 )
 @click.option("--end_date", "-e", "end_date", default=datetime.strftime(datetime.now(), "%Y-%m-%d"))
-def command(mode: str, start_date: str, end_date: str):
+@click.option(
+    "--memory_budget",
+    "-m",
+    "memory_budget",
+    type=int,
+    default=DEFAULT_MEMORY_BUDGET // MEGABYTE,
+    help="Maximum MiB of image bodies held at once by concurrent downloads.",
+)
+@click.option(
+    "--spill_threshold",
+    "spill_threshold",
+    type=int,
+    default=DEFAULT_SPILL_THRESHOLD // MEGABYTE,
+    help="Size in MiB above which an image body is buffered in a memory-mapped temporary file.",
+)
+@click.option(
+    "--profile",
+    "profile",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory where the profiling statistics of the run are written.",
+)
+@click.option(
+    "--track_memory",
+    "track_memory",
+    is_flag=True,
+    default=False,
+    help="Report the memory used by each stage and image at the end of the run.",
+)
+@click.option(
+    "--cache_dir",
+    "cache_dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory where the color counts are kept across runs.",
+)
+@click.option(
+    "--revalidate_days",
+    "revalidate_days",
+    type=click.IntRange(min=0),
+    default=DEFAULT_REVALIDATE_DAYS,
+    help="Revalidate the cached counts of the pictures of the last days with conditional "
+    "requests, since recent entries may still change.",
+)
+@click.option(
+    "--host", "host", default=DEFAULT_HOST, help="Host of the serve mode or the coordinator."
+)
+@click.option(
+    "--port",
+    "port",
+    type=int,
+    default=DEFAULT_PORT,
+    help="Port of the serve mode or the coordinator.",
+)
+@click.option(
+    "--resolution",
+    "resolution",
+    type=click.Choice(RESOLUTIONS),
+    default=URL,
+    help="Download the standard pictures, the high resolution ones, or the high resolution "
+    "ones when they are small enough (auto).",
+)
+@click.option(
+    "--preview_scale",
+    "preview_scale",
+    type=click.Choice([str(scale) for scale in PREVIEW_SCALES]),
+    default="1",
+    help="Decode the pictures at 1/2, 1/4 or 1/8 of their size to count preview-scale colors.",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write the results to a .csv, .parquet, .arrow, .feather or .npy file instead of "
+    "printing them.",
+)
+@click.option(
+    "--ordered",
+    "ordered",
+    is_flag=True,
+    default=False,
+    help="Write the results in date order instead of as soon as each picture is counted.",
+)
+@click.option(
+    "--deadline",
+    "deadline",
+    type=click.FloatRange(min=0),
+    default=None,
+    help="Seconds the run may take. Cached and cheap pictures go first, and the pictures the "
+    "time left cannot cover are skipped.",
+)
+def command(
+    mode: str,
+    start_date: str,
+    end_date: str,
+    memory_budget: int,
+    spill_threshold: int,
+    profile: str | None,
+    track_memory: bool,
+    cache_dir: str | None,
+    revalidate_days: int,
+    host: str,
+    port: int,
+    resolution: str,
+    preview_scale: str,
+    output: str | None,
+    ordered: bool,
+    deadline: float | None,
+):
     """Executes a command for processing NASA's APOD.
 
     Args:
         mode (str): Execution mode used for process the pictures.
         start_date:: Start date
         end_date: End date
+        memory_budget: Memory budget in MiB for the image bodies.
+        spill_threshold: Size in MiB above which an image body is buffered on disk.
+        profile: Directory for the profiling statistics. Profiling is disabled if None.
+        track_memory: Whether to track the memory used by each stage.
+        cache_dir: Directory for the color counts. They are kept in memory only if None.
+        revalidate_days: Number of days back from today whose cached counts are revalidated.
+        host: Host the serve mode or the coordinator listens on, or the workers connect to.
+        port: Port the serve mode or the coordinator listens on, or the workers connect to.
+        resolution: Resolution policy of the downloads.
+        preview_scale: Divisor of the width and height of the decoded pictures.
+        output: File where the results are written. They are printed if None.
+        ordered: Whether the results are written in date order.
+        deadline: Seconds the run may take. It runs until every picture is counted if None.
     """
     setup_logger()
     api_url = get_api_url()
@@ -48,20 +186,70 @@ def command(mode: str, start_date: str, end_date: str):
         f" to {end_date}"
     )
 
+    try:
+        sink = open_sink(output)
+    except (ValueError, ImportError) as error:
+        logger.error(f"Cannot write the results to {output}: {error}")
+        return
+
+    options = RunOptions(
+        memory_budget=memory_budget * MEGABYTE,
+        spill_threshold=spill_threshold * MEGABYTE,
+        cache_dir=cache_dir,
+        revalidate_days=revalidate_days,
+        resolution=resolution,
+        preview_scale=int(preview_scale),
+        sink=sink,
+        ordered=ordered,
+        deadline=None if deadline is None else time() + deadline,
+    )
+    if options.preview_scale > 1:
+        logger.info(
+            f"Decoding previews at 1/{options.preview_scale} scale, the counts are preview-scale"
+            " figures and are lower than the counts of the full pictures."
+        )
+    if deadline is not None:
+        logger.info(f"Skipping the pictures that cannot be counted within {deadline:g} seconds.")
+    kwargs = dict(api_url=api_url, start_date=start_date, end_date=end_date, options=options)
+
+    if track_memory:
+        memtrack.enable()
+    if profile:
+        profiling.enable(os.path.join(profile, datetime.now().strftime("%Y%m%d-%H%M%S")))
+
     start_time = default_timer()
-    match mode:  # noqa: E999
-        case "sync":
-            main_sync(api_url=api_url, start_date=start_date, end_date=end_date)
-        case "async":
-            asyncio.run(main_async(api_url=api_url, start_date=start_date, end_date=end_date))
-        case "threading":
-            main_thread(api_url=api_url, start_date=start_date, end_date=end_date)
-        case "multiprocessing":
-            main_processing(api_url=api_url, start_date=start_date, end_date=end_date)
-        case _:
-            logger.warning(f"{mode} is not a valid argument.")
+    with sink, profiling.profile_block():
+        match mode:  # noqa: E999
+            case "sync":
+                main_sync(**kwargs)
+            case "async":
+                asyncio.run(main_async(**kwargs))
+            case "threading":
+                main_thread(**kwargs)
+            case "multiprocessing":
+                main_processing(**kwargs)
+            case "auto":
+                main_auto(**kwargs)
+            case "serve":
+                main_serve(**kwargs, host=host, port=port)
+            case "coordinator":
+                coordinator_main(**kwargs, host=host, port=port)
+            case "worker":
+                worker_main(**kwargs, host=host, port=port)
+            case _:
+                logger.warning(f"{mode} is not a valid argument.")
     elapsed = default_timer() - start_time
     logger.info(f"{mode} mode took: {elapsed:.2f} seconds")
+    if output:
+        logger.info(f"Results written to {output}")
+
+    merged_path = profiling.merge()
+    if merged_path:
+        logger.info(f"Profiling statistics written to {merged_path}")
+        logger.info(profiling.summarize(merged_path))
+
+    if track_memory:
+        logger.info(f"Memory usage:\n{memtrack.report()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+"""Includes the functions and objects for tracking the memory used by each processing stage.
+
+Tracking is enabled once per process. Each stage records the ``tracemalloc`` peak reached
+above the memory traced when it started, and the resident set size of the process when it
+ended. ``tracemalloc`` traces the whole process and keeps a single peak, so the peak is only
+reset when no other stage is running, and a stage only takes the process peak if it was
+reached after the stage started. Otherwise it records the memory it kept when it ended. The
+peaks of stages running at the same time in several threads or tasks still include each
+other's allocations. Pillow allocates its pixel buffers outside the Python allocator, so they
+are not traced.
+"""
+
+import os
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple
+
+_enabled = False
+_active = 0
+_records: List["StageRecord"] = []
+_lock = threading.Lock()
+
+
+class StageRecord(NamedTuple):
+    """Memory used by a processing stage of an image.
+
+    Attributes:
+        label: Image the stage belongs to.
+        stage: Name of the stage.
+        peak: Peak of the traced memory above the memory traced at the start of the stage.
+        rss: Resident set size of the process at the end of the stage.
+        pid: Process that ran the stage.
+    """
+
+    label: str
+    stage: str
+    peak: int
+    rss: int
+    pid: int
+
+
+class TrackedResult(NamedTuple):
+    """Value returned by a tracked call in a pool worker, along with its stage records."""
+
+    value: Any
+    records: List[StageRecord]
+
+
+def enable():
+    """Enable memory tracking for the current process."""
+    global _enabled
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    """Check whether memory tracking is enabled.
+
+    Returns:
+        True if memory tracking is enabled otherwise False.
+    """
+    return _enabled
+
+
+def init_worker(enabled: bool):
+    """Set up memory tracking in a pool worker.
+
+    Args:
+        enabled (bool): Whether memory tracking is enabled in the parent process.
+    """
+    global _enabled
+    with _lock:
+        _records.clear()
+    if enabled:
+        enable()
+    else:
+        _enabled = False
+
+
+def get_rss() -> int:
+    """Get the resident set size of the current process.
+
+    Returns:
+        The current resident set size in bytes, or the peak one where the current one is not
+        available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def track_stage(label: str, name: str) -> Iterator[None]:
+    """Record the memory used while the context is active.
+
+    Args:
+        label (str): Image the stage belongs to.
+        name (str): Name of the stage.
+
+    Yields:
+        Nothing.
+    """
+    if not _enabled:
+        yield
+        return
+
+    global _active
+    with _lock:
+        if not _active:
+            tracemalloc.reset_peak()
+        _active += 1
+    start, start_peak = tracemalloc.get_traced_memory()
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        top = peak if peak > start_peak else max(start, current)
+        record = StageRecord(label, name, top - start, get_rss(), os.getpid())
+        with _lock:
+            _active -= 1
+            _records.append(record)
+
+
+def get_records() -> List[StageRecord]:
+    """Get the stage records of the current process.
+
+    Returns:
+        A copy of the stage records.
+    """
+    with _lock:
+        return list(_records)
+
+
+def drain() -> List[StageRecord]:
+    """Take the stage records of the current process, leaving none behind.
+
+    Returns:
+        The stage records.
+    """
+    with _lock:
+        records = list(_records)
+        _records.clear()
+    return records
+
+
+class TrackedCall:
+    """Picklable wrapper that sends back the stage records of a call run in a pool worker."""
+
+    def __init__(self, func: Callable):
+        """Initialize the wrapper.
+
+        Args:
+            func (Callable): The callable to track. It must be picklable to be sent to pool
+                workers.
+        """
+        self.func = func
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        """Call the wrapped callable.
+
+        Returns:
+            The value of the wrapped callable, wrapped in a ``TrackedResult`` along with the
+            stage records of the call if memory tracking is enabled.
+        """
+        value = self.func(*args, **kwargs)
+        if not _enabled:
+            return value
+        return TrackedResult(value, drain())
+
+
+def unwrap(result: Any) -> Any:
+    """Collect the stage records of a tracked call in the current process.
+
+    Args:
+        result (Any): Value returned by a ``TrackedCall``.
+
+    Returns:
+        The value returned by the wrapped callable.
+    """
+    if not isinstance(result, TrackedResult):
+        return result
+
+    with _lock:
+        _records.extend(result.records)
+    return result.value
+
+
+def report(limit: int = 5) -> str:
+    """Build a report of the images and stages that used the most memory.
+
+    Args:
+        limit (int): Number of images in the report.
+
+    Returns:
+        The report, or an empty string if nothing was recorded.
+    """
+    records = get_records()
+    if not records:
+        return ""
+
+    images: Dict[str, StageRecord] = {}
+    stages: Dict[str, StageRecord] = {}
+    for record in records:
+        if record.label not in images or record.peak > images[record.label].peak:
+            images[record.label] = record
+        if record.stage not in stages or record.peak > stages[record.stage].peak:
+            stages[record.stage] = record
+
+    lines = [f"Peak RSS: {_format(max(record.rss for record in records))}", "Top images:"]
+    for record in sorted(images.values(), key=lambda r: r.peak, reverse=True)[:limit]:
+        lines.append(
+            f"  {record.label}: {_format(record.peak)} during {record.stage}"
+            f" (RSS {_format(record.rss)}, pid {record.pid})"
+        )
+    lines.append("Top stages:")
+    for record in sorted(stages.values(), key=lambda r: r.peak, reverse=True):
+        lines.append(f"  {record.stage}: {_format(record.peak)} for {record.label}")
+    return "\n".join(lines)
+
+
+def _format(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MiB"
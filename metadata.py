@@ -0,0 +1,223 @@
+"""Includes the functions for decoding the metadata of NASA's APOD.
+
+The metadata is decoded with orjson or msgspec when one of them is installed, and with the
+standard ``json`` module otherwise. The array returned by the API can also be parsed as a
+stream: each picture is decoded as soon as its object has arrived, so its download can start
+before the rest of the response.
+
+When a response cache is given, the metadata is requested with the validators of the cached
+response, and the cached body is reused if the server answers that it has not been modified.
+"""
+
+import codecs
+import json
+import re
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+    Type,
+)
+
+import requests
+
+from cache import NOT_MODIFIED, ResponseCache, Validators
+from image import NasaImage
+
+DecodeError: Type[Exception] = ValueError
+try:
+    import orjson
+
+    loads: Callable[[bytes | str], Any] = orjson.loads
+except ImportError:  # pragma: no cover - depends on the installed packages
+    try:
+        import msgspec
+
+        loads = msgspec.json.decode
+        DecodeError = msgspec.DecodeError
+    except ImportError:
+        loads = json.loads
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def fetch_metadata(url: str, cache: ResponseCache | None = None, session: Any = requests) -> Any:
+    """Request the metadata, revalidating its cached response if any.
+
+    Args:
+        url (str): URL of the metadata endpoint.
+        cache (ResponseCache | None): Cache of the metadata responses.
+        session (Any): The ``requests`` module or a session used for the request.
+
+    Returns:
+        The decoded metadata, or an empty list if the endpoint does not respond successfully.
+        A cached response that cannot be decoded is requested again without validators.
+    """
+    cached = cache.get(url) if cache is not None else None
+    if cached is None:
+        response = session.get(url)
+    else:
+        response = session.get(url, headers=cached.validators.conditional_headers())
+        if response.status_code == NOT_MODIFIED:
+            try:
+                return loads(cached.body)
+            except (ValueError, DecodeError):
+                response = session.get(url)
+
+    if response.status_code != 200:
+        return []
+    if cache is not None:
+        cache.set(url, response.content, Validators.from_headers(response.headers))
+    return loads(response.content)
+
+
+def build_image(data: Dict) -> NasaImage:
+    """Build a NASA image object from its metadata.
+
+    Args:
+        data (Dict): Metadata of a picture.
+
+    Returns:
+        NasaImage: A NASA image object.
+    """
+    return NasaImage(
+        url=data["url"],
+        media_type=data["media_type"],
+        title=data["title"],
+        date=data["date"],
+        hdurl=data.get("hdurl"),
+    )
+
+
+def parse_images(body: bytes) -> List[NasaImage]:
+    """Decode a whole metadata response.
+
+    Args:
+        body (bytes): Body of the response.
+
+    Returns:
+        List[NasaImage]: List of NASA images objects.
+    """
+    return [build_image(data) for data in loads(body)]
+
+
+class MetadataParser:
+    """Incremental parser of the JSON array of objects returned by the metadata endpoint.
+
+    The chunks of the body are fed as they arrive and each object is decoded as soon as it is
+    complete. Only the unparsed tail of the body is kept in memory.
+    """
+
+    def __init__(self):
+        """Initialize the parser."""
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._started = False
+        self._finished = False
+
+    def feed(self, chunk: bytes) -> List[Dict]:
+        """Parse the next chunk of the body.
+
+        Args:
+            chunk (bytes): Next bytes of the body.
+
+        Returns:
+            List[Dict]: The objects completed by the chunk.
+
+        Raises:
+            ValueError: If the body is not a JSON array of objects.
+        """
+        self._buffer += self._decoder.decode(chunk)
+        objects = []
+        position = 0
+        while not self._finished:
+            position = _WHITESPACE.match(self._buffer, position).end()  # type: ignore
+            if position == len(self._buffer):
+                break
+
+            char = self._buffer[position]
+            if not self._started:
+                if char != "[":
+                    raise ValueError("The metadata is not a JSON array.")
+                self._started = True
+                position += 1
+            elif char == "]":
+                self._finished = True
+                position += 1
+            elif char == ",":
+                position += 1
+            elif char == "{":
+                decoded = self._decode_object(position)
+                if decoded is None:
+                    break
+                objects.append(decoded[0])
+                position = decoded[1]
+            else:
+                raise ValueError(f"Unexpected character {char!r} in the metadata.")
+
+        self._buffer = self._buffer[position:]
+        return objects
+
+    def _decode_object(self, start: int) -> Tuple[Dict, int] | None:
+        # The first closing brace that ends a valid object is the end of the object. Braces
+        # inside strings or closing nested objects leave the slice invalid and are skipped.
+        end = self._buffer.find("}", start)
+        while end != -1:
+            try:
+                return loads(self._buffer[start : end + 1]), end + 1
+            except DecodeError:
+                end = self._buffer.find("}", end + 1)
+        return None
+
+    def close(self):
+        """Check that the whole array has been parsed.
+
+        Raises:
+            ValueError: If the body ended before the end of the array.
+        """
+        if not self._finished:
+            raise ValueError("The metadata ended before the end of the array.")
+
+
+def iter_images(chunks: Iterable[bytes]) -> Iterator[NasaImage]:
+    """Decode the pictures of a metadata response as its chunks arrive.
+
+    Args:
+        chunks (Iterable[bytes]): Chunks of the body of the response.
+
+    Yields:
+        Each NASA image object, in the order of the response.
+
+    Raises:
+        ValueError: If the body is not a complete JSON array of objects.
+    """
+    parser = MetadataParser()
+    for chunk in chunks:
+        for data in parser.feed(chunk):
+            yield build_image(data)
+    parser.close()
+
+
+async def aiter_images(chunks: AsyncIterable[bytes]) -> AsyncIterator[NasaImage]:
+    """Decode the pictures of a metadata response as its chunks arrive.
+
+    Args:
+        chunks (AsyncIterable[bytes]): Chunks of the body of the response.
+
+    Yields:
+        Each NASA image object, in the order of the response.
+
+    Raises:
+        ValueError: If the body is not a complete JSON array of objects.
+    """
+    parser = MetadataParser()
+    async for chunk in chunks:
+        for data in parser.feed(chunk):
+            yield build_image(data)
+    parser.close()
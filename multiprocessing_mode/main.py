@@ -1,28 +1,42 @@
 """Implementation for processing NASA APOD in multiprocessing mode."""
 
-import io
+from contextlib import closing
+from functools import partial
 from multiprocessing import Pool, cpu_count
-from typing import Dict, List, Set
+from multiprocessing.pool import Pool as PoolType
+from queue import SimpleQueue
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple
 
 import requests
-from PIL import Image
 
-from image import NasaImage
-
-
-def get_metadata(url: str) -> List[Dict]:
+from cache import NOT_MODIFIED, CacheEntry, metadata_cache
+from colors import count_colors, decode_image
+from image import CHUNK_SIZE, DEFAULT_SPILL_THRESHOLD, BodyBuffer, NasaImage
+from memtrack import TrackedCall, is_enabled, track_stage, unwrap
+from memtrack import init_worker as init_memory_tracking
+from metadata import fetch_metadata
+from options import RunOptions
+from planner import RunPlan
+from profiling import ProfiledCall, get_directory
+from profiling import init_worker as init_profiling
+from resolution import URL, resolve_url
+from scheduler import parse_content_length
+from sinks import make_writer
+
+
+def get_metadata(url: str, cache_dir: str | None = None) -> List[Dict]:
     """Get the metadata from the given URL.
 
     Args:
         url (str): URL of the metadata endpoint.
+        cache_dir (str | None): Directory of the cache, where the metadata response is
+            revalidated if given. The cache is opened in the worker running the request.
 
     Returns:
         List[Dict]: List of decoded data containing images metadata.
     """
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    return []
+    with track_stage("metadata", "metadata"):
+        return fetch_metadata(url, metadata_cache(cache_dir))
 
 
 def process_metadata(data: List[Dict]) -> List[NasaImage]:
@@ -35,35 +49,101 @@ def process_metadata(data: List[Dict]) -> List[NasaImage]:
         List[NasaImage]: Returns a list of NASA images objects.
     """
     return [
-        NasaImage(url=p["url"], media_type=p["media_type"], title=p["title"], date=p["date"])
+        NasaImage(
+            url=p["url"],
+            media_type=p["media_type"],
+            title=p["title"],
+            date=p["date"],
+            hdurl=p.get("hdurl"),
+        )
         for p in data
     ]
 
 
-def get_image_binary(image: NasaImage) -> NasaImage:
+def get_image_binary(
+    image: NasaImage,
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+    resolution: str = URL,
+    cached: CacheEntry | None = None,
+) -> requests.Response | None:
     """Get the binary content of an image using its URL.
 
-    The binary content is loaded using an in-memory buffer and set to
-    the image bytes attribute.
+    The binary content is streamed into a buffer and set to the image bytes attribute. Bodies
+    larger than the spill threshold are buffered in a memory-mapped temporary file. When the
+    image has a cached entry, it is requested with the entry validators and nothing is
+    downloaded if the server answers that it has not been modified.
 
     Args:
         image (NasaImage): An image.
+        spill_threshold (int): Size in bytes above which the body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        cached (CacheEntry | None): Cached entry of the image to revalidate.
 
     Returns:
-        The image with binary content set as an attribute.
+        The response, or None if the content could not be got.
     """
-    response = requests.get(image.url)
-    if response.status_code == 200:
-        image.bytes = io.BytesIO(response.content)
+    headers = cached.validators.conditional_headers() if cached is not None else None
+    with track_stage(image.date, "download"):
+        response = requests.get(resolve_url(image, resolution), stream=True, headers=headers)
+        with closing(response):
+            if cached is not None and response.status_code == NOT_MODIFIED:
+                return response
+            if response.status_code == 200:
+                body = BodyBuffer(spill_threshold, parse_content_length(response.headers))
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    body.write(chunk)
+                image.bytes = body.getbuffer()
+                return response
     print(f"Cannot get the content for image: {image}")
-    return image
+    return None
+
+
+def get_and_process_image(
+    image: NasaImage,
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+    resolution: str = URL,
+    preview_scale: int = 1,
+    cached: CacheEntry | None = None,
+) -> CacheEntry | None:
+    """Get the binary content of an image and count its colors.
+
+    Runs inside a pool worker so downloading and counting both happen in parallel, and only
+    the color count travels back to the parent process. The cached count of an image is
+    reused if the server answers that it has not been modified.
+
+    Args:
+        image (NasaImage): An image.
+        spill_threshold (int): Size in bytes above which the body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        preview_scale (int): Divisor of the width and height of the decoded image.
+        cached (CacheEntry | None): Cached entry of the image to revalidate.
+
+    Returns:
+        The number of unique colors of the image and the validators of its response, or None
+        if it could not be counted.
+    """
+    if image.media_type != "image":
+        return process_image(image)
+
+    response = get_image_binary(image, spill_threshold, resolution, cached)
+    if response is None:
+        return None
+    if cached is not None and response.status_code == NOT_MODIFIED:
+        print(f"Not modified: {image}")
+        return cached.revalidated(response.headers)
 
+    try:
+        return CacheEntry.from_response(process_image(image, preview_scale), response.headers)
+    finally:
+        image.bytes = None
 
-def process_image(image: NasaImage) -> int | None:
+
+def process_image(image: NasaImage, preview_scale: int = 1) -> int | None:
     """Process a given image.
 
     Args:
         image (NasaImage): An image object.
+        preview_scale (int): Divisor of the width and height of the decoded image.
 
     Returns:
         The number of unique colors of the image.
@@ -73,8 +153,13 @@ def process_image(image: NasaImage) -> int | None:
         return  # type: ignore
 
     print(f"Processing image: {image}")
-    img = Image.open(image.bytes)
-    return get_color_count(set(img.getdata()))
+    with track_stage(image.date, "decode"):
+        img = decode_image(image.bytes, preview_scale)  # type: ignore
+    with track_stage(image.date, "count"):
+        count = count_colors(img)
+        if count is not None:
+            return count
+        return get_color_count(set(img.getdata()))
 
 
 def get_color_count(unique_pixels: Set) -> int:
@@ -99,28 +184,116 @@ def process_images(images: List[NasaImage]):
         print(process_image(image))
 
 
-def main(api_url: str, start_date: str, end_date: str):
+def imap_planned(
+    pool: PoolType, task: Callable, plan: RunPlan, window: int
+) -> Iterator[Tuple[int, Any]]:
+    """Run a task over the pictures of a plan, launching each one when a worker is free.
+
+    The pictures are handed to the pool one at a time rather than all at once, so the plan
+    decides on each launch whether the time left can still cover a picture.
+
+    Args:
+        pool (PoolType): Pool running the task.
+        task (Callable): Picklable task run over each picture, with its stale cached entry, or
+            None, as the ``cached`` argument.
+        plan (RunPlan): Plan of the pictures to launch.
+        window (int): Maximum number of pictures handed to the pool at once.
+
+    Yields:
+        The index of each launched picture in the plan and the value of its task, in
+        completion order.
+
+    Raises:
+        Exception: The exception raised by a task.
+    """
+    completed: SimpleQueue = SimpleQueue()
+
+    def launch() -> bool:
+        index = plan.next()
+        if index is None:
+            return False
+        pool.apply_async(
+            task,
+            (plan.images[index],),
+            {"cached": plan.stale.get(index)},
+            callback=lambda value: completed.put((index, value, None)),
+            error_callback=lambda error: completed.put((index, None, error)),
+        )
+        return True
+
+    running = 0
+    while running < window and launch():
+        running += 1
+    while running:
+        index, value, error = completed.get()
+        running -= 1
+        if error is not None:
+            raise error
+        if launch():
+            running += 1
+        yield index, value
+
+
+def init_worker(profile_dir: str | None, track_memory: bool):
+    """Set up the profiling and memory tracking of a pool worker like in the parent process.
+
+    Args:
+        profile_dir (str | None): Directory of the profiling statistics, or None.
+        track_memory (bool): Whether memory tracking is enabled.
+    """
+    init_profiling(profile_dir)
+    init_memory_tracking(track_memory)
+
+
+def main(
+    api_url: str,
+    start_date: str,
+    end_date: str,
+    options: RunOptions = RunOptions(),
+    images: List[NasaImage] | None = None,
+):
     """Run the process for processing images in date range.
 
     Args:
         api_url (str): URL of the image metadata API endpoint.
         start_date (str): Start date of the date range.
         end_date (str): End date of the date range.
+        options (RunOptions): Tuning options. Uses ``cpu_workers`` as the pool size. Bodies
+            larger than ``spill_threshold`` are buffered on disk. The pictures are downloaded
+            with the ``resolution`` policy and decoded at ``preview_scale``. Pictures cached in
+            ``cache_dir`` are not downloaded again, unless they are within the last
+            ``revalidate_days`` and have been modified, and no picture is launched past the
+            ``deadline``. The results are written to ``sink`` as the images complete, or in
+            date order if ``ordered`` is set.
+        images (List[NasaImage] | None): Pictures of the date range, when their metadata has
+            already been processed. The metadata is fetched if None.
     """
-    n_cores = (cpu_count() - 1) | 1
+    n_cores = options.cpu_workers or (cpu_count() - 1) | 1
     print(f"Number of cores: {n_cores}")
 
     url = f"{api_url}&start_date={start_date}&end_date={end_date}"
 
-    with Pool(n_cores) as pool:
-        result = pool.apply_async(get_metadata, (url,))
-        data = result.get(timeout=10)
-
-        if not data:
-            print("An error ocurred retrieving the pictures metadata.")
-            return
-
-        images = process_metadata(data)
-        results = pool.map_async(get_image_binary, images)
-        imgs = [image for image in results.get()]
-        process_images(imgs)
+    initargs = (get_directory(), is_enabled())
+    with Pool(n_cores, initializer=init_worker, initargs=initargs) as pool:
+        if images is None:
+            result = pool.apply_async(
+                ProfiledCall(TrackedCall(get_metadata)), (url, options.cache_dir)
+            )
+            data = unwrap(result.get(timeout=10))
+
+            if not data:
+                print("An error ocurred retrieving the pictures metadata.")
+                return
+
+            images = process_metadata(data)
+        task = partial(
+            get_and_process_image,
+            spill_threshold=options.spill_threshold,
+            resolution=options.resolution,
+            preview_scale=options.preview_scale,
+        )
+        write = make_writer(options.sink, options.ordered)
+        plan = RunPlan(images, options, write, workers=n_cores)
+        for index, entry in imap_planned(pool, ProfiledCall(TrackedCall(task)), plan, n_cores):
+            plan.complete(index, unwrap(entry))
+        plan.finish()
@@ -0,0 +1,52 @@
+"""Holds the options shared by the execution modes."""
+
+from dataclasses import dataclass, field
+
+from cache import DEFAULT_REVALIDATE_DAYS
+from image import DEFAULT_SPILL_THRESHOLD
+from resolution import URL
+from scheduler import DEFAULT_MEMORY_BUDGET
+from sinks import ResultSink
+
+
+@dataclass(frozen=True)
+class RunOptions:
+    """Tuning options for an execution mode.
+
+    Modes ignore the options that do not apply to them, so the same object can be passed to
+    any of them.
+
+    Attributes:
+        io_workers: Maximum number of concurrent downloads. ``None`` starts one per image.
+        cpu_workers: Number of workers used for counting colors. ``None`` lets the mode decide.
+        memory_budget: Maximum number of bytes of image bodies held at once by the concurrent
+            downloads.
+        spill_threshold: Size in bytes above which an image body is buffered in a
+            memory-mapped temporary file instead of the process memory.
+        cache_dir: Directory where the color counts are persisted across runs. ``None`` keeps
+            them in memory only.
+        revalidate_days: Number of days back from today whose cached pictures are revalidated
+            with a conditional request, since recent entries may still change. 0 trusts every
+            cached count.
+        resolution: Resolution policy of the downloads, one of ``url``, ``hdurl`` or ``auto``.
+        preview_scale: Divisor of the width and height of the decoded pictures, one of 1, 2, 4
+            or 8. Counts taken above 1 are preview-scale figures.
+        sink: Sink where the results are written. ``None`` prints the number of colors of
+            each picture.
+        ordered: Whether the results are written in date order. Otherwise each result is
+            written as soon as its picture is counted.
+        deadline: Unix time by which the run must end. Pictures are not launched once the time
+            left cannot cover them. ``None`` runs until every picture is counted.
+    """
+
+    io_workers: int | None = None
+    cpu_workers: int | None = None
+    memory_budget: int = DEFAULT_MEMORY_BUDGET
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD
+    cache_dir: str | None = None
+    revalidate_days: int = DEFAULT_REVALIDATE_DAYS
+    resolution: str = URL
+    preview_scale: int = 1
+    sink: ResultSink | None = field(default=None, repr=False)
+    ordered: bool = False
+    deadline: float | None = None
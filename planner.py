@@ -0,0 +1,346 @@
+"""Includes the objects for planning the pictures of a run around its cache and deadline.
+
+The pictures whose colors are cached are not downloaded again, except the recent ones, which
+may still change: they are revalidated with a conditional request that only downloads them
+again if they have been modified.
+
+When the run has a deadline, the other pictures are launched by expected cost: the pictures
+without a download and the revalidations first, then the smallest files, then the most recent
+dates. A picture is only launched if the time left can cover its estimated cost along with the
+cost left of the pictures in flight, shared among the workers of the mode. The costs are
+refined with the durations observed during the run, so the run ends on its own before the
+deadline instead of being killed. The pictures that could not be covered are skipped and
+reported. The sizes of the pictures are probed before the run, within a share of the time
+left.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, timedelta
+from time import time
+from typing import Callable, Deque, Dict, List
+
+import requests
+
+from cache import CacheEntry, ResultCache
+from counter import cache_key
+from image import NasaImage
+from options import RunOptions
+from resolution import AUTO, URL, select_url
+from results import ColorCount, to_result
+from scheduler import DEFAULT_IMAGE_SIZE, parse_content_length
+
+DEFAULT_IMAGE_SECONDS = 1.0
+DEADLINE_WORKERS = 16
+PROBE_WORKERS = 16
+PROBE_TIMEOUT = 5
+MIN_PROBE_TIMEOUT = 0.01
+PROBE_SHARE = 0.1
+
+
+def probe_sizes(
+    urls: List[str], workers: int = PROBE_WORKERS, timeout: float | None = None
+) -> List[int | None]:
+    """Request the sizes of a set of pictures with concurrent ``HEAD`` requests.
+
+    Args:
+        urls (List[str]): URLs of the pictures.
+        workers (int): Maximum number of concurrent requests.
+        timeout (float | None): Seconds after which the sizes not known yet are given up.
+            Unbounded if None. Each request is given at least ``MIN_PROBE_TIMEOUT`` seconds.
+
+    Returns:
+        The ``Content-Length`` of each picture, or None if it could not be known in time.
+    """
+    request_timeout = PROBE_TIMEOUT
+    if timeout is not None:
+        request_timeout = max(min(PROBE_TIMEOUT, timeout), MIN_PROBE_TIMEOUT)
+
+    def probe(url: str) -> int | None:
+        try:
+            response = requests.head(url, allow_redirects=True, timeout=request_timeout)
+        except Exception:
+            return None
+        return parse_content_length(response.headers) if response.status_code == 200 else None
+
+    if not urls:
+        return []
+    executor = ThreadPoolExecutor(min(workers, len(urls)), thread_name_prefix="probe")
+    try:
+        futures = [executor.submit(probe, url) for url in urls]
+        wait(futures, timeout)
+        return [future.result() if future.done() else None for future in futures]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def bound_workers(workers: int | None, options: RunOptions) -> int | None:
+    """Bound the number of pictures a mode works on at once when the run has a deadline.
+
+    Without a bound every picture would be launched at once, before the deadline could gate
+    any of them.
+
+    Args:
+        workers (int | None): Number of pictures the mode works on at once, unbounded if None.
+        options (RunOptions): Options of the run. Uses ``deadline``.
+
+    Returns:
+        The number of workers, bounded to ``DEADLINE_WORKERS`` if it is None and the run has a
+        deadline.
+    """
+    if workers is None and options.deadline is not None:
+        return DEADLINE_WORKERS
+    return workers
+
+
+class RunPlan:
+    """Pictures of a run, in the order they are launched.
+
+    The plan is shared by the workers of a mode: each worker asks for the next picture when it
+    is free, so the deadline is checked when the work is launched rather than when it is
+    planned. The plan is thread-safe.
+
+    The results are written with the ``write`` function of the plan, if any: the cached counts
+    as soon as they are known, the counts of the launched pictures as they are completed, and a
+    None result for each skipped picture.
+
+    The cached pictures dated within the revalidation window are launched with their stale
+    entry, which the modes send as the validators of a conditional request.
+    """
+
+    def __init__(
+        self,
+        images: List[NasaImage] | None = None,
+        options: RunOptions = RunOptions(),
+        write: Callable[[int, ColorCount | None], None] | None = None,
+        sizes: List[int | None] | None = None,
+        clock: Callable[[], float] = time,
+        workers: int | None = 1,
+    ):
+        """Initialize the plan.
+
+        Args:
+            images (List[NasaImage] | None): Pictures of the run, in date order. More pictures
+                can be added later.
+            options (RunOptions): Options of the run. Uses ``cache_dir``, ``revalidate_days``,
+                ``deadline``, ``resolution`` and ``preview_scale``.
+            write (Callable[[int, ColorCount | None], None] | None): Function writing the
+                result of a picture given its index, such as the ones made by
+                ``sinks.make_writer``.
+            sizes (List[int | None] | None): Sizes of the pictures, if known. They are
+                requested when the run has a deadline and they are not given.
+            clock (Callable[[], float]): Source of the current Unix time in seconds.
+            workers (int | None): Number of pictures the mode works on at once, which share the
+                cost of the pictures in flight. One per picture if None.
+        """
+        self.images: List[NasaImage] = []
+        self.options = options
+        self.cache = ResultCache(options.cache_dir) if options.cache_dir else None
+        self.cached: Dict[int, int] = {}
+        self.stale: Dict[int, CacheEntry] = {}
+        self.skipped: List[int] = []
+        self._write = write
+        self._clock = clock
+        self._workers = workers
+        self._sizes: List[int | None] = []
+        self._pending: Deque[int] = deque()
+        self._started: Dict[int, float] = {}
+        self._estimates: Dict[int, float] = {}
+        self._unwritten_skips: List[int] = []
+        self._observed_seconds = 0.0
+        self._observed_bytes = 0
+        self._lock = threading.Lock()
+
+        images = images or []
+        if options.deadline is not None and sizes is None:
+            sizes = self._probe(images)
+        for index, image in enumerate(images):
+            self.add(image, sizes[index] if sizes else None)
+
+        if options.deadline is not None:
+            self._pending = deque(sorted(self._pending, key=self._priority))
+
+    def _probe(self, images: List[NasaImage]) -> List[int | None]:
+        # The auto policy only downloads the high resolution picture when it is small enough,
+        # so the standard one is probed.
+        resolution = URL if self.options.resolution == AUTO else self.options.resolution
+        probed = [
+            index
+            for index, image in enumerate(images)
+            if image.media_type == "image" and self._cached_entry(image) is None
+        ]
+        sizes: List[int | None] = [None] * len(images)
+        time_left = self.options.deadline - self._clock()  # type: ignore
+        if time_left <= 0:
+            return sizes
+
+        urls = [select_url(images[index], resolution) for index in probed]
+        # The pictures not probed in time are estimated at the default size.
+        for index, size in zip(probed, probe_sizes(urls, timeout=time_left * PROBE_SHARE)):
+            sizes[index] = size
+        return sizes
+
+    def _cached_entry(self, image: NasaImage) -> CacheEntry | None:
+        if self.cache is None or image.media_type != "image":
+            return None
+        return self.cache.get_entry(
+            cache_key(image, self.options.resolution, self.options.preview_scale)
+        )
+
+    def _is_recent(self, image: NasaImage) -> bool:
+        today = date.fromtimestamp(self._clock())
+        return date.fromisoformat(image.date) > today - timedelta(days=self.options.revalidate_days)
+
+    def _is_cheap(self, index: int) -> bool:
+        # Pictures without a download, and stale pictures that are expected to be revalidated
+        # without downloading them again.
+        if self.images[index].media_type != "image":
+            return True
+        return index in self.stale and bool(self.stale[index].validators.conditional_headers())
+
+    def _priority(self, index: int) -> tuple:
+        image = self.images[index]
+        if self._is_cheap(index):
+            return (0, 0, 0)
+        size = self._sizes[index]
+        return (
+            1,
+            DEFAULT_IMAGE_SIZE if size is None else size,
+            -date.fromisoformat(image.date).toordinal(),
+        )
+
+    def add(self, image: NasaImage, size: int | None = None) -> int:
+        """Add a picture after the pictures already planned.
+
+        The result of a cached picture is written right away, unless it is recent enough to be
+        revalidated, and the other pictures are queued to be launched.
+
+        Args:
+            image (NasaImage): An image object.
+            size (int | None): Size of the picture, if known.
+
+        Returns:
+            The index of the picture in the plan.
+        """
+        entry = self._cached_entry(image)
+        stale = entry is not None and self._is_recent(image)
+        with self._lock:
+            index = len(self.images)
+            self.images.append(image)
+            self._sizes.append(size)
+            if entry is None or stale:
+                self._pending.append(index)
+            else:
+                self.cached[index] = entry.colors
+            if stale:
+                self.stale[index] = entry  # type: ignore
+
+        if index in self.cached and self._write is not None:
+            self._write(index, to_result(image, self.cached[index], self.options.preview_scale))
+        return index
+
+    @property
+    def remaining(self) -> int:
+        """Get the number of pictures waiting to be launched.
+
+        Returns:
+            The number of pictures neither launched nor skipped yet.
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def estimate(self, index: int) -> float:
+        """Estimate the number of seconds needed to download and count a picture.
+
+        Args:
+            index (int): Index of the picture.
+
+        Returns:
+            The estimated cost, proportional to the size of the picture at the rate observed
+            so far in the run. Pictures without a download or expected to be revalidated cost
+            nothing.
+        """
+        if self._is_cheap(index):
+            return 0.0
+
+        size = self._sizes[index] or DEFAULT_IMAGE_SIZE
+        if self._observed_bytes:
+            return size * self._observed_seconds / self._observed_bytes
+        return DEFAULT_IMAGE_SECONDS * size / DEFAULT_IMAGE_SIZE
+
+    def next(self) -> int | None:
+        """Launch the next picture that the time left can cover.
+
+        The pictures in flight are expected to take the rest of their estimated cost, and the
+        workers share it with the next picture. The pictures that the time left cannot cover
+        are skipped, and so is every picture once the deadline has passed.
+
+        Returns:
+            The index of the picture, or None if no picture is left to launch.
+        """
+        with self._lock:
+            while self._pending:
+                index = self._pending.popleft()
+                now = self._clock()
+                deadline = self.options.deadline
+                estimate = self.estimate(index)
+                if deadline is None or (
+                    now < deadline and now + self._backlog(now, estimate) <= deadline
+                ):
+                    self._started[index] = now
+                    self._estimates[index] = estimate
+                    return index
+
+                self.skipped.append(index)
+                self._unwritten_skips.append(index)
+            return None
+
+    def _backlog(self, now: float, estimate: float) -> float:
+        left = sum(
+            max(self._estimates[index] - (now - started), 0.0)
+            for index, started in self._started.items()
+        )
+        workers = self._workers or len(self._started) + 1
+        return (left + estimate) / workers
+
+    def complete(self, index: int, entry: CacheEntry | None):
+        """Record the result of a launched picture.
+
+        The duration of the picture refines the estimated costs, its count is stored in the
+        cache and its result is written along with the pictures skipped meanwhile.
+
+        Args:
+            index (int): Index of the picture.
+            entry (CacheEntry | None): Number of unique colors of the picture and validators of
+                its response, or None if it could not be counted.
+        """
+        image = self.images[index]
+        with self._lock:
+            started = self._started.pop(index, None)
+            self._estimates.pop(index, None)
+            if started is not None and not self._is_cheap(index):
+                self._observed_seconds += self._clock() - started
+                self._observed_bytes += self._sizes[index] or DEFAULT_IMAGE_SIZE
+
+        colors = None if entry is None else entry.colors
+        if self.cache is not None and entry is not None:
+            key = cache_key(image, self.options.resolution, self.options.preview_scale)
+            self.cache.set(key, entry.colors, entry.validators)
+        if self._write is not None:
+            self._write(index, to_result(image, colors, self.options.preview_scale))
+            self._write_skips()
+
+    def _write_skips(self):
+        with self._lock:
+            skips, self._unwritten_skips = self._unwritten_skips, []
+        for index in skips:
+            self._write(index, None)  # type: ignore
+
+    def finish(self):
+        """Write the pending skips and report the skipped pictures."""
+        if self._write is not None:
+            self._write_skips()
+        if self.skipped:
+            dates = ", ".join(sorted(self.images[index].date for index in self.skipped))
+            print(f"Skipped {len(self.skipped)} pictures the deadline could not cover: {dates}")
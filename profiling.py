@@ -0,0 +1,158 @@
+"""Includes the functions and objects for profiling the execution modes.
+
+Profiling is enabled once per process with a directory. Every thread that runs profiled code
+keeps its own ``cProfile`` profiler and writes its statistics to a file of that directory, so
+the parent process, pool workers and thread-pool threads are all covered. At the end of a run
+the files are merged into a single ``pstats`` file, which can be loaded with ``pstats``,
+snakeviz, gprof2dot or flameprof.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+from contextlib import contextmanager
+from glob import glob
+from typing import Any, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+MERGED_FILE_NAME = "merged.pstats"
+
+_directory: str | None = None
+_local = threading.local()
+
+
+def enable(directory: str):
+    """Enable profiling for the current process.
+
+    Args:
+        directory (str): Directory where the profiling statistics are written.
+    """
+    global _directory
+    os.makedirs(directory, exist_ok=True)
+    _directory = directory
+
+
+def get_directory() -> str | None:
+    """Get the directory of the profiling statistics.
+
+    Returns:
+        The directory, or None if profiling is disabled.
+    """
+    return _directory
+
+
+def init_worker(directory: str | None):
+    """Set up profiling in a pool worker.
+
+    A forked worker inherits the profiler that was running in the parent thread, which would
+    never write its statistics, so it is dropped before starting a fresh one.
+
+    Args:
+        directory (str | None): Directory of the profiling statistics, or None to disable it.
+    """
+    global _directory
+    sys.setprofile(None)
+    _local.__dict__.clear()
+    _directory = directory
+
+
+def _stats_path(directory: str) -> str:
+    thread_name = re.sub(r"[^\w.-]", "_", threading.current_thread().name)
+    return os.path.join(directory, f"{os.getpid()}-{thread_name}.pstats")
+
+
+@contextmanager
+def profile_block() -> Iterator[None]:
+    """Profile the current thread while the context is active.
+
+    Statistics accumulate across the blocks run by the same thread and are written after each
+    one, so they are kept even if the worker running them is terminated. Nested blocks are
+    recorded by the outermost one.
+
+    Yields:
+        Nothing.
+    """
+    directory = _directory
+    if directory is None or getattr(_local, "active", False):
+        yield
+        return
+
+    profiler = getattr(_local, "profiler", None)
+    if profiler is None:
+        profiler = _local.profiler = cProfile.Profile()
+
+    _local.active = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _local.active = False
+        profiler.dump_stats(_stats_path(directory))
+
+
+class ProfiledCall:
+    """Picklable wrapper that profiles a callable in the thread or process that runs it."""
+
+    def __init__(self, func: Callable):
+        """Initialize the wrapper.
+
+        Args:
+            func (Callable): The callable to profile. It must be picklable to be sent to pool
+                workers.
+        """
+        self.func = func
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        """Call the wrapped callable while profiling it.
+
+        Returns:
+            The value returned by the wrapped callable.
+        """
+        with profile_block():
+            return self.func(*args, **kwargs)
+
+
+def merge(directory: str | None = None) -> str | None:
+    """Merge the statistics written by every process and thread.
+
+    Args:
+        directory (str | None): Directory of the profiling statistics. Defaults to the enabled
+            one.
+
+    Returns:
+        The path of the merged statistics, or None if there is nothing to merge.
+    """
+    directory = directory or _directory
+    if directory is None:
+        return None
+
+    merged_path = os.path.join(directory, MERGED_FILE_NAME)
+    paths = [path for path in glob(os.path.join(directory, "*.pstats")) if path != merged_path]
+    if not paths:
+        return None
+
+    stats = pstats.Stats(*paths)
+    stats.dump_stats(merged_path)
+    return merged_path
+
+
+def summarize(path: str, limit: int = 15) -> str:
+    """Build a summary of the most expensive functions of a statistics file.
+
+    Args:
+        path (str): Path of the statistics file.
+        limit (int): Number of functions of the summary.
+
+    Returns:
+        The functions sorted by cumulative time.
+    """
+    stream = io.StringIO()
+    pstats.Stats(path, stream=stream).sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
@@ -0,0 +1,91 @@
+"""Includes the functions for choosing the resolution of the pictures to download.
+
+The metadata of most pictures links a standard resolution version (``url``) and a high
+resolution one (``hdurl``). The ``auto`` policy downloads the high resolution version when its
+``Content-Length`` is small enough, and the standard one otherwise.
+"""
+
+from typing import Any
+
+import requests
+from aiohttp import ClientSession
+
+from image import NasaImage
+from scheduler import parse_content_length
+
+URL = "url"
+HDURL = "hdurl"
+AUTO = "auto"
+RESOLUTIONS = (URL, HDURL, AUTO)
+DEFAULT_HD_SIZE_LIMIT = 8 * 1024 * 1024
+
+
+def select_url(
+    image: NasaImage,
+    resolution: str = URL,
+    hd_size: int | None = None,
+    hd_size_limit: int = DEFAULT_HD_SIZE_LIMIT,
+) -> str:
+    """Choose the URL of a picture for a resolution policy.
+
+    Args:
+        image (NasaImage): An image object.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        hd_size (int | None): Size in bytes of the high resolution picture, if known.
+        hd_size_limit (int): Largest high resolution picture downloaded by the ``auto`` policy.
+
+    Returns:
+        The URL to download. The standard resolution one when there is no high resolution
+        picture, or when its size is unknown or too large for the ``auto`` policy.
+
+    Raises:
+        ValueError: If the resolution policy is not supported.
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unsupported resolution {resolution}, use one of {RESOLUTIONS}")
+
+    if resolution == URL or not image.hdurl:
+        return image.url
+    if resolution == HDURL:
+        return image.hdurl
+    if hd_size is not None and hd_size <= hd_size_limit:
+        return image.hdurl
+    return image.url
+
+
+def resolve_url(image: NasaImage, resolution: str = URL, session: Any = requests) -> str:
+    """Choose the URL of a picture, requesting the size of the high resolution one if needed.
+
+    Args:
+        image (NasaImage): An image object.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        session (Any): The ``requests`` module or a session used for the ``HEAD`` request.
+
+    Returns:
+        The URL to download.
+    """
+    if resolution != AUTO or not image.hdurl:
+        return select_url(image, resolution)
+
+    response = session.head(image.hdurl, allow_redirects=True)
+    hd_size = parse_content_length(response.headers) if response.status_code == 200 else None
+    return select_url(image, resolution, hd_size)
+
+
+async def resolve_url_async(image: NasaImage, resolution: str, session: ClientSession) -> str:
+    """Choose the URL of a picture, requesting the size of the high resolution one if needed.
+
+    Args:
+        image (NasaImage): An image object.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        session (ClientSession): Session used for the ``HEAD`` request.
+
+    Returns:
+        The URL to download.
+    """
+    if resolution != AUTO or not image.hdurl:
+        return select_url(image, resolution)
+
+    async with session.head(image.hdurl, allow_redirects=True) as response:
+        hd_size = parse_content_length(response.headers) if response.status == 200 else None
+    return select_url(image, resolution, hd_size)
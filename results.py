@@ -0,0 +1,40 @@
+"""Holds the objects for the results of counting the colors of NASA's APOD."""
+
+from typing import NamedTuple
+
+from image import NasaImage
+
+
+class ColorCount(NamedTuple):
+    """Number of unique colors of a NASA's APOD.
+
+    Attributes:
+        date: Date of the picture.
+        title: Title of the picture.
+        url: URL of the picture.
+        media_type: Media type of the picture.
+        colors: Number of unique colors, or None if the picture could not be counted.
+        scale: Divisor of the width and height at which the picture was decoded. Counts above 1
+            are preview-scale figures, lower than the count of the full picture.
+    """
+
+    date: str
+    title: str
+    url: str
+    media_type: str
+    colors: int | None
+    scale: int = 1
+
+
+def to_result(image: NasaImage, colors: int | None, preview_scale: int = 1) -> ColorCount:
+    """Build the result of an image.
+
+    Args:
+        image (NasaImage): An image object.
+        colors (int | None): Number of unique colors of the image.
+        preview_scale (int): Divisor of the width and height of the decoded image.
+
+    Returns:
+        The result of the image.
+    """
+    return ColorCount(image.date, image.title, image.url, image.media_type, colors, preview_scale)
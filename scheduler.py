@@ -0,0 +1,200 @@
+"""Includes the objects for admitting downloads against a memory budget."""
+
+import asyncio
+import itertools
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from heapq import heapify, heappop, heappush
+from typing import AsyncIterator, Iterator, List, Mapping, Tuple
+
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+DEFAULT_IMAGE_SIZE = 2 * 1024 * 1024
+
+
+def parse_content_length(headers: Mapping[str, str]) -> int | None:
+    """Get the size of a response body from its headers.
+
+    Args:
+        headers (Mapping[str, str]): HTTP response headers.
+
+    Returns:
+        The value of the ``Content-Length`` header, or None if it is missing or invalid.
+    """
+    try:
+        size = int(headers["Content-Length"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return size if size >= 0 else None
+
+
+class _Budget:
+    """Bookkeeping shared by the thread and asyncio byte budgets."""
+
+    def __init__(self, capacity: int = DEFAULT_MEMORY_BUDGET):
+        self.capacity = max(1, capacity)
+        self.in_use = 0
+        self._waiting: List[Tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._observed_bytes = 0
+        self._observed_count = 0
+
+    def estimate(self, content_length: int | None) -> int:
+        """Get the number of bytes to reserve for a download.
+
+        Args:
+            content_length (int | None): Announced size of the body, if any.
+
+        Returns:
+            The announced size, or the mean size of the bodies downloaded so far. The result
+            never exceeds the capacity, so a body larger than the budget is admitted alone.
+        """
+        if content_length is None:
+            if self._observed_count:
+                content_length = self._observed_bytes // self._observed_count
+            else:
+                content_length = DEFAULT_IMAGE_SIZE
+        return min(max(content_length, 1), self.capacity)
+
+    def observe(self, size: int):
+        """Record the actual size of a downloaded body to refine the fallback estimate.
+
+        Args:
+            size (int): Size of the body in bytes.
+        """
+        self._observed_bytes += size
+        self._observed_count += 1
+
+    def _enqueue(self, size: int) -> Tuple[int, int]:
+        entry = (size, next(self._counter))
+        heappush(self._waiting, entry)
+        return entry
+
+    def _dequeue(self, entry: Tuple[int, int]):
+        self._waiting.remove(entry)
+        heapify(self._waiting)
+
+    def _can_admit(self, entry: Tuple[int, int]) -> bool:
+        return self._waiting[0] == entry and self.in_use + entry[0] <= self.capacity
+
+    def _admit(self):
+        size, _ = heappop(self._waiting)
+        self.in_use += size
+
+
+class ByteBudget(_Budget):
+    """Weighted semaphore that admits downloads by size, for threads.
+
+    Waiting downloads are admitted smallest first, so small images keep flowing while the
+    large ones wait for enough room.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_MEMORY_BUDGET):
+        super().__init__(capacity)
+        self._condition = threading.Condition()
+
+    def acquire(self, size: int):
+        """Block until the given number of bytes fits in the budget.
+
+        Args:
+            size (int): Number of bytes to reserve, as returned by ``estimate``.
+        """
+        with self._condition:
+            entry = self._enqueue(size)
+            self._condition.wait_for(lambda: self._can_admit(entry))
+            self._admit()
+            self._condition.notify_all()
+
+    def observe(self, size: int):
+        """Record the actual size of a downloaded body to refine the fallback estimate.
+
+        Args:
+            size (int): Size of the body in bytes.
+        """
+        with self._condition:
+            super().observe(size)
+
+    def release(self, size: int):
+        """Give back reserved bytes to the budget.
+
+        Args:
+            size (int): Number of reserved bytes.
+        """
+        with self._condition:
+            self.in_use -= size
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, content_length: int | None) -> Iterator[int]:
+        """Reserve room for a body while the context is active.
+
+        Args:
+            content_length (int | None): Announced size of the body, if any.
+
+        Yields:
+            The number of reserved bytes.
+        """
+        with self._condition:
+            size = self.estimate(content_length)
+        self.acquire(size)
+        try:
+            yield size
+        finally:
+            self.release(size)
+
+
+class AsyncByteBudget(_Budget):
+    """Weighted semaphore that admits downloads by size, for asyncio tasks.
+
+    Waiting downloads are admitted smallest first, so small images keep flowing while the
+    large ones wait for enough room.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_MEMORY_BUDGET):
+        super().__init__(capacity)
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size: int):
+        """Wait until the given number of bytes fits in the budget.
+
+        A cancelled wait leaves the queue, so it does not hold back the downloads behind it.
+
+        Args:
+            size (int): Number of bytes to reserve, as returned by ``estimate``.
+        """
+        async with self._condition:
+            entry = self._enqueue(size)
+            try:
+                await self._condition.wait_for(lambda: self._can_admit(entry))
+            except BaseException:
+                self._dequeue(entry)
+                self._condition.notify_all()
+                raise
+            self._admit()
+            self._condition.notify_all()
+
+    async def release(self, size: int):
+        """Give back reserved bytes to the budget.
+
+        Args:
+            size (int): Number of reserved bytes.
+        """
+        async with self._condition:
+            self.in_use -= size
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def reserve(self, content_length: int | None) -> AsyncIterator[int]:
+        """Reserve room for a body while the context is active.
+
+        Args:
+            content_length (int | None): Announced size of the body, if any.
+
+        Yields:
+            The number of reserved bytes.
+        """
+        size = self.estimate(content_length)
+        await self.acquire(size)
+        try:
+            yield size
+        finally:
+            await self.release(size)
@@ -0,0 +1,131 @@
+"""Includes the functions for serving the colors of Nasa images over a local HTTP API."""
+
+import json
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from counter import ApodColorCounter
+from options import RunOptions
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+
+
+class ColorsServer(ThreadingHTTPServer):
+    """HTTP server answering the requests with a shared color counter.
+
+    Each request is handled in its own thread, and the counter keeps its session, process pool
+    and caches warm between requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], counter: ApodColorCounter):
+        """Initialize the server.
+
+        Args:
+            address (Tuple[str, int]): Host and port to listen on.
+            counter (ApodColorCounter): Counter shared by the requests.
+        """
+        super().__init__(address, ColorsHandler)
+        self.counter = counter
+
+
+class ColorsHandler(BaseHTTPRequestHandler):
+    """Handles the requests of the colors API.
+
+    ``GET /colors?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD`` responds with a JSON list with
+    the date, title, url, media type and number of colors of each picture of the range.
+    """
+
+    server: ColorsServer
+
+    def do_GET(self):
+        """Respond to a GET request."""
+        url = urlsplit(self.path)
+        if url.path != "/colors":
+            self.send_json(404, {"error": f"Unknown path {url.path}"})
+            return
+
+        query = parse_qs(url.query)
+        start_date = query.get("start_date", [""])[0]
+        end_date = query.get("end_date", [""])[0]
+        if not start_date or not end_date:
+            self.send_json(400, {"error": "start_date and end_date are required."})
+            return
+
+        try:
+            if date.fromisoformat(start_date) > date.fromisoformat(end_date):
+                self.send_json(400, {"error": "start_date must not be after end_date."})
+                return
+        except ValueError:
+            self.send_json(400, {"error": "Dates must be in format YYYY-MM-DD."})
+            return
+
+        try:
+            results = [
+                result._asdict() for result in self.server.counter.count(start_date, end_date)
+            ]
+        except requests.RequestException as error:
+            self.send_json(502, {"error": f"Cannot get the pictures: {error}"})
+            return
+        except Exception as error:
+            self.send_json(500, {"error": f"Cannot count the colors: {error}"})
+            return
+
+        self.send_json(200, results)
+
+    def send_json(self, status: int, body: Any):
+        """Send a JSON response.
+
+        Args:
+            status (int): HTTP status code.
+            body (Any): Object serialized as the response body.
+        """
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main(
+    api_url: str,
+    start_date: str,
+    end_date: str,
+    options: RunOptions = RunOptions(),
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+):
+    """Serve the colors of the pictures over HTTP until interrupted.
+
+    The pictures of the date range are counted before serving, so the cache starts warm. A
+    failed warm-up is reported and the server starts anyway.
+
+    Args:
+        api_url (str): URL of the image metadata API endpoint.
+        start_date (str): Start date of the date range counted on startup.
+        end_date (str): End date of the date range counted on startup.
+        options (RunOptions): Tuning options. Uses ``cpu_workers`` as the pool size. The counts
+            are persisted to ``cache_dir`` when set.
+        host (str): Host to listen on.
+        port (int): Port to listen on.
+    """
+    with ApodColorCounter(api_url, options) as counter:
+        try:
+            for result in counter.count(start_date, end_date):
+                print(f"Warmed up {result.date}: {result.colors}")
+        except Exception as error:
+            print(f"Cannot warm up the cache: {error}")
+
+        with ColorsServer((host, port), counter) as server:
+            print(f"Serving colors on http://{host}:{server.server_port}/colors")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                print("Stopping the server.")
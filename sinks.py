@@ -0,0 +1,345 @@
+"""Includes the sinks where the color counts of NASA's APOD are written.
+
+The counts are printed by default. They can also be written as columnar output that analytics
+tools load without parsing the standard output: CSV, Parquet or Arrow files when ``pyarrow``
+is installed, or a NumPy structured array. The results are buffered and written in batches.
+
+The modes write each result as soon as its picture is counted. A reorder buffer can be put in
+front of the sink to write them in date order instead.
+"""
+
+import csv
+import os
+import sys
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Type
+
+import numpy as np
+
+from results import ColorCount
+
+DEFAULT_BATCH_SIZE = 1024
+MISSING_COLORS = -1
+
+
+class ResultSink(ABC):
+    """Base class of the sinks, buffering the results and writing them in batches.
+
+    Sinks are context managers: the pending results are written and the output is closed on
+    exit.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE):
+        """Initialize the sink.
+
+        Args:
+            batch_size (int): Number of results buffered before they are written.
+        """
+        self.batch_size = max(batch_size, 1)
+        self._batch: List[ColorCount] = []
+
+    def write(self, result: ColorCount):
+        """Add a result to the sink.
+
+        Args:
+            result (ColorCount): Result of a picture.
+        """
+        self._batch.append(result)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered results."""
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._write_batch(batch)
+
+    def close(self):
+        """Write the buffered results and close the output."""
+        self.flush()
+
+    @abstractmethod
+    def _write_batch(self, batch: List[ColorCount]):
+        """Write a batch of results to the output."""
+
+    def __enter__(self) -> "ResultSink":
+        """Use the sink as a context manager that closes it on exit.
+
+        Returns:
+            The sink.
+        """
+        return self
+
+    def __exit__(self, *args):
+        """Close the sink."""
+        self.close()
+
+
+class PrintSink(ResultSink):
+    """Sink printing the number of colors of each picture as soon as it is written."""
+
+    def __init__(self):
+        """Initialize the sink."""
+        super().__init__(batch_size=1)
+
+    def _write_batch(self, batch: List[ColorCount]):
+        for result in batch:
+            # A single write, so the lines do not mix with those printed by other threads.
+            sys.stdout.write(f"{result.colors}\n")
+
+
+class CsvSink(ResultSink):
+    """Sink writing the results as a CSV file with a header row.
+
+    The colors of the pictures that could not be counted are left empty.
+    """
+
+    def __init__(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        """Initialize the sink and write the header.
+
+        Args:
+            path (str): Path of the CSV file.
+            batch_size (int): Number of results buffered before they are written.
+        """
+        super().__init__(batch_size)
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(ColorCount._fields)
+
+    def _write_batch(self, batch: List[ColorCount]):
+        self._writer.writerows(batch)
+
+    def close(self):
+        """Write the buffered results and close the file."""
+        super().close()
+        self._file.close()
+
+
+def import_pyarrow() -> Any:
+    """Import ``pyarrow``, which is an optional dependency.
+
+    Returns:
+        The ``pyarrow`` module.
+
+    Raises:
+        ImportError: If ``pyarrow`` is not installed.
+    """
+    try:
+        import pyarrow
+    except ImportError as error:
+        raise ImportError("Install pyarrow to write Parquet or Arrow files.") from error
+    return pyarrow
+
+
+def arrow_schema(pa: Any) -> Any:
+    """Build the Arrow schema of the results.
+
+    Args:
+        pa (Any): The ``pyarrow`` module.
+
+    Returns:
+        The schema, with nullable colors.
+    """
+    return pa.schema(
+        [
+            ("date", pa.string()),
+            ("title", pa.string()),
+            ("url", pa.string()),
+            ("media_type", pa.string()),
+            ("colors", pa.int64()),
+            ("scale", pa.int64()),
+        ]
+    )
+
+
+class _ArrowBatchSink(ResultSink):
+    def __init__(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        super().__init__(batch_size)
+        self._pa = import_pyarrow()
+        self._schema = arrow_schema(self._pa)
+        self._writer = self._open_writer(path)
+
+    @abstractmethod
+    def _open_writer(self, path: str) -> Any:
+        """Open the writer of the batches."""
+
+    def _write_batch(self, batch: List[ColorCount]):
+        columns = [
+            self._pa.array(values, type=field.type)
+            for values, field in zip(zip(*batch), self._schema)
+        ]
+        self._writer.write_batch(self._pa.record_batch(columns, schema=self._schema))
+
+    def close(self):
+        """Write the buffered results and close the file."""
+        super().close()
+        self._writer.close()
+
+
+class ParquetSink(_ArrowBatchSink):
+    """Sink writing the results as a Parquet file, one row group per batch.
+
+    Requires ``pyarrow``.
+    """
+
+    def _open_writer(self, path: str) -> Any:
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(path, self._schema)
+
+
+class ArrowSink(_ArrowBatchSink):
+    """Sink writing the results as an Arrow IPC file, also readable as Feather.
+
+    Requires ``pyarrow``.
+    """
+
+    def _open_writer(self, path: str) -> Any:
+        return self._pa.ipc.new_file(path, self._schema)
+
+
+class NumpySink(ResultSink):
+    """Sink writing the results as a NumPy structured array in a ``.npy`` file.
+
+    The batches are appended to one buffer per column, and the array is saved on close since
+    its string widths are only known once every result has been written. The colors of the
+    pictures that could not be counted are stored as -1.
+    """
+
+    def __init__(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        """Initialize the sink.
+
+        Args:
+            path (str): Path of the ``.npy`` file.
+            batch_size (int): Number of results buffered before they are added to the columns.
+        """
+        super().__init__(batch_size)
+        self.path = path
+        self._columns: Dict[str, List] = {field: [] for field in ColorCount._fields}
+
+    def _write_batch(self, batch: List[ColorCount]):
+        for column, values in zip(self._columns.values(), zip(*batch)):
+            column.extend(values)
+
+    def to_array(self) -> np.ndarray:
+        """Build the structured array of the results written so far.
+
+        Returns:
+            The array, with one record per result.
+        """
+        self.flush()
+        dtype = []
+        for field, values in self._columns.items():
+            if field in ("colors", "scale"):
+                dtype.append((field, np.int64))
+            else:
+                dtype.append((field, f"U{max(map(len, values), default=1)}"))
+
+        colors = [MISSING_COLORS if value is None else value for value in self._columns["colors"]]
+        array = np.empty(len(colors), dtype=dtype)
+        for field, values in self._columns.items():
+            array[field] = colors if field == "colors" else values
+        return array
+
+    def close(self):
+        """Save the array of the results."""
+        np.save(self.path, self.to_array())
+
+
+class ReorderBuffer:
+    """Writes the results completed out of order to a sink in the order of their indexes.
+
+    A result is only held until every result before it has arrived, so each result is written
+    as soon as the order allows.
+    """
+
+    def __init__(self, sink: ResultSink, start: int = 0):
+        """Initialize the buffer.
+
+        Args:
+            sink (ResultSink): Sink where the results are written.
+            start (int): Index of the first result.
+        """
+        self.sink = sink
+        self._next = start
+        self._pending: Dict[int, ColorCount | None] = {}
+
+    def put(self, index: int, result: ColorCount | None):
+        """Add a result and write every result whose turn has come.
+
+        Args:
+            index (int): Position of the result, the pictures are indexed in date order.
+            result (ColorCount | None): Result of a picture, or None if the picture was
+                skipped and has no result to write.
+        """
+        self._pending[index] = result
+        while self._next in self._pending:
+            result = self._pending.pop(self._next)
+            if result is not None:
+                self.sink.write(result)
+            self._next += 1
+
+    def __len__(self) -> int:
+        """Get the number of results held until their turn comes.
+
+        Returns:
+            The number of held results.
+        """
+        return len(self._pending)
+
+
+def make_writer(
+    sink: ResultSink | None = None, ordered: bool = False
+) -> Callable[[int, ColorCount | None], None]:
+    """Make the function used by the modes to write the results as their pictures complete.
+
+    Args:
+        sink (ResultSink | None): Sink where the results are written. They are printed if None.
+        ordered (bool): Whether the results are written in date order instead of completion
+            order.
+
+    Returns:
+        A function taking the index of a picture, in date order, and its result, or None if
+        the picture was skipped.
+    """
+    sink = sink or PrintSink()
+    if ordered:
+        return ReorderBuffer(sink).put
+
+    def write(index: int, result: ColorCount | None):
+        if result is not None:
+            sink.write(result)  # type: ignore
+
+    return write
+
+
+SINKS: Dict[str, Type[ResultSink]] = {
+    ".csv": CsvSink,
+    ".parquet": ParquetSink,
+    ".arrow": ArrowSink,
+    ".feather": ArrowSink,
+    ".npy": NumpySink,
+}
+
+
+def open_sink(path: str | None = None, batch_size: int = DEFAULT_BATCH_SIZE) -> ResultSink:
+    """Open the sink of an output path, chosen by its extension.
+
+    Args:
+        path (str | None): Path of the output file. The results are printed if None.
+        batch_size (int): Number of results buffered before they are written.
+
+    Returns:
+        The sink.
+
+    Raises:
+        ValueError: If the extension of the path is not supported.
+        ImportError: If the format requires ``pyarrow`` and it is not installed.
+    """
+    if path is None:
+        return PrintSink()
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINKS:
+        raise ValueError(f"Unsupported output format {extension!r}, use one of {sorted(SINKS)}")
+    return SINKS[extension](path, batch_size)  # type: ignore
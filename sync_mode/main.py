@@ -1,27 +1,35 @@
 """Includes the functions for get and process Nasa images in sync mode."""
 
-import io
-from typing import Dict, List, Set
+from contextlib import closing
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
 
 import requests
-from PIL import Image
 
-from image import NasaImage
+from cache import NOT_MODIFIED, CacheEntry, ResponseCache, metadata_cache
+from colors import count_colors, decode_image
+from image import CHUNK_SIZE, DEFAULT_SPILL_THRESHOLD, BodyBuffer, NasaImage
+from memtrack import track_stage
+from metadata import fetch_metadata
+from options import RunOptions
+from planner import RunPlan
+from resolution import URL, resolve_url
+from results import to_result
+from scheduler import parse_content_length
+from sinks import PrintSink, ResultSink, make_writer
 
 
-def get_metadata(api_url: str):
+def get_metadata(api_url: str, cache: ResponseCache | None = None):
     """Get the metadata from the given URL.
 
     Args:
         url (str): URL of the metadata endpoint.
+        cache (ResponseCache | None): Cache of the metadata responses, revalidated if given.
 
     Returns:
         List[Dict]: List of decoded data containing images metadata.
     """
-    response = requests.get(api_url)
-    if response.status_code == 200:
-        return response.json()
-    return []
+    with track_stage("metadata", "metadata"):
+        return fetch_metadata(api_url, cache)
 
 
 def process_metadata(data: List[Dict]) -> List[NasaImage]:
@@ -34,43 +42,135 @@ def process_metadata(data: List[Dict]) -> List[NasaImage]:
         List[NasaImage]: Returns a list of NASA images objects.
     """
     return [
-        NasaImage(url=p["url"], media_type=p["media_type"], title=p["title"], date=p["date"])
+        NasaImage(
+            url=p["url"],
+            media_type=p["media_type"],
+            title=p["title"],
+            date=p["date"],
+            hdurl=p.get("hdurl"),
+        )
         for p in data
     ]
 
 
-def get_content(image: NasaImage):
+def get_content(
+    image: NasaImage,
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+    resolution: str = URL,
+    cached: CacheEntry | None = None,
+) -> requests.Response | None:
     """Get the binary content of an image using its URL.
 
-    The binary content is loaded using an in-memory buffer and set to
-    the image bytes attribute.
+    The binary content is streamed into a buffer and set to the image bytes attribute. Bodies
+    larger than the spill threshold are buffered in a memory-mapped temporary file. When the
+    image has a cached entry, it is requested with the entry validators and nothing is
+    downloaded if the server answers that it has not been modified.
 
     Args:
         image (NasaImage): An image.
+        spill_threshold (int): Size in bytes above which the body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        cached (CacheEntry | None): Cached entry of the image to revalidate.
+
+    Returns:
+        The response, or None if the content could not be got.
     """
     print(f"Getting data for: {image}")
-    response = requests.get(image.url)
-    if response.status_code == 200:
-        image.bytes = io.BytesIO(response.content)
-        return
+    url = resolve_url(image, resolution)
+    with track_stage(image.date, "download"):
+        if cached is None:
+            response = requests.get(url, stream=True)
+        else:
+            headers = cached.validators.conditional_headers()
+            response = requests.get(url, stream=True, headers=headers)
+        with closing(response):
+            if cached is not None and response.status_code == NOT_MODIFIED:
+                return response
+            if response.status_code == 200:
+                body = BodyBuffer(spill_threshold, parse_content_length(response.headers))
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    body.write(chunk)
+                image.bytes = body.getbuffer()
+                return response
     print(f"Cannot get the content for image: {image}")
+    return None
 
 
-def get_images(images: List[NasaImage]):
+def get_images(
+    images: List[NasaImage], spill_threshold: int = DEFAULT_SPILL_THRESHOLD, resolution: str = URL
+):
     """Get the binary content for a list of NASA images.
 
     Args:
         images (List[NasaImage]): List of NASA images.
+        spill_threshold (int): Size in bytes above which a body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
     """
     for image in images:
-        get_content(image)
+        get_content(image, spill_threshold, resolution)
+
+
+def stream_images(
+    plan: RunPlan, spill_threshold: int = DEFAULT_SPILL_THRESHOLD, resolution: str = URL
+) -> Iterator[Tuple[int, requests.Response | None]]:
+    """Get the binary content of each picture of a plan when the previous one has been processed.
 
+    Each picture is launched only when the previous one is done, and its body is dropped once
+    the next picture is requested, so a single body is held at once. The pictures with a
+    stale cached entry are revalidated.
 
-def process_image(image: NasaImage):
+    Args:
+        plan (RunPlan): Plan of the pictures to launch.
+        spill_threshold (int): Size in bytes above which a body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+
+    Yields:
+        The index of each launched picture, with its binary content, and its response.
+    """
+    for index in iter(plan.next, None):
+        image = plan.images[index]
+        response = get_content(image, spill_threshold, resolution, plan.stale.get(index))
+        try:
+            yield index, response
+        finally:
+            image.bytes = None
+
+
+def count_content(
+    image: NasaImage,
+    response: requests.Response | None,
+    cached: CacheEntry | None = None,
+    preview_scale: int = 1,
+) -> CacheEntry | None:
+    """Count the colors of a downloaded image, reusing its cached count if it was not modified.
+
+    Args:
+        image (NasaImage): An image object, with its binary content unless it was not modified.
+        response (requests.Response | None): Response of the image content, or None if it
+            could not be got.
+        cached (CacheEntry | None): Cached entry of the image that was revalidated.
+        preview_scale (int): Divisor of the width and height of the decoded image.
+
+    Returns:
+        The count of the image and the validators of its response, or None if it could not be
+        counted.
+    """
+    if response is None:
+        return None
+    if cached is not None and response.status_code == NOT_MODIFIED:
+        print(f"Not modified: {image}")
+        return cached.revalidated(response.headers)
+
+    colors = process_image(image, preview_scale)
+    return CacheEntry.from_response(colors, response.headers)
+
+
+def process_image(image: NasaImage, preview_scale: int = 1):
     """Process a given image.
 
     Args:
         image (NasaImage): An image object.
+        preview_scale (int): Divisor of the width and height of the decoded image.
 
     Returns:
         The number of unique colors of the image.
@@ -80,8 +180,13 @@ def process_image(image: NasaImage):
         return
 
     print(f"Processing image: {image}")
-    img = Image.open(image.bytes)
-    return get_color_count(set(img.getdata()))
+    with track_stage(image.date, "decode"):
+        img = decode_image(image.bytes, preview_scale)  # type: ignore
+    with track_stage(image.date, "count"):
+        count = count_colors(img)
+        if count is not None:
+            return count
+        return get_color_count(set(img.getdata()))
 
 
 def get_color_count(unique_pixels: Set):
@@ -96,30 +201,57 @@ def get_color_count(unique_pixels: Set):
     return len(unique_pixels)
 
 
-def process_images(images: List[NasaImage]):
+def process_images(
+    images: Iterable[NasaImage], preview_scale: int = 1, sink: ResultSink | None = None
+):
     """Process a set NASA's APOD images.
 
+    Each result is written as soon as its image is processed.
+
     Args:
-        images (List[NasaImage]): List of NASA images objects.
+        images (Iterable[NasaImage]): NASA images objects.
+        preview_scale (int): Divisor of the width and height of the decoded images.
+        sink (ResultSink | None): Sink where the results are written. They are printed if None.
     """
+    sink = sink or PrintSink()
     for image in images:
-        print(process_image(image))
+        sink.write(to_result(image, process_image(image, preview_scale), preview_scale))
 
 
-def main(api_url: str, start_date, end_date):
+def main(
+    api_url: str,
+    start_date,
+    end_date,
+    options: RunOptions = RunOptions(),
+    images: List[NasaImage] | None = None,
+):
     """Run the process for processing images in date range.
 
     Args:
         api_url (str): URL of the image metadata API endpoint.
         start_date (str): Start date of the date range.
         end_date (str): End date of the date range.
+        options (RunOptions): Tuning options. Sync mode has no concurrency to tune. Bodies
+            larger than ``spill_threshold`` are buffered on disk. The pictures are downloaded
+            with the ``resolution`` policy and decoded at ``preview_scale``, one at a time,
+            within the ``cache_dir`` and ``deadline`` plan. The cached pictures of the last
+            ``revalidate_days`` are revalidated. The results are written to ``sink``, in date
+            order unless the deadline reorders the pictures and ``ordered`` is not set.
+        images (List[NasaImage] | None): Pictures of the date range, when their metadata has
+            already been processed. The metadata is fetched if None.
     """
-    url = f"{api_url}&start_date={start_date}&end_date={end_date}"
-    data = get_metadata(url)
-    if not data:
-        print("An error ocurred retrieving the pictures metadata.")
-        return
-
-    images = process_metadata(data)
-    get_images(images)
-    process_images(images)
+    if images is None:
+        url = f"{api_url}&start_date={start_date}&end_date={end_date}"
+        data = get_metadata(url, metadata_cache(options.cache_dir))
+        if not data:
+            print("An error ocurred retrieving the pictures metadata.")
+            return
+
+        images = process_metadata(data)
+    plan = RunPlan(images, options, make_writer(options.sink, options.ordered))
+    for index, response in stream_images(plan, options.spill_threshold, options.resolution):
+        entry = count_content(
+            plan.images[index], response, plan.stale.get(index), options.preview_scale
+        )
+        plan.complete(index, entry)
+    plan.finish()
@@ -0,0 +1 @@
+"""Async mode package."""
@@ -0,0 +1,310 @@
+"""Unit tests for the async mode implementation"""
+
+import asyncio
+import io
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Tuple
+
+import pytest
+from PIL import Image
+from pytest_mock import MockerFixture
+
+from async_mode.main import get_image_bytes, iter_content, main
+from cache import CacheEntry, Validators
+from image import NasaImage
+from options import RunOptions
+from planner import RunPlan
+from scheduler import AsyncByteBudget
+
+
+class FakeContent:
+    """Body of a fake ``aiohttp`` response."""
+
+    def __init__(self, body: bytes):
+        """Initialize the body.
+
+        Args:
+            body: Bytes of the body.
+        """
+        self.body = body
+
+    async def iter_chunked(self, size: int) -> AsyncIterator[bytes]:
+        """Iterate over the body by chunks.
+
+        Args:
+            size: Size of the chunks.
+
+        Yields:
+            Each chunk of the body.
+        """
+        for start in range(0, len(self.body), size):
+            yield self.body[start : start + size]
+
+
+class FakeResponse:
+    """Fake ``aiohttp`` response."""
+
+    def __init__(self, status: int, body: bytes = b"", headers: Dict[str, str] | None = None):
+        """Initialize the response.
+
+        Args:
+            status: HTTP status code.
+            body: Bytes of the body.
+            headers: Headers of the response.
+        """
+        self.status = status
+        self.headers = headers or {}
+        self.content = FakeContent(body)
+
+
+class FakeSession:
+    """Fake ``aiohttp`` session answering every request with the same response."""
+
+    def __init__(self, response: FakeResponse):
+        """Initialize the session.
+
+        Args:
+            response: Response to every request.
+        """
+        self.response = response
+        self.requests: List[Tuple[str, Dict[str, str] | None]] = []
+
+    @asynccontextmanager
+    async def get(self, url: str, headers: Dict[str, str] | None = None):
+        """Request a URL.
+
+        Args:
+            url: URL of the request.
+            headers: Headers of the request.
+
+        Yields:
+            The response.
+        """
+        self.requests.append((url, headers))
+        yield self.response
+
+
+@pytest.fixture()
+def png_body() -> bytes:
+    """Build a PNG picture of two colors.
+
+    Returns:
+        The encoded picture.
+    """
+    img = Image.new("RGB", (4, 4), (255, 0, 0))
+    img.putpixel((0, 0), (0, 0, 255))
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_get_image_bytes(images_data: List[NasaImage], png_body: bytes):
+    """Test that the picture is counted and its reservation released.
+
+    Args:
+        images_data: A list of NASA image objects.
+        png_body: A PNG picture.
+    """
+    headers = {"Content-Length": str(len(png_body)), "ETag": '"v1"'}
+    session = FakeSession(FakeResponse(200, png_body, headers))
+    budget = AsyncByteBudget(capacity=1000)
+
+    entry = asyncio.run(get_image_bytes(images_data[0], session, budget))  # type: ignore
+
+    assert entry == CacheEntry(2, Validators('"v1"'))
+    assert session.requests == [(images_data[0].url, None)]
+    assert images_data[0].bytes is None
+    assert budget.in_use == 0
+
+
+def test_get_image_bytes_counts_off_event_loop(
+    images_data: List[NasaImage], png_body: bytes, mocker: MockerFixture
+):
+    """Test that the colors are counted in the executor while the reservation is held.
+
+    Args:
+        images_data: A list of NASA image objects.
+        png_body: A PNG picture.
+        mocker: Mocking fixture.
+    """
+    budget = AsyncByteBudget(capacity=1000)
+    calls: List[Tuple[str, int]] = []
+
+    def process_image(image: NasaImage, preview_scale: int) -> int:
+        calls.append((threading.current_thread().name, budget.in_use))
+        return 3
+
+    mocker.patch("async_mode.main.process_image", side_effect=process_image)
+    session = FakeSession(FakeResponse(200, png_body, {"Content-Length": str(len(png_body))}))
+
+    entry = asyncio.run(get_image_bytes(images_data[0], session, budget))  # type: ignore
+
+    assert entry is not None and entry.colors == 3
+    assert calls == [(calls[0][0], len(png_body))]
+    assert calls[0][0] != threading.main_thread().name
+    assert budget.in_use == 0
+
+
+def test_get_image_bytes_not_modified(images_data: List[NasaImage], mocker: MockerFixture):
+    """Test that a picture that was not modified keeps its cached count without a download.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+    """
+    process_image_mock = mocker.patch("async_mode.main.process_image")
+    session = FakeSession(FakeResponse(304, headers={"ETag": '"v1"'}))
+
+    entry = asyncio.run(
+        get_image_bytes(
+            images_data[0],
+            session,  # type: ignore
+            AsyncByteBudget(),
+            cached=CacheEntry(42, Validators('"v1"')),
+        )
+    )
+
+    assert entry == CacheEntry(42, Validators('"v1"'))
+    assert session.requests == [(images_data[0].url, {"If-None-Match": '"v1"'})]
+    process_image_mock.assert_not_called()
+
+
+def test_get_image_bytes_error(images_data: List[NasaImage], mocker: MockerFixture):
+    """Test that a picture whose download fails is not counted.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+    """
+    process_image_mock = mocker.patch("async_mode.main.process_image")
+    session = FakeSession(FakeResponse(404))
+    budget = AsyncByteBudget()
+
+    entry = asyncio.run(get_image_bytes(images_data[0], session, budget))  # type: ignore
+
+    assert entry is None
+    process_image_mock.assert_not_called()
+    assert budget.in_use == 0
+
+
+async def slow_first(image: NasaImage, *args) -> CacheEntry:
+    """Count a picture, the first one of the date range after the others.
+
+    Args:
+        image: An image object.
+
+    Returns:
+        A count of the length of the title of the picture.
+    """
+    if image.date == "2022-02-10":
+        await asyncio.sleep(0.1)
+    return CacheEntry(len(image.title))
+
+
+def test_iter_content_completion_order(images_data: List[NasaImage], mocker: MockerFixture):
+    """Test that the counts are yielded as the pictures complete.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+    """
+    mocker.patch("async_mode.main.get_image_bytes", side_effect=slow_first)
+
+    async def collect() -> List[Tuple[int, NasaImage, CacheEntry | None]]:
+        return [result async for result in iter_content(images_data, None, AsyncByteBudget())]
+
+    results = asyncio.run(collect())
+
+    assert [index for index, _, _ in results][-1] == 0
+    assert sorted((index, entry) for index, _, entry in results) == [
+        (index, CacheEntry(len(image.title))) for index, image in enumerate(images_data)
+    ]
+
+
+def test_iter_content_streamed_images(images_data: List[NasaImage], mocker: MockerFixture):
+    """Test that the pictures are launched as their metadata arrives.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+    """
+    mocker.patch("async_mode.main.get_image_bytes", side_effect=slow_first)
+
+    async def stream() -> AsyncIterator[NasaImage]:
+        for image in images_data:
+            yield image
+
+    async def collect() -> List[int]:
+        plan = RunPlan()
+        results = iter_content(stream(), 2, AsyncByteBudget(), plan=plan)
+        indexes = [index async for index, _, _ in results]
+        assert plan.images == images_data
+        return indexes
+
+    assert sorted(asyncio.run(collect())) == [0, 1, 2]
+
+
+def test_iter_content_cancels_on_abandon(images_data: List[NasaImage], mocker: MockerFixture):
+    """Test that the pending downloads are cancelled when the iteration is abandoned.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+    """
+    cancelled: List[str] = []
+
+    async def get_image_bytes(image: NasaImage, *args) -> CacheEntry:
+        if image is not images_data[0]:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(image.date)
+                raise
+        return CacheEntry(1)
+
+    get_mock = mocker.patch("async_mode.main.get_image_bytes", side_effect=get_image_bytes)
+    plan = RunPlan(images_data)
+
+    async def abandon():
+        results = iter_content([], 1, AsyncByteBudget(), plan=plan)
+        assert await results.__anext__() == (0, images_data[0], CacheEntry(1))
+        # Let the second picture take the freed download slot.
+        await asyncio.sleep(0.05)
+        await results.aclose()
+
+    asyncio.run(asyncio.wait_for(abandon(), timeout=5))
+
+    assert get_mock.call_count == 2
+    assert cancelled == [images_data[1].date]
+    assert plan.remaining == 1
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_main_ordered(images_data: List[NasaImage], mocker: MockerFixture, ordered: bool):
+    """Test that the results are written as they complete, or in date order if requested.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+        ordered: Whether the results are written in date order.
+    """
+    mocker.patch("async_mode.main.get_image_bytes", side_effect=slow_first)
+    sink = mocker.MagicMock()
+
+    asyncio.run(
+        main(
+            "http://test.com/",
+            "2022-02-10",
+            "2022-02-13",
+            RunOptions(sink=sink, ordered=ordered),
+            images=images_data,
+        )
+    )
+
+    dates = [call.args[0].date for call in sink.write.call_args_list]
+    if ordered:
+        assert dates == [image.date for image in images_data]
+    else:
+        assert dates[-1] == images_data[0].date
+        assert sorted(dates) == [image.date for image in images_data]
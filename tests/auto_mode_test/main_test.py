@@ -0,0 +1,162 @@
+"""Unit tests for the auto mode implementation"""
+
+from pathlib import Path
+from time import time
+from typing import Dict, List
+from unittest.mock import MagicMock
+
+from pytest_mock import MockerFixture
+
+from auto_mode.main import (
+    DEFAULT_CALIBRATION,
+    Calibration,
+    calibrate,
+    choose_strategy,
+    load_calibration,
+    main,
+    save_calibration,
+)
+from cache import ResultCache
+from counter import cache_key
+from image import NasaImage
+from options import RunOptions
+
+
+def test_choose_strategy_single_image():
+    """Test that a single image is processed sequentially."""
+    calibration = Calibration(download_seconds=1.0, decode_seconds=1.0, measured_at=time())
+
+    strategy = choose_strategy(1, calibration, n_cores=8)
+
+    assert strategy.mode == "sync"
+
+
+def test_choose_strategy_download_bound():
+    """Test that a download bound workload uses concurrent downloads."""
+    calibration = Calibration(download_seconds=2.0, decode_seconds=0.01, measured_at=time())
+
+    strategy = choose_strategy(30, calibration, n_cores=4)
+
+    assert strategy.mode == "async"
+    assert strategy.options.io_workers == 30
+    assert "async" in strategy.reason
+
+
+def test_choose_strategy_decode_bound():
+    """Test that a decode bound workload counts the colors in parallel threads."""
+    calibration = Calibration(download_seconds=0.1, decode_seconds=3.0, measured_at=time())
+
+    strategy = choose_strategy(30, calibration, n_cores=8)
+
+    assert strategy.mode == "threading"
+    assert strategy.options.cpu_workers == 8
+
+
+def test_choose_strategy_overrides():
+    """Test that the concurrency levels of the run override the chosen ones in the reason too."""
+    calibration = Calibration(download_seconds=2.0, decode_seconds=0.01, measured_at=time())
+
+    strategy = choose_strategy(30, calibration, n_cores=4, options=RunOptions(io_workers=5))
+
+    assert strategy.mode == "async"
+    assert strategy.options.io_workers == 5
+    assert "io_workers=5," in strategy.reason
+
+
+def test_save_and_load_calibration(tmp_path: Path):
+    """Test the calibration data round trip.
+
+    Args:
+        tmp_path: Temporary directory.
+    """
+    path = str(tmp_path / "nested" / "calibration.json")
+    calibration = Calibration(download_seconds=0.5, decode_seconds=0.25, measured_at=time())
+
+    save_calibration(path, calibration)
+
+    assert load_calibration(path) == calibration
+
+
+def test_load_calibration_expired(tmp_path: Path):
+    """Test that old calibration data is discarded.
+
+    Args:
+        tmp_path: Temporary directory.
+    """
+    path = str(tmp_path / "calibration.json")
+    save_calibration(path, Calibration(download_seconds=0.5, decode_seconds=0.25, measured_at=0))
+
+    assert load_calibration(path) is None
+    assert load_calibration(str(tmp_path / "missing.json")) is None
+
+
+def test_main_hands_images_to_chosen_mode(
+    mocker: MockerFixture, valid_response: List[Dict[str, str]]
+):
+    """Test that the chosen mode gets the pictures instead of fetching their metadata again."""
+    calibration = Calibration(download_seconds=2.0, decode_seconds=0.01, measured_at=time())
+    mocker.patch("auto_mode.main.load_calibration", return_value=calibration)
+    get_data_mock = mocker.patch("auto_mode.main.get_metadata", return_value=valid_response)
+    main_async_mock = mocker.patch("auto_mode.main.main_async")
+
+    main("http://test.com/?api_key=key", "2022-02-10", "2022-02-13")
+
+    get_data_mock.assert_called_once()
+    images: List[NasaImage] = main_async_mock.call_args.kwargs["images"]
+    assert [image.date for image in images] == [data["date"] for data in valid_response]
+
+
+def test_calibrate_within_plan(
+    mocker: MockerFixture,
+    images_data: List[NasaImage],
+    error_image_content_request: MagicMock,
+    tmp_path: Path,
+):
+    """Test that the cached pictures are not downloaded and that a failed one has a result.
+
+    Args:
+        mocker: Mocking fixture.
+        images_data: A list of NASA image objects.
+        error_image_content_request: A mock of a failed get request.
+        tmp_path: Temporary directory.
+    """
+    ResultCache(str(tmp_path)).set(cache_key(images_data[0]), 5)
+    sink = mocker.MagicMock()
+
+    calibration = calibrate(images_data, RunOptions(cache_dir=str(tmp_path), sink=sink))
+
+    assert calibration == DEFAULT_CALIBRATION
+    error_image_content_request.assert_called_once()
+    assert error_image_content_request.call_args.args == (images_data[1].url,)
+    results = [call.args[0] for call in sink.write.call_args_list]
+    assert [(result.date, result.colors) for result in results] == [
+        ("2022-02-10", 5),
+        ("2022-02-11", None),
+        ("2022-02-13", None),
+    ]
+
+
+def test_calibrate_caches_counts(
+    mocker: MockerFixture,
+    images_data: List[NasaImage],
+    ok_image_content_request: MagicMock,
+    tmp_path: Path,
+):
+    """Test that the counts of the sample are stored in the cache.
+
+    Args:
+        mocker: Mocking fixture.
+        images_data: A list of NASA image objects.
+        ok_image_content_request: A mock of a successful get request.
+        tmp_path: Temporary directory.
+    """
+    ok_image_content_request.return_value.headers = {}
+    mocker.patch("sync_mode.main.process_image", return_value=7)
+
+    calibration = calibrate(
+        images_data[:2], RunOptions(cache_dir=str(tmp_path), sink=mocker.MagicMock())
+    )
+
+    assert calibration != DEFAULT_CALIBRATION
+    cache = ResultCache(str(tmp_path))
+    assert [cache.get(cache_key(image)) for image in images_data[:2]] == [7, 7]
@@ -0,0 +1,161 @@
+"""Unit tests for the benchmarks of the hot path"""
+
+import io
+
+from PIL import Image
+
+from benchmarks.main import (
+    DECODE,
+    Measurement,
+    compare,
+    count_modes,
+    find_disagreements,
+    format_report,
+    generate_corpus,
+    load_baseline,
+    measure,
+    run_benchmarks,
+    save_baseline,
+)
+
+
+def test_generate_corpus():
+    """Test that the corpus covers every mode, size and entropy and is the same in every run."""
+    corpus = generate_corpus(sizes=(16, 32))
+
+    assert len(corpus) == 36
+    assert len({image.name for image in corpus}) == len(corpus)
+    assert corpus == generate_corpus(sizes=(16, 32))
+    for image in corpus:
+        img = Image.open(io.BytesIO(image.data))
+        assert img.format == image.format
+        assert img.mode == image.mode
+        assert img.size == (image.size, image.size)
+
+
+def test_generate_corpus_entropies():
+    """Test that the pictures of higher entropy have more colors."""
+    corpus = generate_corpus(sizes=(64,), modes=("RGB",))
+    counts = {
+        image.entropy: len(Image.open(io.BytesIO(image.data)).getcolors(64 * 64))  # type: ignore
+        for image in corpus
+        if image.format == "PNG"
+    }
+
+    assert counts["low"] <= 16 < counts["medium"] < counts["high"]
+
+
+def test_measure():
+    """Test that a function is timed and its memory peak is traced."""
+    seconds, peak, blocks, value = measure(lambda: len(bytearray(1 << 20)), repeat=2)
+
+    assert seconds > 0
+    assert peak >= 1 << 20
+    assert blocks == 0
+    assert value == 1 << 20
+
+
+def test_measure_pillow_blocks():
+    """Test that the blocks of pixels taken from Pillow's allocator are counted."""
+    _, _, blocks, img = measure(lambda: Image.new("RGB", (64, 64)).convert("L"), repeat=1)
+
+    assert blocks == 2
+    assert img.size == (64, 64)
+
+
+def test_run_benchmarks():
+    """Test that every stage is measured and that every implementation agrees."""
+    corpus = generate_corpus(sizes=(16,), modes=("RGB", "P"), entropies=("high",))
+
+    measurements, disagreements = run_benchmarks(corpus, repeat=1)
+
+    assert disagreements == []
+    assert [(m.case, m.stage) for m in measurements] == [
+        ("rgb-16-high-png", DECODE),
+        ("rgb-16-high-png", "count/engine"),
+        ("rgb-16-high-png", "count/array"),
+        ("rgb-16-high-png", "count/getcolors"),
+        ("rgb-16-high-png", "count/set"),
+        ("rgb-16-high-jpeg", DECODE),
+        ("rgb-16-high-jpeg", "count/engine"),
+        ("rgb-16-high-jpeg", "count/array"),
+        ("rgb-16-high-jpeg", "count/getcolors"),
+        ("rgb-16-high-jpeg", "count/set"),
+        ("p-16-high-png", DECODE),
+        ("p-16-high-png", "count/engine"),
+        ("p-16-high-png", "count/fast"),
+        ("p-16-high-png", "count/getcolors"),
+        ("p-16-high-png", "count/set"),
+    ]
+
+
+def test_count_modes():
+    """Test that the picture is counted by every mode without printing."""
+    image = generate_corpus(sizes=(16,), modes=("RGBA",), entropies=("low",))[0]
+
+    counts = count_modes(image)
+
+    assert set(counts) == {"counter", "sync", "async", "threading", "multiprocessing"}
+    assert len(set(counts.values())) == 1
+
+
+def test_find_disagreements():
+    """Test that the pictures whose counts differ are reported."""
+    counts = {"a": {"engine": 3, "set": 3}, "b": {"engine": 3, "set": 4}}
+
+    assert find_disagreements(counts) == ["b: the implementations disagree (engine=3, set=4)"]
+
+
+def test_baseline_round_trip(tmp_path):
+    """Test that a saved baseline is loaded back and matches its measurements."""
+    path = str(tmp_path / "baseline.json")
+    measurements = [
+        Measurement("a", DECODE, 0.01, 1000, 1.0, blocks=2),
+        Measurement("a", "count/set", 0.02, 2000, 1.0, 42),
+    ]
+
+    save_baseline(path, measurements)
+
+    baseline = load_baseline(path)
+    assert baseline == {
+        "a/decode": {"seconds": 0.01, "peak": 1000, "blocks": 2, "colors": None},
+        "a/count/set": {"seconds": 0.02, "peak": 2000, "blocks": 0, "colors": 42},
+    }
+    assert compare(measurements, baseline) == []  # type: ignore
+
+
+def test_load_baseline_missing(tmp_path):
+    """Test that a missing baseline is None."""
+    assert load_baseline(str(tmp_path / "baseline.json")) is None
+
+
+def test_compare_flags_regressions():
+    """Test that slower stages, larger peaks, more Pillow blocks and changed counts are flagged.
+
+    The Pillow blocks of a baseline saved before they were counted are not compared.
+    """
+    baseline = {
+        "a/decode": {"seconds": 0.01, "peak": 1 << 20, "blocks": 1, "colors": None},
+        "a/count/set": {"seconds": 0.02, "peak": 1 << 20, "colors": 42},
+        "b/count/set": {"seconds": 0.02, "peak": 1 << 20, "colors": 42},
+    }
+    measurements = [
+        Measurement("a", DECODE, 0.02, 1 << 20, 1.0, blocks=2),
+        Measurement("a", "count/set", 0.02, 2 << 20, 1.0, 43, blocks=2),
+        Measurement("b", "count/set", 0.0105, 1 << 20, 1.0, 42),
+        Measurement("c", "count/set", 1.0, 1 << 30, 1.0, 1),
+    ]
+
+    assert compare(measurements, baseline, tolerance=0.25, memory_tolerance=0.1) == [
+        "a/decode: 100% slower, 20.00 ms instead of 10.00 ms",
+        "a/decode: takes 2 Pillow blocks instead of 1",
+        "a/count/set: counted 43 colors instead of 42",
+        "a/count/set: allocates 2048 KiB instead of 1024 KiB",
+    ]
+
+
+def test_format_report():
+    """Test that each measurement is reported with its throughput."""
+    report = format_report([Measurement("a", "count/set", 0.5, 2048, 1.0, 42, 3)])
+
+    assert report.splitlines()[1].split() == ["a", "count/set", "500.00", "2.0", "2", "3", "42"]
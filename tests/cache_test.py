@@ -0,0 +1,85 @@
+"""Unit tests for the color count cache"""
+
+import json
+
+from cache import CacheEntry, ResponseCache, ResultCache, Validators, metadata_cache
+
+
+def test_result_cache_in_memory():
+    """Test that an in-memory cache keeps the counts of the images."""
+    cache = ResultCache()
+
+    cache.set("http://nasa.gov/image.jpg", 42)
+
+    assert cache.get("http://nasa.gov/image.jpg") == 42
+    assert "http://nasa.gov/image.jpg" in cache
+    assert cache.get("http://nasa.gov/image2.jpg") is None
+
+
+def test_result_cache_persisted(tmp_path):
+    """Test that the counts written by a cache are read by another one on the same directory."""
+    ResultCache(str(tmp_path)).set("http://nasa.gov/image.jpg", 42)
+
+    cache = ResultCache(str(tmp_path))
+
+    assert cache.get("http://nasa.gov/image.jpg") == 42
+    assert "http://nasa.gov/image2.jpg" not in cache
+
+
+def test_result_cache_home_directory(tmp_path, monkeypatch):
+    """Test that a directory in the home of the user is expanded before it is created."""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+
+    ResultCache("~/colors").set("http://nasa.gov/image.jpg", 42)
+
+    assert not (tmp_path / "~").exists()
+    assert ResultCache(str(tmp_path / "colors")).get("http://nasa.gov/image.jpg") == 42
+
+
+def test_result_cache_validators(tmp_path):
+    """Test that the validators of an entry are persisted along with its count."""
+    validators = Validators('"abc"', "Thu, 10 Feb 2022 00:00:00 GMT")
+    ResultCache(str(tmp_path)).set("http://nasa.gov/image.jpg", 42, validators)
+
+    cache = ResultCache(str(tmp_path))
+
+    assert cache.get_entry("http://nasa.gov/image.jpg") == CacheEntry(42, validators)
+
+
+def test_result_cache_entry_without_validators(tmp_path):
+    """Test that the entries written without validators are still read."""
+    cache = ResultCache(str(tmp_path))
+    with open(cache._path("http://nasa.gov/image.jpg"), "w") as entry_file:
+        json.dump({"url": "http://nasa.gov/image.jpg", "colors": 42}, entry_file)
+
+    assert cache.get_entry("http://nasa.gov/image.jpg") == CacheEntry(42)
+    assert CacheEntry(42).validators.conditional_headers() == {}
+
+
+def test_validators():
+    """Test the conditional headers of the validators and their update after a 304."""
+    validators = Validators('"abc"', "Thu, 10 Feb 2022 00:00:00 GMT")
+
+    assert validators.conditional_headers() == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Thu, 10 Feb 2022 00:00:00 GMT",
+    }
+    assert validators.update({"ETag": '"def"'}) == Validators(
+        '"def"', "Thu, 10 Feb 2022 00:00:00 GMT"
+    )
+    assert CacheEntry.from_response(None, {"ETag": '"abc"'}) is None
+    assert CacheEntry.from_response(7, {"ETag": '"abc"'}) == CacheEntry(7, Validators('"abc"'))
+
+
+def test_response_cache(tmp_path):
+    """Test that the responses with validators are persisted and the others are not."""
+    ResponseCache(str(tmp_path)).set("http://nasa.gov/apod?a", b"[]", Validators('"abc"'))
+    ResponseCache(str(tmp_path)).set("http://nasa.gov/apod?b", b"[]", Validators())
+
+    cache = ResponseCache(str(tmp_path))
+
+    assert cache.get("http://nasa.gov/apod?a") == (b"[]", Validators('"abc"'))
+    assert cache.get("http://nasa.gov/apod?b") is None
+    assert metadata_cache(None) is None
+    assert metadata_cache(str(tmp_path)).directory == str(tmp_path / "metadata")  # type: ignore
@@ -0,0 +1,157 @@
+"""Unit tests for the fast color counting paths"""
+
+import io
+import random
+import tracemalloc
+
+import pytest
+from PIL import Image
+
+import colors
+from colors import count_colors, count_colors_array, count_colors_fast, decode_image
+
+
+def build_image(mode: str) -> Image.Image:
+    """Build a noisy image in the given mode.
+
+    Args:
+        mode: Pillow mode of the image.
+
+    Returns:
+        An image with random pixels.
+    """
+    rng = random.Random(mode)
+    rgb = Image.frombytes("RGB", (64, 48), bytes(rng.getrandbits(8) for _ in range(64 * 48 * 3)))
+    if mode.startswith("I;16"):
+        data = bytes(rng.getrandbits(8) for _ in range(64 * 48 * 2))
+        return Image.frombytes(mode, (64, 48), data)
+    if mode == "PA":
+        return rgb.convert("P").convert("PA")
+    return rgb.convert(mode)
+
+
+@pytest.mark.parametrize("mode", ["1", "L", "P", "LA", "La", "PA", "I;16", "I;16B", "I;16L"])
+def test_count_colors_fast(mode: str):
+    """Test that the fast paths count the same colors as the pixel set.
+
+    Args:
+        mode: Pillow mode of the image.
+    """
+    img = build_image(mode)
+
+    assert count_colors_fast(img) == len(set(img.getdata()))
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "F"])
+def test_count_colors_fast_general_modes(mode: str):
+    """Test that the modes without a fast path are left to the general engine.
+
+    Args:
+        mode: Pillow mode of the image.
+    """
+    assert count_colors_fast(build_image(mode)) is None
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "RGBX", "CMYK", "YCbCr"])
+def test_count_colors_array(mode: str):
+    """Test that the NumPy engine counts the same colors as the pixel set.
+
+    Args:
+        mode: Pillow mode of the image.
+    """
+    img = build_image(mode)
+
+    assert count_colors_array(img) == len(set(img.getdata()))
+    assert count_colors(img) == len(set(img.getdata()))
+
+
+def test_count_colors_array_table(monkeypatch: pytest.MonkeyPatch):
+    """Test that the table of colors counts the same colors as the sorted pixels.
+
+    Args:
+        monkeypatch: Patching fixture.
+    """
+    img = build_image("RGB")
+    sorted_count = count_colors_array(img)
+    monkeypatch.setattr(colors, "COLOR_TABLE_PIXELS", 0)
+
+    assert count_colors_array(img) == sorted_count == len(set(img.getdata()))
+
+
+def test_count_colors_array_small_memory():
+    """Test that a small three-band image is counted without the table of colors."""
+    img = build_image("RGB")
+    tracemalloc.start()
+    try:
+        count_colors_array(img)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak < 1 << 20
+
+
+def test_count_colors_array_empty():
+    """Test the counting of an image without pixels."""
+    assert count_colors_array(Image.new("RGBA", (0, 0))) == 0
+    assert count_colors_array(Image.new("RGB", (0, 0))) == 0
+    assert count_colors_array(Image.new("F", (4, 4))) is None
+
+
+def encode(img: Image.Image, image_format: str) -> io.BytesIO:
+    """Encode an image in memory.
+
+    Args:
+        img: An image.
+        image_format: Pillow format name.
+
+    Returns:
+        A buffer with the encoded image.
+    """
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.parametrize("scale", [1, 2, 4, 8])
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+def test_decode_image_preview(scale: int, image_format: str):
+    """Test that the previews are decoded at the requested scale.
+
+    Args:
+        scale: Preview scale.
+        image_format: Pillow format name.
+    """
+    img = decode_image(encode(build_image("RGB"), image_format), scale)
+
+    assert img.size == (64 // scale, 48 // scale)
+
+
+@pytest.mark.parametrize("scale", [2, 4, 8])
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+def test_decode_image_preview_odd_size(scale: int, image_format: str):
+    """Test that pictures of odd sizes are not reduced twice.
+
+    Args:
+        scale: Preview scale.
+        image_format: Pillow format name.
+    """
+    img = Image.new("RGB", (1001, 601), (255, 0, 0))
+
+    preview = decode_image(encode(img, image_format), scale)
+
+    assert preview.size == (-(-1001 // scale), -(-601 // scale))
+
+
+def test_decode_image_preview_palette():
+    """Test that palette images are decoded at full size."""
+    img = decode_image(encode(build_image("P"), "PNG"), 4)
+
+    assert img.size == (64, 48)
+
+
+def test_decode_image_invalid_scale():
+    """Test that unsupported scales are rejected."""
+    with pytest.raises(ValueError):
+        decode_image(encode(build_image("RGB"), "PNG"), 3)
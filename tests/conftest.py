@@ -1,5 +1,6 @@
 """Includes reusable fixtures for unit tests."""
 
+import json
 from typing import Dict, Generator, List, Literal
 from unittest.mock import MagicMock
 
@@ -86,6 +87,7 @@ def ok_get_request(
     """
     mocked_get_request.return_value.status_code = 200
     mocked_get_request.return_value.json.return_value = valid_response
+    mocked_get_request.return_value.content = json.dumps(valid_response).encode()
     yield mocked_get_request
 
 
@@ -122,6 +124,7 @@ def ok_image_content_request(
     """
     mocked_get_request.return_value.status_code = 200
     mocked_get_request.return_value.content = binary_response
+    mocked_get_request.return_value.iter_content.return_value = [binary_response]
     yield mocked_get_request
 
 
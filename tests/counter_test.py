@@ -0,0 +1,224 @@
+"""Unit tests for the color counter library API"""
+
+import asyncio
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from unittest.mock import MagicMock
+
+import pytest
+from PIL import Image
+from pytest_mock import MockerFixture
+
+from cache import ResultCache
+from counter import ApodColorCounter, AsyncApodColorCounter, cache_key, count_bytes
+from image import NasaImage
+from results import ColorCount
+
+
+@pytest.fixture()
+def png_response() -> bytes:
+    """Build the binary content of a PNG image with two colors.
+
+    Returns:
+        Binary content.
+    """
+    img = Image.new("RGB", (4, 4), (255, 0, 0))
+    img.putpixel((0, 0), (0, 0, 255))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture()
+def session_get(
+    mocker: MockerFixture, valid_response: List[Dict[str, str]], png_response: bytes
+) -> MagicMock:
+    """Mock the get method of the HTTP sessions.
+
+    Args:
+        mocker: Mocking fixture.
+        valid_response: A list of the metadata for each NASA's picture.
+        png_response: Binary content of an image.
+
+    Returns:
+        A mock of requests.Session.get method.
+    """
+    response = MagicMock(status_code=200, headers={})
+    response.content = json.dumps(valid_response).encode()
+    response.iter_content.return_value = [png_response]
+    return mocker.patch("requests.Session.get", return_value=response)
+
+
+def test_count_bytes(png_response: bytes):
+    """Test that the colors of a downloaded image are counted."""
+    assert count_bytes(png_response) == 2
+
+
+def test_cache_key(images_data: List[NasaImage]):
+    """Test that previews and other resolutions are cached apart from the standard counts."""
+    image = images_data[0]
+
+    assert cache_key(image) == image.url
+    assert cache_key(image, preview_scale=4) != image.url
+    assert cache_key(image, "hdurl") != cache_key(image, "auto")
+
+
+def test_counter_count(session_get: MagicMock):
+    """Test that the counter yields a typed result per picture in date order."""
+    with ApodColorCounter("http://nasa.gov/apod?api_key=x", executor=ThreadPoolExecutor(2)) as c:
+        results = list(c.count("2022-02-10", "2022-02-13"))
+
+    assert results == [
+        ColorCount("2022-02-10", "An image title", "http://nasa.gov/image.jpg", "image", 2),
+        ColorCount("2022-02-11", "An image 2 title", "http://nasa.gov/image2.jpg", "image", 2),
+        ColorCount("2022-02-13", "A video title", "http://nasa.gov/video.mp4", "video", None),
+    ]
+    session_get.assert_any_call(
+        "http://nasa.gov/apod?api_key=x&start_date=2022-02-10&end_date=2022-02-13"
+    )
+
+
+def test_counter_count_is_lazy(session_get: MagicMock):
+    """Test that nothing is requested until the results are iterated."""
+    with ApodColorCounter("http://nasa.gov/apod?api_key=x", executor=ThreadPoolExecutor(2)) as c:
+        results = c.count("2022-02-10", "2022-02-13")
+        session_get.assert_not_called()
+        next(results)
+
+    session_get.assert_called()
+
+
+def test_counter_uses_cache(session_get: MagicMock):
+    """Test that cached pictures are not downloaded again."""
+    cache = ResultCache()
+    cache.set("http://nasa.gov/image.jpg", 7)
+
+    with ApodColorCounter(
+        "http://nasa.gov/apod?api_key=x", cache=cache, executor=ThreadPoolExecutor(2)
+    ) as c:
+        colors = [result.colors for result in c.count("2022-02-10", "2022-02-13")]
+
+    assert colors == [7, 2, None]
+    assert cache.get("http://nasa.gov/image2.jpg") == 2
+    urls = [call.args[0] for call in session_get.call_args_list]
+    assert "http://nasa.gov/image.jpg" not in urls
+
+
+def test_counter_count_unordered(session_get: MagicMock):
+    """Test that unordered results yield the cached pictures first."""
+    cache = ResultCache()
+    cache.set("http://nasa.gov/image2.jpg", 7)
+
+    with ApodColorCounter(
+        "http://nasa.gov/apod?api_key=x", cache=cache, executor=ThreadPoolExecutor(2)
+    ) as c:
+        results = list(c.count("2022-02-10", "2022-02-13", ordered=False))
+
+    assert [result.date for result in results[:2]] == ["2022-02-11", "2022-02-13"]
+    assert results[2].colors == 2
+
+
+def test_counter_count_failed_picture(mocker: MockerFixture, session_get: MagicMock):
+    """Test that a picture whose count fails is yielded without colors."""
+    mocker.patch("counter.count_url", side_effect=[OSError("truncated"), 3])
+
+    with ApodColorCounter("http://nasa.gov/apod?api_key=x", executor=ThreadPoolExecutor(1)) as c:
+        colors = [result.colors for result in c.count("2022-02-10", "2022-02-13")]
+
+    assert colors == [None, 3, None]
+
+
+def test_async_counter_uses_cache(mocker: MockerFixture):
+    """Test that the async counter yields cached counts without downloading the pictures."""
+    cache = ResultCache()
+    cache.set("http://nasa.gov/image.jpg", 7)
+    cache.set("http://nasa.gov/image2.jpg", 8)
+    images = [
+        MagicMock(url="http://nasa.gov/image.jpg", media_type="image", title="A", date="1"),
+        MagicMock(url="http://nasa.gov/image2.jpg", media_type="image", title="B", date="2"),
+        MagicMock(url="http://nasa.gov/video.mp4", media_type="video", title="C", date="3"),
+    ]
+    mocker.patch.object(AsyncApodColorCounter, "get_images", return_value=images)
+    download = mocker.patch.object(AsyncApodColorCounter, "_download_and_count")
+
+    async def count() -> List[int | None]:
+        async with AsyncApodColorCounter("http://nasa.gov/apod?api_key=x", cache=cache) as c:
+            return [result.colors async for result in c.count("1", "3")]
+
+    assert asyncio.run(count()) == [7, 8, None]
+    download.assert_not_called()
+
+
+def test_counter_caches_past_metadata(session_get: MagicMock):
+    """Test that the metadata of past days is requested only once."""
+    with ApodColorCounter("http://nasa.gov/apod?api_key=x", executor=ThreadPoolExecutor(2)) as c:
+        first = c.get_images("2022-02-10", "2022-02-13")
+        second = c.get_images("2022-02-11", "2022-02-13")
+
+    assert session_get.call_count == 1
+    assert [image.date for image in second] == [image.date for image in first[1:]]
+
+
+def test_counter_coalesces_inflight_counts(mocker: MockerFixture):
+    """Test that concurrent counts of the same picture share a single download."""
+    started = threading.Event()
+    finish = threading.Event()
+
+    def slow_count(image: NasaImage, spill_threshold: int, *args) -> int:
+        started.set()
+        finish.wait(5)
+        return 5
+
+    mocker.patch("counter.count_url", side_effect=slow_count)
+    image = MagicMock(url="http://nasa.gov/image.jpg", media_type="image")
+    executor = ThreadPoolExecutor(2)
+    submit = mocker.spy(executor, "submit")
+
+    with ApodColorCounter("http://nasa.gov/apod?api_key=x", executor=executor) as c:
+        first = c.submit(image)
+        started.wait(5)
+        second = c.submit(image)
+        finish.set()
+
+        assert first is second
+        assert first.result() == 5  # type: ignore
+        c.release(image, first)
+        c.release(image, second)
+        assert submit.call_count == 1
+        assert c.cache.get(image.url) == 5
+        assert c.submit(image) == 5
+
+
+def test_counter_count_shares_inflight_counts(mocker: MockerFixture, session_get: MagicMock):
+    """Test that overlapping iterations count each picture once."""
+    started = threading.Semaphore(0)
+    finish = threading.Event()
+
+    def slow_count(image: NasaImage, spill_threshold: int, *args) -> int:
+        started.release()
+        finish.wait(5)
+        return 5
+
+    count_url = mocker.patch("counter.count_url", side_effect=slow_count)
+    results: List[List[int | None]] = []
+
+    with ApodColorCounter("http://nasa.gov/apod?api_key=x", executor=ThreadPoolExecutor(4)) as c:
+
+        def consume():
+            results.append([result.colors for result in c.count("2022-02-10", "2022-02-13")])
+
+        first = threading.Thread(target=consume)
+        first.start()
+        assert started.acquire(timeout=5) and started.acquire(timeout=5)
+        second = threading.Thread(target=consume)
+        second.start()
+        second.join(0.2)
+        finish.set()
+        first.join(5)
+        second.join(5)
+
+    assert results == [[5, 5, None], [5, 5, None]]
+    assert count_url.call_count == 2
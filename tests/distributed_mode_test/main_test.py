@@ -0,0 +1,187 @@
+"""Unit tests for the distributed mode implementation"""
+
+import threading
+from concurrent.futures import Future
+from typing import Dict, List
+from unittest.mock import MagicMock
+
+import pytest
+
+from counter import ApodColorCounter
+from distributed_mode.main import (
+    DEFAULT_AUTHKEY,
+    CoordinatorManager,
+    WorkerManager,
+    WorkQueue,
+    coordinator_main,
+    count_unit,
+    get_authkey,
+    serve,
+    split_units,
+    work,
+)
+from image import NasaImage
+
+
+class FakeClock:
+    """Clock advanced by hand."""
+
+    def __init__(self):
+        """Start the clock at zero."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Get the current time.
+
+        Returns:
+            The current time in seconds.
+        """
+        return self.now
+
+
+def test_split_units(images_data: List[NasaImage]):
+    """Test that the pictures are split into units of consecutive dates."""
+    units = split_units(images_data, unit_size=2)
+
+    assert [unit.unit_id for unit in units] == [0, 1]
+    assert units[0].images == images_data[:2]
+    assert units[1].images == images_data[2:]
+
+
+def test_work_queue_hands_out_and_gathers(images_data: List[NasaImage]):
+    """Test that the results are gathered in date order whatever the completion order."""
+    queue = WorkQueue(split_units(images_data, unit_size=2))
+
+    first = queue.get_unit("a")
+    second = queue.get_unit("b")
+    assert queue.get_unit("c") is None
+
+    queue.complete("b", second.unit_id, [3])  # type: ignore
+    assert not queue.is_done()
+    queue.complete("a", first.unit_id, [1, 2])  # type: ignore
+
+    assert queue.is_done()
+    assert queue.results() == [1, 2, 3]
+
+
+def test_work_queue_reports_completed_units(images_data: List[NasaImage]):
+    """Test that each completed unit is reported once, as soon as it is completed."""
+    queue = WorkQueue(split_units(images_data, unit_size=2))
+    queue.get_unit("a")
+    second = queue.get_unit("b")
+
+    assert queue.wait_completed(set(), timeout=0) == {}
+    queue.complete("b", second.unit_id, [3])  # type: ignore
+
+    assert queue.wait_completed(set(), timeout=0) == {1: [3]}
+    assert queue.wait_completed({1}, timeout=0) == {}
+
+
+def test_work_queue_requeues_lost_units(images_data: List[NasaImage]):
+    """Test that the unit of a worker without heartbeats is handed to another worker."""
+    clock = FakeClock()
+    queue = WorkQueue(split_units(images_data, unit_size=3), heartbeat_timeout=10, clock=clock)
+    unit = queue.get_unit("a")
+
+    clock.now = 5
+    queue.heartbeat("b")
+    assert queue.get_unit("b") is None
+
+    clock.now = 11
+    assert queue.requeue_lost() == ["a"]
+    assert queue.get_unit("b") == unit
+
+    queue.complete("b", unit.unit_id, [1, 2, None])  # type: ignore
+    queue.complete("a", unit.unit_id, [7, 7, 7])  # type: ignore
+    assert queue.results() == [1, 2, None]
+
+
+def test_work_queue_gives_up_units(images_data: List[NasaImage]):
+    """Test that a unit that keeps losing its workers is reported without colors."""
+    clock = FakeClock()
+    queue = WorkQueue(
+        split_units(images_data, unit_size=3), heartbeat_timeout=1, max_attempts=2, clock=clock
+    )
+
+    for worker_id in ("a", "b"):
+        assert queue.get_unit(worker_id) is not None
+        clock.now += 2
+        queue.requeue_lost()
+
+    assert queue.is_done()
+    assert queue.results() == [None, None, None]
+
+
+def test_workers_end_to_end(images_data: List[NasaImage]):
+    """Test that several workers count every unit through the manager channel."""
+    queue = WorkQueue(split_units(images_data, unit_size=1))
+    CoordinatorManager.register("get_queue", callable=lambda: queue)
+    server = CoordinatorManager(address=("127.0.0.1", 0), authkey=b"test").get_server()
+    threading.Thread(target=serve, args=(server,), daemon=True).start()
+
+    counter = MagicMock()
+    counter.submit.side_effect = lambda image: len(image.title)
+    counter.result.side_effect = lambda image, pending: pending
+    done: List[int] = []
+
+    def run_worker(worker_id: str):
+        manager = WorkerManager(address=server.address, authkey=b"test")
+        manager.connect()
+        done.append(work(manager.get_queue(), worker_id, counter))  # type: ignore
+
+    workers = [threading.Thread(target=run_worker, args=(f"w{i}",)) for i in range(3)]
+    for worker in workers:
+        worker.start()
+    assert queue.wait(10)
+    for worker in workers:
+        worker.join(10)
+    server.stop_event.set()
+
+    assert queue.results() == [len(image.title) for image in images_data]
+    assert sum(done) == 3
+
+
+def test_count_unit_failed_picture(images_data: List[NasaImage]):
+    """Test that a picture whose count fails does not fail its unit."""
+    unit = split_units(images_data, unit_size=3)[0]
+    failed: Future = Future()
+    failed.set_exception(OSError("cannot identify image file"))
+    counted: Future = Future()
+    counted.set_result(5)
+    with ApodColorCounter("http://nasa.gov/apod?api_key=x", executor=MagicMock()) as counter:
+        counter.submit = MagicMock(side_effect=[failed, counted, None])  # type: ignore
+
+        assert count_unit(counter, unit) == [None, 5, None]
+
+
+@pytest.mark.parametrize(
+    "host, environ, expected",
+    [
+        ("127.0.0.1", {}, DEFAULT_AUTHKEY.encode()),
+        ("localhost", {}, DEFAULT_AUTHKEY.encode()),
+        ("0.0.0.0", {}, None),
+        ("node-1", {}, None),
+        ("0.0.0.0", {"COORDINATOR_AUTHKEY": "secret"}, b"secret"),
+    ],
+)
+def test_get_authkey(
+    monkeypatch: pytest.MonkeyPatch, host: str, environ: Dict[str, str], expected: bytes | None
+):
+    """Test that the default key is only used on loopback hosts."""
+    monkeypatch.delenv("COORDINATOR_AUTHKEY", raising=False)
+    for name, value in environ.items():
+        monkeypatch.setenv(name, value)
+
+    assert get_authkey(host) == expected
+
+
+def test_coordinator_refuses_default_key(
+    monkeypatch: pytest.MonkeyPatch, capfd: pytest.CaptureFixture[str]
+):
+    """Test that the coordinator does not listen beyond localhost with the default key."""
+    monkeypatch.delenv("COORDINATOR_AUTHKEY", raising=False)
+
+    coordinator_main("http://nasa.gov/apod?api_key=x", "2022-02-10", "2022-02-13", host="0.0.0.0")
+
+    out, _ = capfd.readouterr()
+    assert out == "Set COORDINATOR_AUTHKEY to a secret to listen on 0.0.0.0.\n"
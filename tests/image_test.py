@@ -0,0 +1,68 @@
+"""Unit tests for the NASA image objects"""
+
+import io
+import mmap
+import pickle
+
+import pytest
+
+from image import BodyBuffer, NasaImage
+
+
+def test_body_buffer_in_memory():
+    """Test that a small body is kept in memory."""
+    body = BodyBuffer(spill_threshold=10)
+    body.write(b"abc")
+    body.write(b"def")
+
+    buffer = body.getbuffer()
+
+    assert not body.spilled
+    assert isinstance(buffer, io.BytesIO)
+    assert buffer.read() == b"abcdef"
+
+
+def test_body_buffer_spills_when_growing():
+    """Test that a body is moved to disk once it grows above the threshold."""
+    body = BodyBuffer(spill_threshold=4)
+    body.write(b"abc")
+    assert not body.spilled
+    body.write(b"def")
+
+    buffer = body.getbuffer()
+
+    assert body.spilled
+    assert isinstance(buffer, mmap.mmap)
+    assert buffer.read() == b"abcdef"
+    assert body.size == 6
+
+
+def test_body_buffer_spills_announced_size():
+    """Test that a body announced above the threshold is written to disk from the start."""
+    body = BodyBuffer(spill_threshold=4, size=100)
+
+    assert body.spilled
+    body.write(b"ab")
+    assert body.getbuffer().read() == b"ab"
+
+
+def test_nasa_image_is_slotted():
+    """Test that the images do not carry a dictionary per instance."""
+    image = NasaImage("http://nasa.gov/image.jpg", "image", "A title", "2022-02-10")
+
+    assert not hasattr(image, "__dict__")
+    with pytest.raises(AttributeError):
+        image.extra = 1  # type: ignore
+
+
+def test_nasa_image_pickles_without_payload():
+    """Test that only the metadata of an image is pickled."""
+    image = NasaImage("http://nasa.gov/image.jpg", "image", "A title", "2022-02-10", "http://hd")
+    image.bytes = io.BytesIO(b"x" * 1000)
+
+    restored = pickle.loads(pickle.dumps(image))
+
+    assert restored == image
+    assert restored.hdurl == "http://hd"
+    assert restored.bytes is None
+    assert image.bytes is not None
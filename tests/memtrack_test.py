@@ -0,0 +1,120 @@
+"""Unit tests for the memory tracking"""
+
+import tracemalloc
+from typing import Generator
+
+import pytest
+
+import memtrack
+
+
+@pytest.fixture()
+def tracking(monkeypatch: pytest.MonkeyPatch) -> Generator[None, None, None]:
+    """Enable memory tracking for a single test.
+
+    Args:
+        monkeypatch: Patching fixture that restores the tracking state.
+
+    Yields:
+        Nothing.
+    """
+    monkeypatch.setattr(memtrack, "_enabled", False)
+    monkeypatch.setattr(memtrack, "_records", [])
+    was_tracing = tracemalloc.is_tracing()
+    memtrack.enable()
+    yield
+    if not was_tracing:
+        tracemalloc.stop()
+
+
+def allocate(size: int) -> int:
+    """Allocate a buffer inside a tracked stage.
+
+    Args:
+        size: Size of the buffer.
+
+    Returns:
+        The size of the buffer.
+    """
+    with memtrack.track_stage("2022-02-10", "decode"):
+        buffer = bytearray(size)
+    return len(buffer)
+
+
+def test_track_stage_disabled(monkeypatch: pytest.MonkeyPatch):
+    """Test that nothing is recorded when tracking is disabled.
+
+    Args:
+        monkeypatch: Patching fixture.
+    """
+    monkeypatch.setattr(memtrack, "_enabled", False)
+    monkeypatch.setattr(memtrack, "_records", [])
+
+    assert memtrack.TrackedCall(allocate)(1024) == 1024
+    assert memtrack.get_records() == []
+    assert memtrack.report() == ""
+
+
+def test_track_stage(tracking: None):
+    """Test the recording of the memory peak of a stage.
+
+    Args:
+        tracking: Enables memory tracking.
+    """
+    allocate(1024 * 1024)
+
+    [record] = memtrack.get_records()
+    assert record.label == "2022-02-10"
+    assert record.stage == "decode"
+    assert record.peak >= 1024 * 1024
+    assert record.rss > 0
+
+
+def test_track_stage_overlapping(tracking: None):
+    """Test that a stage does not reset the peak of a stage running at the same time.
+
+    Args:
+        tracking: Enables memory tracking.
+    """
+    with memtrack.track_stage("2022-02-10", "decode"):
+        buffer = bytearray(4 * 1024 * 1024)
+        del buffer
+        with memtrack.track_stage("2022-02-11", "count"):
+            buffer = bytearray(1024 * 1024)
+        del buffer
+
+    inner, outer = memtrack.get_records()
+    assert outer.label == "2022-02-10"
+    assert outer.peak >= 4 * 1024 * 1024
+    assert 1024 * 1024 <= inner.peak < 4 * 1024 * 1024
+
+
+def test_tracked_call_round_trip(tracking: None):
+    """Test that the records of a tracked call are collected by the caller.
+
+    Args:
+        tracking: Enables memory tracking.
+    """
+    result = memtrack.TrackedCall(allocate)(1024)
+
+    assert isinstance(result, memtrack.TrackedResult)
+    assert memtrack.get_records() == []
+    assert memtrack.unwrap(result) == 1024
+    assert len(memtrack.get_records()) == 1
+
+
+def test_report(tracking: None):
+    """Test the report of the images and stages using the most memory.
+
+    Args:
+        tracking: Enables memory tracking.
+    """
+    allocate(2 * 1024 * 1024)
+    with memtrack.track_stage("2022-02-11", "count"):
+        pass
+
+    report = memtrack.report(limit=1)
+
+    assert "Top images:\n  2022-02-10: 2.0 MiB during decode" in report
+    assert "2022-02-11" not in report.split("Top stages:")[0]
+    assert "  count: 0.0 MiB for 2022-02-11" in report
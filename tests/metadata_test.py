@@ -0,0 +1,152 @@
+"""Unit tests for the metadata decoding"""
+
+import asyncio
+import json
+from typing import AsyncIterator, Dict, List
+
+import pytest
+from pytest_mock import MockerFixture
+
+from async_mode.main import stream_images
+from cache import ResponseCache, Validators
+from image import NasaImage
+from metadata import MetadataParser, aiter_images, fetch_metadata, iter_images, parse_images
+
+
+@pytest.fixture()
+def tricky_response(valid_response: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Build a metadata response with braces, quotes and non-ASCII characters in its strings.
+
+    Args:
+        valid_response: A list of the metadata for each NASA's picture.
+
+    Returns:
+        A list of the metadata for each NASA's picture.
+    """
+    response = [dict(p) for p in valid_response]
+    response[0]["explanation"] = 'A "nebula" {in} [Orión] \\ }'
+    response[1]["hdurl"] = "http://nasa.gov/image2_hd.jpg"
+    return response
+
+
+def test_parse_images(valid_response: List[Dict[str, str]], images_data: List[NasaImage]):
+    """Test the decoding of a whole response."""
+    assert parse_images(json.dumps(valid_response).encode()) == images_data
+
+
+def test_iter_images_any_chunking(tricky_response: List[Dict[str, str]]):
+    """Test that the images are the same wherever the chunks of the body are cut."""
+    body = json.dumps(tricky_response, ensure_ascii=False, indent=1).encode()
+    expected = parse_images(body)
+
+    for size in range(1, 40):
+        chunks = [body[i : i + size] for i in range(0, len(body), size)]
+        assert list(iter_images(chunks)) == expected
+
+    assert expected[1].hdurl == "http://nasa.gov/image2_hd.jpg"
+
+
+def test_metadata_parser_yields_early(valid_response: List[Dict[str, str]]):
+    """Test that each object is decoded as soon as it has arrived."""
+    body = json.dumps(valid_response).encode()
+    first_end = body.index(b"}") + 1
+    parser = MetadataParser()
+
+    assert parser.feed(body[: first_end - 1]) == []
+    assert parser.feed(body[first_end - 1 : first_end]) == [valid_response[0]]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'{"code": 400, "msg": "Bad request"}',
+        b'[{"url": "a"}, 3]',
+        b'[{"url": "a", "media_type": "image", "title": "A", "date": "2022-02-10"}',
+    ],
+)
+def test_iter_images_malformed(body: bytes):
+    """Test that bodies that are not a complete array of objects are rejected."""
+    with pytest.raises(ValueError):
+        list(iter_images([body]))
+
+
+def test_aiter_images(valid_response: List[Dict[str, str]], images_data: List[NasaImage]):
+    """Test the streaming of the images from an asynchronous body."""
+    body = json.dumps(valid_response).encode()
+
+    async def chunks() -> AsyncIterator[bytes]:
+        for i in range(0, len(body), 7):
+            yield body[i : i + 7]
+
+    async def collect() -> List[NasaImage]:
+        return [image async for image in aiter_images(chunks())]
+
+    assert asyncio.run(collect()) == images_data
+
+
+def test_fetch_metadata_revalidated(
+    valid_response: List[Dict[str, str]], mocker: MockerFixture, tmp_path
+):
+    """Test that a cached metadata response is reused when the server has not modified it."""
+    body = json.dumps(valid_response).encode()
+    session = mocker.MagicMock()
+    session.get.return_value = mocker.MagicMock(
+        status_code=200, content=body, headers={"ETag": '"abc"'}
+    )
+    cache = ResponseCache(str(tmp_path))
+
+    assert fetch_metadata("http://nasa.gov/apod", cache, session) == valid_response
+    session.get.assert_called_with("http://nasa.gov/apod")
+
+    session.get.return_value = mocker.MagicMock(status_code=304, content=b"", headers={})
+    assert fetch_metadata("http://nasa.gov/apod", cache, session) == valid_response
+    session.get.assert_called_with("http://nasa.gov/apod", headers={"If-None-Match": '"abc"'})
+
+
+def test_fetch_metadata_corrupt_cache(
+    valid_response: List[Dict[str, str]], mocker: MockerFixture, tmp_path
+):
+    """Test that a cached metadata response that cannot be decoded is requested again."""
+    body = json.dumps(valid_response).encode()
+    cache = ResponseCache(str(tmp_path))
+    cache.set("http://nasa.gov/apod", body[:-10], Validators(etag='"abc"'))
+    session = mocker.MagicMock()
+    session.get.side_effect = [
+        mocker.MagicMock(status_code=304, content=b"", headers={}),
+        mocker.MagicMock(status_code=200, content=body, headers={"ETag": '"def"'}),
+    ]
+
+    assert fetch_metadata("http://nasa.gov/apod", cache, session) == valid_response
+    session.get.assert_called_with("http://nasa.gov/apod")
+    assert cache.get("http://nasa.gov/apod") == (body, Validators(etag='"def"'))
+
+
+def test_stream_images_corrupt_cache(
+    valid_response: List[Dict[str, str]],
+    images_data: List[NasaImage],
+    mocker: MockerFixture,
+    tmp_path,
+):
+    """Test that a cached metadata body that cannot be decoded is streamed again."""
+    body = json.dumps(valid_response).encode()
+    cache = ResponseCache(str(tmp_path))
+    cache.set("http://nasa.gov/apod", body[:-10], Validators(etag='"abc"'))
+
+    async def iter_any() -> AsyncIterator[bytes]:
+        yield body
+
+    not_modified = mocker.MagicMock(status=304, headers={})
+    modified = mocker.MagicMock(status=200, headers={"ETag": '"def"'})
+    modified.content.iter_any = iter_any
+    session = mocker.MagicMock()
+    session.get.return_value.__aenter__.side_effect = [not_modified, modified]
+
+    async def collect() -> List[NasaImage]:
+        return [image async for image in stream_images("http://nasa.gov/apod", session, cache)]
+
+    assert asyncio.run(collect()) == images_data
+    assert session.get.call_args_list == [
+        mocker.call("http://nasa.gov/apod", headers={"If-None-Match": '"abc"'}),
+        mocker.call("http://nasa.gov/apod"),
+    ]
+    assert cache.get("http://nasa.gov/apod") == (body, Validators(etag='"def"'))
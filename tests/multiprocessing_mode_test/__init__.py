@@ -0,0 +1 @@
+"""Multiprocessing mode package."""
@@ -0,0 +1,222 @@
+"""Unit tests for the multiprocessing mode implementation"""
+
+import io
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from typing import Dict, List
+from unittest.mock import MagicMock
+
+import pytest
+from PIL import Image
+from pytest_mock import MockerFixture
+
+from cache import CacheEntry, Validators
+from image import NasaImage
+from multiprocessing_mode.main import get_and_process_image, imap_planned, main
+from options import RunOptions
+from planner import RunPlan
+
+
+@pytest.fixture()
+def png_content_request(mocked_get_request: MagicMock) -> MagicMock:
+    """Configure the get request to respond with a PNG picture of two colors.
+
+    Args:
+        mocked_get_request: A mock of a get request.
+
+    Returns:
+        The mock of the get request.
+    """
+    img = Image.new("RGB", (4, 4), (255, 0, 0))
+    img.putpixel((0, 0), (0, 0, 255))
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG")
+    response = mocked_get_request.return_value
+    response.status_code = 200
+    response.headers = {"Content-Length": str(len(buffer.getvalue())), "ETag": '"v1"'}
+    response.iter_content.return_value = [buffer.getvalue()]
+    return mocked_get_request
+
+
+def test_get_and_process_image(images_data: List[NasaImage], png_content_request: MagicMock):
+    """Test that the picture is counted and its body dropped.
+
+    Args:
+        images_data: A list of NASA image objects.
+        png_content_request: A mock of a get request answering a PNG picture.
+    """
+    entry = get_and_process_image(images_data[0])
+
+    assert entry == CacheEntry(2, Validators('"v1"'))
+    assert images_data[0].bytes is None
+    png_content_request.return_value.close.assert_called_once()
+
+
+def test_get_and_process_image_not_modified(
+    images_data: List[NasaImage], mocked_get_request: MagicMock, mocker: MockerFixture
+):
+    """Test that a picture that was not modified keeps its cached count without a download.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocked_get_request: A mock of a get request.
+        mocker: Mocking fixture.
+    """
+    mocked_get_request.return_value.status_code = 304
+    mocked_get_request.return_value.headers = {"ETag": '"v1"'}
+    process_image_mock = mocker.patch("multiprocessing_mode.main.process_image")
+
+    entry = get_and_process_image(images_data[0], cached=CacheEntry(42, Validators('"v1"')))
+
+    assert entry == CacheEntry(42, Validators('"v1"'))
+    assert mocked_get_request.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+    process_image_mock.assert_not_called()
+    mocked_get_request.return_value.iter_content.assert_not_called()
+
+
+def test_get_and_process_image_error(
+    images_data: List[NasaImage], error_image_content_request: MagicMock, mocker: MockerFixture
+):
+    """Test that a picture whose download fails is not counted.
+
+    Args:
+        images_data: A list of NASA image objects.
+        error_image_content_request: A mock of a failed get request.
+        mocker: Mocking fixture.
+    """
+    process_image_mock = mocker.patch("multiprocessing_mode.main.process_image")
+
+    assert get_and_process_image(images_data[0]) is None
+    process_image_mock.assert_not_called()
+    error_image_content_request.return_value.close.assert_called_once()
+
+
+class SlowFirstTask:
+    """Task counting a picture, the first one of the date range after the others."""
+
+    def __init__(self):
+        """Initialize the task."""
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, image: NasaImage, cached: CacheEntry | None = None) -> CacheEntry:
+        """Count a picture.
+
+        Args:
+            image: An image object.
+            cached: Cached entry of the image.
+
+        Returns:
+            A count of the length of the title of the picture.
+        """
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.2 if image.date == "2022-02-10" else 0.05)
+        with self.lock:
+            self.running -= 1
+        return CacheEntry(len(image.title))
+
+
+@pytest.mark.parametrize("window", [1, 2])
+def test_imap_planned_window(images_data: List[NasaImage], window: int):
+    """Test that no more pictures than the window are handed to the pool at once.
+
+    Args:
+        images_data: A list of NASA image objects.
+        window: Maximum number of pictures handed to the pool at once.
+    """
+    task = SlowFirstTask()
+    with ThreadPool(4) as pool:
+        results = list(imap_planned(pool, task, RunPlan(images_data), window))
+
+    assert task.max_running == window
+    assert sorted(results) == [
+        (index, CacheEntry(len(image.title))) for index, image in enumerate(images_data)
+    ]
+
+
+def test_imap_planned_completion_order(images_data: List[NasaImage]):
+    """Test that the values are yielded as the pictures complete.
+
+    Args:
+        images_data: A list of NASA image objects.
+    """
+    with ThreadPool(3) as pool:
+        results = list(imap_planned(pool, SlowFirstTask(), RunPlan(images_data), 3))
+
+    assert [index for index, _ in results][-1] == 0
+
+
+def test_imap_planned_stale_entries(images_data: List[NasaImage]):
+    """Test that the stale cached entry of a picture is handed to its task.
+
+    Args:
+        images_data: A list of NASA image objects.
+    """
+    plan = RunPlan(images_data)
+    plan.stale[1] = CacheEntry(42, Validators('"v1"'))
+    seen: Dict[str, CacheEntry | None] = {}
+
+    def task(image: NasaImage, cached: CacheEntry | None = None):
+        seen[image.date] = cached
+
+    with ThreadPool(1) as pool:
+        list(imap_planned(pool, task, plan, 1))
+
+    assert seen == {
+        "2022-02-10": None,
+        "2022-02-11": CacheEntry(42, Validators('"v1"')),
+        "2022-02-13": None,
+    }
+
+
+def test_imap_planned_error(images_data: List[NasaImage]):
+    """Test that the exception raised by a task is raised by the iteration.
+
+    Args:
+        images_data: A list of NASA image objects.
+    """
+
+    def task(image: NasaImage, cached: CacheEntry | None = None):
+        raise OSError(f"Cannot count {image.date}")
+
+    with ThreadPool(1) as pool, pytest.raises(OSError, match="Cannot count 2022-02-10"):
+        list(imap_planned(pool, task, RunPlan(images_data), 1))
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_main_ordered(images_data: List[NasaImage], mocker: MockerFixture, ordered: bool):
+    """Test that the results are written as they complete, or in date order if requested.
+
+    The pool workers are threads, so the mocks reach them.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+        ordered: Whether the results are written in date order.
+    """
+    mocker.patch("multiprocessing_mode.main.Pool", ThreadPool)
+    task = SlowFirstTask()
+    mocker.patch(
+        "multiprocessing_mode.main.get_and_process_image",
+        side_effect=lambda image, cached=None, **kwargs: task(image, cached),
+    )
+    sink = MagicMock()
+
+    main(
+        "http://test.com/",
+        "2022-02-10",
+        "2022-02-13",
+        RunOptions(cpu_workers=3, sink=sink, ordered=ordered),
+        images=images_data,
+    )
+
+    dates = [call.args[0].date for call in sink.write.call_args_list]
+    if ordered:
+        assert dates == [image.date for image in images_data]
+    else:
+        assert dates[-1] == images_data[0].date
+        assert sorted(dates) == [image.date for image in images_data]
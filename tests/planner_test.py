@@ -0,0 +1,246 @@
+"""Unit tests for the run planner"""
+
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Tuple
+
+from pytest_mock import MockerFixture
+
+from cache import CacheEntry, ResultCache, Validators
+from counter import cache_key
+from image import NasaImage
+from options import RunOptions
+from planner import DEADLINE_WORKERS, MIN_PROBE_TIMEOUT, RunPlan, bound_workers, probe_sizes
+from resolution import URL
+from results import ColorCount
+from scheduler import DEFAULT_IMAGE_SIZE
+
+
+class FakeClock:
+    """Clock whose time only moves when the test advances it."""
+
+    def __init__(self, now: float = 0.0):
+        """Initialize the clock.
+
+        Args:
+            now (float): Starting time in seconds.
+        """
+        self.now = now
+
+    def __call__(self) -> float:
+        """Get the current time.
+
+        Returns:
+            The current time in seconds.
+        """
+        return self.now
+
+
+def build_images() -> List[NasaImage]:
+    """Build a set of pictures in date order.
+
+    Returns:
+        Three images and a video.
+    """
+    return [
+        NasaImage("http://nasa.gov/a.jpg", "image", "A", "2022-02-10"),
+        NasaImage("http://nasa.gov/b.jpg", "image", "B", "2022-02-11"),
+        NasaImage("http://nasa.gov/c.mp4", "video", "C", "2022-02-12"),
+        NasaImage("http://nasa.gov/d.jpg", "image", "D", "2022-02-13"),
+    ]
+
+
+def test_run_plan_without_deadline():
+    """Test that a plan without deadline launches every picture in date order."""
+    plan = RunPlan(build_images())
+
+    assert list(iter(plan.next, None)) == [0, 1, 2, 3]
+    assert plan.skipped == []
+
+
+def test_run_plan_writes_cached_pictures_first(tmp_path):
+    """Test that the cached pictures are written right away and are not launched."""
+    images = build_images()
+    ResultCache(str(tmp_path)).set(cache_key(images[1], URL, 1), 42)
+    written: List[Tuple[int, ColorCount | None]] = []
+
+    plan = RunPlan(images, RunOptions(cache_dir=str(tmp_path)), lambda *args: written.append(args))
+
+    assert written == [(1, ColorCount("2022-02-11", "B", "http://nasa.gov/b.jpg", "image", 42, 1))]
+    assert plan.cached == {1: 42}
+    assert list(iter(plan.next, None)) == [0, 2, 3]
+
+
+def test_run_plan_revalidates_recent_pictures(tmp_path):
+    """Test that the recent cached pictures are launched with their entry to revalidate it."""
+    images = build_images()
+    cache = ResultCache(str(tmp_path))
+    cache.set(cache_key(images[0], URL, 1), 41, Validators('"a"'))
+    cache.set(cache_key(images[3], URL, 1), 42, Validators('"d"'))
+    clock = FakeClock(datetime(2022, 2, 14).timestamp())
+
+    plan = RunPlan(images, RunOptions(cache_dir=str(tmp_path), revalidate_days=3), clock=clock)
+
+    assert plan.cached == {0: 41}
+    assert plan.stale == {3: CacheEntry(42, Validators('"d"'))}
+    assert list(iter(plan.next, None)) == [1, 2, 3]
+
+
+def test_run_plan_caches_completed_pictures(tmp_path):
+    """Test that the counts of the completed pictures are persisted and written."""
+    images = build_images()
+    written: List[Tuple[int, ColorCount | None]] = []
+    plan = RunPlan(images, RunOptions(cache_dir=str(tmp_path)), lambda *args: written.append(args))
+
+    plan.complete(plan.next(), CacheEntry(7, Validators('"abc"')))  # type: ignore
+
+    assert ResultCache(str(tmp_path)).get_entry(cache_key(images[0], URL, 1)) == CacheEntry(
+        7, Validators('"abc"')
+    )
+    assert [(index, result.colors) for index, result in written] == [(0, 7)]  # type: ignore
+
+
+def test_run_plan_priority():
+    """Test that a plan with a deadline launches the videos, then small and recent pictures."""
+    options = RunOptions(deadline=1000.0)
+    plan = RunPlan(build_images(), options, sizes=[100, 200, None, 100], clock=FakeClock())
+
+    assert list(iter(plan.next, None)) == [2, 3, 0, 1]
+
+
+def test_run_plan_skips_pictures_past_deadline(capfd):
+    """Test that the pictures the time left cannot cover are skipped and reported."""
+    clock = FakeClock()
+    written: List[Tuple[int, ColorCount | None]] = []
+    plan = RunPlan(
+        build_images(),
+        RunOptions(deadline=10.0),
+        lambda *args: written.append(args),
+        sizes=[1000, 4000, None, 1000],
+        clock=clock,
+    )
+    assert plan.next() == 2
+    plan.complete(2, None)
+
+    assert plan.next() == 3
+    clock.now = 2.0
+    plan.complete(3, CacheEntry(5))
+    # The first picture took 2 seconds for 1000 bytes.
+    assert plan.estimate(0) == 2.0
+    assert plan.next() == 0
+    clock.now = 4.0
+    plan.complete(0, CacheEntry(6))
+
+    # The largest picture would need 8 more seconds while 6 are left.
+    assert plan.next() is None
+    plan.finish()
+
+    assert plan.skipped == [1]
+    assert [(index, result and result.colors) for index, result in written] == [
+        (2, None),
+        (3, 5),
+        (0, 6),
+        (1, None),
+    ]
+    out, _ = capfd.readouterr()
+    assert out == "Skipped 1 pictures the deadline could not cover: 2022-02-11\n"
+
+
+def test_run_plan_counts_pictures_in_flight():
+    """Test that the pictures in flight share the time left with the next picture."""
+    images = [
+        NasaImage(f"http://nasa.gov/{i}.jpg", "image", str(i), str(date(2022, 1, 1) + timedelta(i)))
+        for i in range(30)
+    ]
+    clock = FakeClock()
+    plan = RunPlan(
+        images, RunOptions(deadline=5.0), sizes=[DEFAULT_IMAGE_SIZE] * 30, clock=clock, workers=4
+    )
+
+    # Four workers get through 20 pictures of a second each in 5 seconds.
+    launched = list(iter(plan.next, None))
+
+    assert len(launched) == 20
+    assert len(plan.skipped) == 10
+
+
+def test_run_plan_counts_elapsed_time_in_flight():
+    """Test that the time a picture has been in flight is taken off its cost."""
+    images = build_images()
+    clock = FakeClock()
+    plan = RunPlan(
+        images, RunOptions(deadline=2.5), sizes=[DEFAULT_IMAGE_SIZE] * 4, clock=clock, workers=1
+    )
+    assert plan.next() == 2
+    assert plan.next() == 3
+    assert plan.next() == 1
+
+    # The two pictures in flight have run for their estimated second, so the last one fits.
+    clock.now = 1.0
+    assert plan.next() == 0
+
+
+def test_bound_workers():
+    """Test that the unbounded modes are bounded when the run has a deadline."""
+    assert bound_workers(None, RunOptions()) is None
+    assert bound_workers(None, RunOptions(deadline=10.0)) == DEADLINE_WORKERS
+    assert bound_workers(4, RunOptions(deadline=10.0)) == 4
+
+
+def test_run_plan_probes_sizes(mocker: MockerFixture):
+    """Test that a plan with a deadline probes the sizes of the pictures that are not cached."""
+    probe_mock = mocker.patch("planner.probe_sizes", return_value=[300, 100, 200])
+
+    plan = RunPlan(build_images(), RunOptions(deadline=1000.0), clock=FakeClock())
+
+    # A tenth of the time left is spent probing.
+    probe_mock.assert_called_once_with(
+        ["http://nasa.gov/a.jpg", "http://nasa.gov/b.jpg", "http://nasa.gov/d.jpg"], timeout=100.0
+    )
+    assert list(iter(plan.next, None)) == [2, 1, 3, 0]
+
+
+def test_run_plan_expired_deadline(mocker: MockerFixture):
+    """Test that nothing is probed nor launched once the deadline has passed."""
+    probe_mock = mocker.patch("planner.probe_sizes")
+
+    plan = RunPlan(build_images(), RunOptions(deadline=10.0), clock=FakeClock(10.0))
+
+    probe_mock.assert_not_called()
+    assert plan.next() is None
+    assert plan.skipped == [2, 3, 1, 0]
+
+
+def test_probe_sizes(mocker: MockerFixture):
+    """Test that the sizes are read from the headers of successful HEAD requests."""
+    head_mock = mocker.patch("planner.requests.head")
+    head_mock.side_effect = [
+        mocker.MagicMock(status_code=200, headers={"Content-Length": "123"}),
+        mocker.MagicMock(status_code=404, headers={}),
+    ]
+
+    assert probe_sizes(["http://nasa.gov/a.jpg", "http://nasa.gov/b.jpg"], 1) == [123, None]
+
+
+def test_probe_sizes_timeout(mocker: MockerFixture):
+    """Test that the sizes not known within the timeout are given up."""
+
+    def head(url: str, **kwargs):
+        if url.endswith("b.jpg"):
+            time.sleep(0.5)
+        return mocker.MagicMock(status_code=200, headers={"Content-Length": "123"})
+
+    head_mock = mocker.patch("planner.requests.head", side_effect=head)
+
+    sizes = probe_sizes(["http://nasa.gov/a.jpg", "http://nasa.gov/b.jpg"], 2, timeout=0.1)
+
+    assert sizes == [123, None]
+    assert head_mock.call_args.kwargs["timeout"] == 0.1
+
+
+def test_probe_sizes_errors(mocker: MockerFixture):
+    """Test that a size is unknown when its request fails, and that the timeout stays positive."""
+    head_mock = mocker.patch("planner.requests.head", side_effect=ValueError("Invalid timeout"))
+
+    assert probe_sizes(["http://nasa.gov/a.jpg"], 1, timeout=0.0) == [None]
+    assert head_mock.call_args.kwargs["timeout"] == MIN_PROBE_TIMEOUT
@@ -0,0 +1,90 @@
+"""Unit tests for the profiling hooks"""
+
+import os
+import pstats
+import threading
+from pathlib import Path
+
+import pytest
+
+import profiling
+
+
+@pytest.fixture()
+def profile_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> str:
+    """Enable profiling in a temporary directory for a single test.
+
+    Args:
+        tmp_path: Temporary directory.
+        monkeypatch: Patching fixture that restores the profiling state.
+
+    Returns:
+        The directory of the profiling statistics.
+    """
+    monkeypatch.setattr(profiling, "_directory", None)
+    monkeypatch.setattr(profiling, "_local", threading.local())
+    directory = str(tmp_path / "profile")
+    profiling.enable(directory)
+    return directory
+
+
+def square(value: int) -> int:
+    """Square a number.
+
+    Args:
+        value: A number.
+
+    Returns:
+        The square of the number.
+    """
+    return value * value
+
+
+def test_profiled_call_disabled(monkeypatch: pytest.MonkeyPatch):
+    """Test that the wrapper only calls the function when profiling is disabled.
+
+    Args:
+        monkeypatch: Patching fixture.
+    """
+    monkeypatch.setattr(profiling, "_directory", None)
+
+    assert profiling.ProfiledCall(square)(3) == 9
+    assert profiling.merge() is None
+
+
+def test_profiled_call_per_thread(profile_dir: str):
+    """Test that each thread writes its own statistics and that they are merged.
+
+    Args:
+        profile_dir: The directory of the profiling statistics.
+    """
+    task = profiling.ProfiledCall(square)
+    threads = [threading.Thread(target=task, args=(value,)) for value in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(os.listdir(profile_dir)) == 3
+
+    merged_path = profiling.merge()
+    assert merged_path == os.path.join(profile_dir, profiling.MERGED_FILE_NAME)
+    calls = [
+        stat[1]
+        for (_, _, name), stat in pstats.Stats(merged_path).stats.items()  # type: ignore
+        if name == "square"
+    ]
+    assert calls == [3]
+    assert "square" in profiling.summarize(merged_path)
+
+
+def test_profile_block_nested(profile_dir: str):
+    """Test that nested blocks are recorded by the outermost profiler.
+
+    Args:
+        profile_dir: The directory of the profiling statistics.
+    """
+    with profiling.profile_block():
+        assert profiling.ProfiledCall(square)(2) == 4
+
+    assert len(os.listdir(profile_dir)) == 1
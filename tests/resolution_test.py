@@ -0,0 +1,62 @@
+"""Unit tests for the resolution policies"""
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from image import NasaImage
+from resolution import AUTO, HDURL, URL, resolve_url, select_url
+
+IMAGE = NasaImage(
+    url="http://nasa.gov/image.jpg",
+    media_type="image",
+    title="An image title",
+    date="2022-02-10",
+    hdurl="http://nasa.gov/image_hd.jpg",
+)
+
+
+@pytest.mark.parametrize(
+    "resolution,hd_size,expected",
+    [
+        (URL, None, IMAGE.url),
+        (HDURL, None, IMAGE.hdurl),
+        (AUTO, 1024, IMAGE.hdurl),
+        (AUTO, 100 * 1024 * 1024, IMAGE.url),
+        (AUTO, None, IMAGE.url),
+    ],
+)
+def test_select_url(resolution: str, hd_size: int | None, expected: str):
+    """Test the URL chosen by each policy."""
+    assert select_url(IMAGE, resolution, hd_size) == expected
+
+
+def test_select_url_without_hdurl():
+    """Test that pictures without high resolution version use the standard one."""
+    image = NasaImage(url=IMAGE.url, media_type="image", title="A title", date="2022-02-10")
+
+    assert select_url(image, HDURL) == image.url
+
+
+def test_select_url_invalid():
+    """Test that unknown policies are rejected."""
+    with pytest.raises(ValueError):
+        select_url(IMAGE, "best")
+
+
+def test_resolve_url_auto():
+    """Test that the auto policy requests the size of the high resolution picture."""
+    session = MagicMock()
+    session.head.return_value.status_code = 200
+    session.head.return_value.headers = {"Content-Length": "2048"}
+
+    assert resolve_url(IMAGE, AUTO, session) == IMAGE.hdurl
+    session.head.assert_called_once_with(IMAGE.hdurl, allow_redirects=True)
+
+
+def test_resolve_url_without_request():
+    """Test that the fixed policies do not request the size of the pictures."""
+    session = MagicMock()
+
+    assert resolve_url(IMAGE, HDURL, session) == IMAGE.hdurl
+    session.head.assert_not_called()
@@ -0,0 +1,114 @@
+"""Unit tests for the memory budget scheduler"""
+
+import asyncio
+import threading
+import time
+from typing import List
+
+import pytest
+
+from scheduler import DEFAULT_IMAGE_SIZE, AsyncByteBudget, ByteBudget, parse_content_length
+
+
+def test_parse_content_length():
+    """Test the parsing of the size announced by a response."""
+    assert parse_content_length({"Content-Length": "1024"}) == 1024
+    assert parse_content_length({"Content-Length": "invalid"}) is None
+    assert parse_content_length({}) is None
+
+
+def test_estimate():
+    """Test the fallback estimate and the capacity cap of the reservations."""
+    budget = ByteBudget(capacity=10 * DEFAULT_IMAGE_SIZE)
+
+    assert budget.estimate(100) == 100
+    assert budget.estimate(None) == DEFAULT_IMAGE_SIZE
+    assert budget.estimate(100 * DEFAULT_IMAGE_SIZE) == 10 * DEFAULT_IMAGE_SIZE
+
+    budget.observe(300)
+    budget.observe(500)
+    assert budget.estimate(None) == 400
+
+
+def test_byte_budget_admits_smallest_first():
+    """Test that waiting downloads are admitted by increasing size."""
+    budget = ByteBudget(capacity=100)
+    admitted: List[int] = []
+    budget.acquire(100)
+
+    def download(size: int):
+        budget.acquire(size)
+        admitted.append(size)
+        budget.release(size)
+
+    threads = [threading.Thread(target=download, args=(size,)) for size in (80, 60, 55)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    budget.release(100)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert admitted == [55, 60, 80]
+    assert budget.in_use == 0
+
+
+def test_byte_budget_bounds_bytes_in_use():
+    """Test that concurrent reservations never exceed the capacity."""
+    budget = ByteBudget(capacity=100)
+    peaks: List[int] = []
+
+    def download():
+        with budget.reserve(40):
+            peaks.append(budget.in_use)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=download) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert max(peaks) <= 100
+    assert budget.in_use == 0
+
+
+def test_async_byte_budget_admits_smallest_first():
+    """Test that waiting asyncio downloads are admitted by increasing size."""
+    admitted: List[int] = []
+
+    async def run():
+        budget = AsyncByteBudget(capacity=100)
+        await budget.acquire(100)
+
+        async def download(size: int):
+            async with budget.reserve(size):
+                admitted.append(size)
+
+        tasks = [asyncio.ensure_future(download(size)) for size in (80, 60, 55)]
+        await asyncio.sleep(0.01)
+        await budget.release(100)
+        await asyncio.gather(*tasks)
+        return budget.in_use
+
+    assert asyncio.run(run()) == 0
+    assert admitted == [55, 60, 80]
+
+
+def test_async_byte_budget_cancelled_wait():
+    """Test that a cancelled wait does not block the downloads that come after it."""
+
+    async def run():
+        budget = AsyncByteBudget(capacity=10)
+        await budget.acquire(8)
+        waiting = asyncio.ensure_future(budget.acquire(5))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        await budget.release(8)
+
+        await asyncio.wait_for(budget.acquire(6), timeout=1)
+        return budget.in_use
+
+    assert asyncio.run(run()) == 6
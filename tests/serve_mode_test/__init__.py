@@ -0,0 +1 @@
+"""Serve mode package."""
\ No newline at end of file
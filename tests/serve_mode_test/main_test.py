@@ -0,0 +1,137 @@
+"""Unit tests for the serve mode implementation"""
+
+import json
+import threading
+from typing import Generator, Tuple
+from unittest.mock import MagicMock
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+import requests
+from pytest_mock import MockerFixture
+
+from results import ColorCount
+from serve_mode.main import ColorsServer, main
+
+
+@pytest.fixture()
+def server() -> Generator[Tuple[ColorsServer, MagicMock], None, None]:
+    """Start a colors server on a free port with a mocked counter.
+
+    Yields:
+        The server and its counter.
+    """
+    counter = MagicMock()
+    counter.count.return_value = [
+        ColorCount("2022-02-10", "An image title", "http://nasa.gov/image.jpg", "image", 42)
+    ]
+    colors_server = ColorsServer(("127.0.0.1", 0), counter)
+    thread = threading.Thread(target=colors_server.serve_forever, daemon=True)
+    thread.start()
+    yield colors_server, counter
+    colors_server.shutdown()
+    colors_server.server_close()
+
+
+def get(colors_server: ColorsServer, path: str) -> Tuple[int, object]:
+    """Request a path of the server.
+
+    Args:
+        colors_server: A running server.
+        path: Path and query string.
+
+    Returns:
+        The status code and the decoded JSON body.
+    """
+    url = f"http://127.0.0.1:{colors_server.server_port}{path}"
+    try:
+        with urlopen(url) as response:
+            return response.status, json.load(response)
+    except HTTPError as error:
+        return error.code, json.load(error)
+
+
+def test_get_colors(server: Tuple[ColorsServer, MagicMock]):
+    """Test that the colors of a date range are served as JSON."""
+    colors_server, counter = server
+
+    status, body = get(colors_server, "/colors?start_date=2022-02-10&end_date=2022-02-11")
+
+    assert status == 200
+    assert body == [
+        {
+            "date": "2022-02-10",
+            "title": "An image title",
+            "url": "http://nasa.gov/image.jpg",
+            "media_type": "image",
+            "colors": 42,
+            "scale": 1,
+        }
+    ]
+    counter.count.assert_called_once_with("2022-02-10", "2022-02-11")
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/colors?start_date=2022-02-10",
+        "/colors?start_date=2022-02-10&end_date=tomorrow",
+        "/colors?start_date=2022-02-11&end_date=2022-02-10",
+    ],
+)
+def test_get_colors_invalid_dates(server: Tuple[ColorsServer, MagicMock], path: str):
+    """Test that invalid date ranges are rejected without counting."""
+    colors_server, counter = server
+
+    status, body = get(colors_server, path)
+
+    assert status == 400
+    assert "error" in body  # type: ignore
+    counter.count.assert_not_called()
+
+
+def test_get_unknown_path(server: Tuple[ColorsServer, MagicMock]):
+    """Test that unknown paths are not found."""
+    status, _ = get(server[0], "/pictures")
+
+    assert status == 404
+
+
+def test_get_colors_metadata_error(server: Tuple[ColorsServer, MagicMock]):
+    """Test that a failure of the metadata endpoint is reported as a bad gateway."""
+    colors_server, counter = server
+    counter.count.side_effect = requests.HTTPError("403 Forbidden")
+
+    status, _ = get(colors_server, "/colors?start_date=2022-02-10&end_date=2022-02-11")
+
+    assert status == 502
+
+
+def test_get_colors_unexpected_error(server: Tuple[ColorsServer, MagicMock]):
+    """Test that an unexpected failure of the counter is reported as a server error."""
+    colors_server, counter = server
+    counter.count.side_effect = OSError("cannot identify image file")
+
+    status, body = get(colors_server, "/colors?start_date=2022-02-10&end_date=2022-02-11")
+
+    assert status == 500
+    assert body == {"error": "Cannot count the colors: cannot identify image file"}
+
+
+def test_main_warm_up_error(mocker: MockerFixture, capfd: pytest.CaptureFixture[str]):
+    """Test that a failed warm-up is reported and the server starts anyway."""
+    counter = mocker.patch("serve_mode.main.ApodColorCounter").return_value.__enter__.return_value
+    counter.count.side_effect = OSError("cannot identify image file")
+    server = mocker.patch("serve_mode.main.ColorsServer").return_value.__enter__.return_value
+    server.server_port = 8000
+    server.serve_forever.side_effect = KeyboardInterrupt
+
+    main("http://nasa.gov/apod?api_key=x", "2022-02-10", "2022-02-11")
+
+    out, _ = capfd.readouterr()
+    assert out.splitlines() == [
+        "Cannot warm up the cache: cannot identify image file",
+        "Serving colors on http://127.0.0.1:8000/colors",
+        "Stopping the server.",
+    ]
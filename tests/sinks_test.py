@@ -0,0 +1,158 @@
+"""Unit tests for the result sinks"""
+
+import csv
+
+import numpy as np
+import pytest
+from pytest import CaptureFixture
+
+from results import ColorCount
+from sinks import CsvSink, NumpySink, PrintSink, ReorderBuffer, ResultSink, make_writer, open_sink
+
+RESULTS = [
+    ColorCount("2022-02-10", "An image title", "http://nasa.gov/image.jpg", "image", 42),
+    ColorCount("2022-02-11", "A video title", "http://nasa.gov/video.mp4", "video", None),
+    ColorCount("2022-02-12", "An image 3 title", "http://nasa.gov/image3.jpg", "image", 7, 4),
+]
+
+
+class ListSink(ResultSink):
+    """Sink keeping the written batches."""
+
+    def __init__(self, batch_size: int):
+        """Initialize the sink."""
+        super().__init__(batch_size)
+        self.batches = []
+
+    def _write_batch(self, batch):
+        self.batches.append(batch)
+
+
+def test_result_sink_is_abstract():
+    """Test that a sink without a batch writer cannot be created."""
+
+    class IncompleteSink(ResultSink):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteSink()  # type: ignore
+
+
+def test_result_sink_writes_batches():
+    """Test that the results are written in full batches and the rest on close."""
+    with ListSink(batch_size=2) as sink:
+        for result in RESULTS:
+            sink.write(result)
+        assert sink.batches == [RESULTS[:2]]
+
+    assert sink.batches == [RESULTS[:2], RESULTS[2:]]
+
+
+def test_reorder_buffer():
+    """Test that each result is written as soon as the results before it have arrived."""
+    sink = ListSink(batch_size=1)
+    buffer = ReorderBuffer(sink)
+
+    buffer.put(2, RESULTS[2])
+    assert sink.batches == [] and len(buffer) == 1
+    buffer.put(0, RESULTS[0])
+    assert sink.batches == [[RESULTS[0]]]
+    buffer.put(1, RESULTS[1])
+
+    assert sink.batches == [[result] for result in RESULTS]
+    assert len(buffer) == 0
+
+
+def test_reorder_buffer_skipped_results():
+    """Test that a skipped result releases the results after it without being written."""
+    sink = ListSink(batch_size=1)
+    buffer = ReorderBuffer(sink)
+
+    buffer.put(1, RESULTS[1])
+    buffer.put(0, None)
+
+    assert sink.batches == [[RESULTS[1]]]
+    assert len(buffer) == 0
+
+
+def test_make_writer():
+    """Test that unordered writers write the results in completion order."""
+    sink = ListSink(batch_size=1)
+    write = make_writer(sink)
+
+    write(2, RESULTS[2])
+    write(0, RESULTS[0])
+
+    assert sink.batches == [[RESULTS[2]], [RESULTS[0]]]
+
+
+def test_print_sink(capfd: CaptureFixture[str]):
+    """Test that the print sink prints the colors of each result."""
+    sink = PrintSink()
+    for result in RESULTS:
+        sink.write(result)
+
+    out, _ = capfd.readouterr()
+    assert out.split("\n") == ["42", "None", "7", ""]
+
+
+def test_csv_sink(tmp_path):
+    """Test that the CSV sink writes a header and one row per result."""
+    path = tmp_path / "colors.csv"
+    with CsvSink(str(path), batch_size=2) as sink:
+        for result in RESULTS:
+            sink.write(result)
+
+    with open(path, newline="") as file:
+        rows = list(csv.reader(file))
+
+    assert rows[0] == list(ColorCount._fields)
+    assert rows[1] == [
+        "2022-02-10",
+        "An image title",
+        "http://nasa.gov/image.jpg",
+        "image",
+        "42",
+        "1",
+    ]
+    assert rows[2][4] == ""
+    assert len(rows) == 4
+
+
+def test_numpy_sink(tmp_path):
+    """Test that the NumPy sink saves a structured array with one record per result."""
+    path = tmp_path / "colors.npy"
+    with NumpySink(str(path), batch_size=2) as sink:
+        for result in RESULTS:
+            sink.write(result)
+
+    array = np.load(path)
+
+    assert list(array.dtype.names) == list(ColorCount._fields)
+    assert list(array["colors"]) == [42, -1, 7]
+    assert list(array["scale"]) == [1, 1, 4]
+    assert array["title"][2] == "An image 3 title"
+
+
+def test_arrow_sinks(tmp_path):
+    """Test that the Parquet and Arrow sinks write nullable colors."""
+    pytest.importorskip("pyarrow")
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    for name, read in (("colors.parquet", pq.read_table), ("colors.arrow", feather.read_table)):
+        path = str(tmp_path / name)
+        with open_sink(path, batch_size=2) as sink:
+            for result in RESULTS:
+                sink.write(result)
+
+        assert read(path).column("colors").to_pylist() == [42, None, 7]
+
+
+def test_open_sink(tmp_path):
+    """Test that the sink is chosen by the extension of the output."""
+    assert isinstance(open_sink(), PrintSink)
+    with open_sink(str(tmp_path / "colors.CSV")) as sink:
+        assert isinstance(sink, CsvSink)
+    with pytest.raises(ValueError):
+        open_sink(str(tmp_path / "colors.txt"))
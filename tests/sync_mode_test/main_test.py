@@ -1,14 +1,20 @@
 """Unit tests for the sync mode implementation"""
 
 import io
+import mmap
 from typing import Dict, List, Literal
 from unittest.mock import MagicMock
 
+from PIL import Image
 from pytest import CaptureFixture
 from pytest_mock import MockerFixture
 
-from image import NasaImage
+from cache import CacheEntry, Validators
+from image import DEFAULT_SPILL_THRESHOLD, NasaImage
+from planner import RunPlan
+from resolution import URL
 from sync_mode.main import (
+    count_content,
     get_color_count,
     get_content,
     get_images,
@@ -17,6 +23,7 @@ from sync_mode.main import (
     process_image,
     process_images,
     process_metadata,
+    stream_images,
 )
 
 
@@ -77,10 +84,85 @@ def test_get_content_ok(
     """
     image = images_data[0]
     get_content(image)
-    ok_image_content_request.assert_called_with(image.url)
+    ok_image_content_request.assert_called_with(image.url, stream=True)
     assert image.bytes.getvalue() == io.BytesIO(binary_response).getvalue()  # type: ignore
 
 
+def test_get_content_spilled(
+    images_data: List[NasaImage],
+    ok_image_content_request: MagicMock,
+    binary_response: Literal[b"\x00\x0f"],
+):
+    """Test the binary content retrieval of an image larger than the spill threshold.
+
+    Args:
+        images_data: A list of NASA image objects.
+        ok_image_content_request: A mock of a get request.
+        binary_response: A binary literal.
+    """
+    image = images_data[0]
+    get_content(image, spill_threshold=1)
+    ok_image_content_request.assert_called_with(image.url, stream=True)
+    assert isinstance(image.bytes, mmap.mmap)
+    assert image.bytes.read() == binary_response
+
+
+def test_get_content_not_modified(images_data: List[NasaImage], mocked_get_request: MagicMock):
+    """Test that a cached image is revalidated without downloading its content.
+
+    Args:
+        images_data (List[NasaImage]): A list of NASA image objects.
+        mocked_get_request (MagicMock): A mock of a get request.
+    """
+    mocked_get_request.return_value.status_code = 304
+    mocked_get_request.return_value.headers = {"ETag": '"v2"'}
+    image = images_data[0]
+    cached = CacheEntry(42, Validators('"v1"', "Thu, 10 Feb 2022 00:00:00 GMT"))
+
+    response = get_content(image, cached=cached)
+
+    mocked_get_request.assert_called_with(
+        image.url,
+        stream=True,
+        headers={"If-None-Match": '"v1"', "If-Modified-Since": "Thu, 10 Feb 2022 00:00:00 GMT"},
+    )
+    mocked_get_request.return_value.iter_content.assert_not_called()
+    mocked_get_request.return_value.close.assert_called_once()
+    assert image.bytes is None
+    assert count_content(image, response, cached) == CacheEntry(
+        42, Validators('"v2"', "Thu, 10 Feb 2022 00:00:00 GMT")
+    )
+
+
+def test_count_content_modified(images_data: List[NasaImage], mocker: MockerFixture):
+    """Test that a modified image is counted again and keeps the validators of its response.
+
+    Args:
+        images_data (List[NasaImage]): A list of NASA image objects.
+        mocker (MockerFixture): Mocking fixture.
+    """
+    process_image_mock = mocker.patch("sync_mode.main.process_image", return_value=7)
+    response = mocker.MagicMock(status_code=200, headers={"ETag": '"v2"'})
+
+    entry = count_content(images_data[0], response, CacheEntry(42, Validators('"v1"')))
+
+    process_image_mock.assert_called_once_with(images_data[0], 1)
+    assert entry == CacheEntry(7, Validators('"v2"'))
+
+
+def test_count_content_failed_download(images_data: List[NasaImage], mocker: MockerFixture):
+    """Test that an image whose content could not be got is not counted.
+
+    Args:
+        images_data (List[NasaImage]): A list of NASA image objects.
+        mocker (MockerFixture): Mocking fixture.
+    """
+    process_image_mock = mocker.patch("sync_mode.main.process_image")
+
+    assert count_content(images_data[0], None) is None
+    process_image_mock.assert_not_called()
+
+
 def test_get_content_error(
     images_data: List[NasaImage], error_image_content_request: MagicMock, capfd: CaptureFixture[str]
 ):
@@ -93,7 +175,8 @@ def test_get_content_error(
     """
     image = images_data[0]
     get_content(image)
-    error_image_content_request.assert_called_with(image.url)
+    error_image_content_request.assert_called_with(image.url, stream=True)
+    error_image_content_request.return_value.close.assert_called_once()
     out, _ = capfd.readouterr()
     # Assert the second calling to print checking the value written to stdout
     assert out.split("\n")[1] == f"Cannot get the content for image: {image}"
@@ -107,7 +190,7 @@ def test_get_images(images_data: List[NasaImage], mocker: MockerFixture):
         mocker: Mocking fixture.
     """
     get_content_mock = mocker.patch("sync_mode.main.get_content")
-    calls = [mocker.call(image) for image in images_data]
+    calls = [mocker.call(image, DEFAULT_SPILL_THRESHOLD, URL) for image in images_data]
 
     get_images(images_data)
     assert get_content_mock.call_count == len(images_data)
@@ -140,7 +223,7 @@ def test_process_images(
     """
     num_of_colors = 6
     process_image_mock = mocker.patch("sync_mode.main.process_image", return_value=num_of_colors)
-    calls = [mocker.call(image) for image in images_data]
+    calls = [mocker.call(image, 1) for image in images_data]
 
     process_images(images_data)
 
@@ -200,6 +283,23 @@ def test_process_image_valid_media_type(
     color_counter_mock.assert_called_once_with(set(expected_img_data))
 
 
+def test_process_image_palette(mocker: MockerFixture, images_data: List[NasaImage]):
+    """Test that palette images are counted from their histogram.
+
+    Args:
+        mocker (MockerFixture): Mocking fixture.
+        images_data (List[NasaImage]): A list of NASA image objects.
+    """
+    buffer = io.BytesIO()
+    Image.new("P", (4, 4)).save(buffer, format="PNG")
+    image = images_data[0]
+    image.bytes = buffer
+    color_counter_mock = mocker.patch("sync_mode.main.get_color_count")
+
+    assert process_image(image) == 1
+    color_counter_mock.assert_not_called()
+
+
 def test_main_no_data(mocker: MockerFixture, capfd: CaptureFixture[str]):
     """Test the main calling for processing the NASA's APOD when no data is retrieved.
 
@@ -218,7 +318,10 @@ def test_main_no_data(mocker: MockerFixture, capfd: CaptureFixture[str]):
 
 
 def test_main(
-    mocker: MockerFixture, images_data: List[NasaImage], valid_response: List[Dict[str, str]]
+    mocker: MockerFixture,
+    images_data: List[NasaImage],
+    valid_response: List[Dict[str, str]],
+    capfd: CaptureFixture[str],
 ):
     """Test the main calling for processing the NASA's APOD when data is retrieved for a date range.
 
@@ -226,6 +329,7 @@ def test_main(
         mocker (MockerFixture): Mocking fixture.
         images_data (List[NasaImage]): A list of NASA image objects.
         valid_response (List[Dict[str, str]]): A list of image metadata.
+        capfd (CaptureFixture[str]): Capture fixture for getting stdout string
     """
     expected_url = "http://test.com/&start_date=2022-02-10&end_date=2022-02-13"
     get_data_mock = mocker.patch("sync_mode.main.get_metadata", return_value=valid_response)
@@ -234,12 +338,59 @@ def test_main(
         "sync_mode.main.process_metadata", return_value=images_data
     )
 
-    get_images_mock = mocker.patch("sync_mode.main.get_images")
+    response = mocker.MagicMock(status_code=200, headers={})
+    stream_images_mock = mocker.patch(
+        "sync_mode.main.stream_images", return_value=[(0, response), (1, response)]
+    )
 
-    process_images_mock = mocker.patch("sync_mode.main.process_images")
+    process_image_mock = mocker.patch("sync_mode.main.process_image", return_value=6)
 
     main(api_url=expected_url, start_date="2022-02-10", end_date="2022-02-13")
     get_data_mock.called_once_with(expected_url)
     process_metadata_mock.called_once_with(valid_response)
-    get_images_mock.called_once_with(images_data)
-    process_images_mock.called_once_with(images_data)
+    plan = stream_images_mock.call_args.args[0]
+    assert plan.images == images_data
+    process_image_mock.assert_has_calls([mocker.call(image, 1) for image in images_data[:2]])
+    out, _ = capfd.readouterr()
+    assert out == "6\n6\n"
+
+
+def test_main_with_images(mocker: MockerFixture, images_data: List[NasaImage]):
+    """Test that the metadata is not fetched again when the images are given.
+
+    Args:
+        mocker (MockerFixture): Mocking fixture.
+        images_data (List[NasaImage]): A list of NASA image objects.
+    """
+    get_data_mock = mocker.patch("sync_mode.main.get_metadata")
+    stream_images_mock = mocker.patch("sync_mode.main.stream_images", return_value=[])
+
+    main("http://test.com/", "2022-02-10", "2022-02-13", images=images_data)
+
+    get_data_mock.assert_not_called()
+    assert stream_images_mock.call_args.args[0].images == images_data
+
+
+def test_stream_images(images_data: List[NasaImage], mocker: MockerFixture):
+    """Test that each picture is downloaded only when the previous one has been processed.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+    """
+
+    def get_content(image: NasaImage, spill_threshold: int, resolution: str, cached: None):
+        image.bytes = io.BytesIO(b"body")
+        return response
+
+    response = mocker.MagicMock(status_code=200)
+    get_content_mock = mocker.patch("sync_mode.main.get_content", side_effect=get_content)
+    stream = stream_images(RunPlan(images_data))
+
+    assert next(stream) == (0, response)
+    assert get_content_mock.call_count == 1
+    assert images_data[0].bytes is not None
+
+    assert next(stream) == (1, response)
+    assert get_content_mock.call_count == 2
+    assert images_data[0].bytes is None
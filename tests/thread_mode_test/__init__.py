@@ -0,0 +1 @@
+"""Thread mode package."""
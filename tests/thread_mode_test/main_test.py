@@ -0,0 +1,224 @@
+"""Unit tests for the threading mode implementation"""
+
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from unittest.mock import MagicMock
+
+import pytest
+from PIL import Image
+from pytest_mock import MockerFixture
+
+from cache import CacheEntry, Validators
+from image import NasaImage
+from options import RunOptions
+from planner import RunPlan
+from scheduler import ByteBudget
+from thread_mode.main import get_and_process_image, iter_processed_images, main
+
+
+@pytest.fixture()
+def png_content_request(mocked_get_request: MagicMock) -> MagicMock:
+    """Configure the get request to respond with a PNG picture of two colors.
+
+    Args:
+        mocked_get_request: A mock of a get request.
+
+    Returns:
+        The mock of the get request.
+    """
+    img = Image.new("RGB", (4, 4), (255, 0, 0))
+    img.putpixel((0, 0), (0, 0, 255))
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG")
+    response = mocked_get_request.return_value
+    response.status_code = 200
+    response.headers = {"Content-Length": str(len(buffer.getvalue())), "ETag": '"v1"'}
+    response.iter_content.return_value = [buffer.getvalue()]
+    return mocked_get_request
+
+
+def test_get_and_process_image(images_data: List[NasaImage], png_content_request: MagicMock):
+    """Test that the picture is counted by the counter threads and its reservation released.
+
+    Args:
+        images_data: A list of NASA image objects.
+        png_content_request: A mock of a get request answering a PNG picture.
+    """
+    budget = ByteBudget(capacity=1000)
+    with ThreadPoolExecutor(1, thread_name_prefix="counter") as counter:
+        entry = get_and_process_image(images_data[0], budget, counter)
+
+    assert entry == CacheEntry(2, Validators('"v1"'))
+    assert images_data[0].bytes is None
+    assert budget.in_use == 0
+    png_content_request.return_value.close.assert_called_once()
+
+
+def test_get_and_process_image_counts_off_download_thread(
+    images_data: List[NasaImage], png_content_request: MagicMock, mocker: MockerFixture
+):
+    """Test that the colors are counted by the counter executor, not the download thread.
+
+    Args:
+        images_data: A list of NASA image objects.
+        png_content_request: A mock of a get request answering a PNG picture.
+        mocker: Mocking fixture.
+    """
+    threads: List[str] = []
+    mocker.patch(
+        "thread_mode.main.process_image",
+        side_effect=lambda image, scale: threads.append(threading.current_thread().name) or 3,
+    )
+
+    with ThreadPoolExecutor(1, thread_name_prefix="counter") as counter:
+        entry = get_and_process_image(images_data[0], ByteBudget(), counter)
+
+    assert entry is not None and entry.colors == 3
+    assert len(threads) == 1 and threads[0].startswith("counter")
+
+
+def test_get_and_process_image_releases_budget_on_error(
+    images_data: List[NasaImage], png_content_request: MagicMock, mocker: MockerFixture
+):
+    """Test that the reservation is released when the picture cannot be decoded.
+
+    Args:
+        images_data: A list of NASA image objects.
+        png_content_request: A mock of a get request answering a PNG picture.
+        mocker: Mocking fixture.
+    """
+    mocker.patch("thread_mode.main.process_image", side_effect=OSError("Truncated picture"))
+    budget = ByteBudget(capacity=1000)
+
+    with ThreadPoolExecutor(1) as counter, pytest.raises(OSError):
+        get_and_process_image(images_data[0], budget, counter)
+
+    assert budget.in_use == 0
+    assert images_data[0].bytes is None
+
+
+def test_get_and_process_image_not_modified(
+    images_data: List[NasaImage], mocked_get_request: MagicMock
+):
+    """Test that a picture that was not modified keeps its cached count without a download.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocked_get_request: A mock of a get request.
+    """
+    mocked_get_request.return_value.status_code = 304
+    mocked_get_request.return_value.headers = {"ETag": '"v1"'}
+    counter = MagicMock()
+
+    entry = get_and_process_image(
+        images_data[0], ByteBudget(), counter, cached=CacheEntry(42, Validators('"v1"'))
+    )
+
+    assert entry == CacheEntry(42, Validators('"v1"'))
+    assert mocked_get_request.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+    counter.submit.assert_not_called()
+    mocked_get_request.return_value.close.assert_called_once()
+
+
+def test_get_and_process_image_error(
+    images_data: List[NasaImage], error_image_content_request: MagicMock
+):
+    """Test that a picture whose download fails is not counted.
+
+    Args:
+        images_data: A list of NASA image objects.
+        error_image_content_request: A mock of a failed get request.
+    """
+    counter = MagicMock()
+
+    assert get_and_process_image(images_data[0], ByteBudget(), counter) is None
+    counter.submit.assert_not_called()
+    error_image_content_request.return_value.close.assert_called_once()
+
+
+def test_iter_processed_images_completion_order(
+    images_data: List[NasaImage], mocker: MockerFixture
+):
+    """Test that the counts are yielded as the pictures complete.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+    """
+
+    def get_and_process(image: NasaImage, *args) -> CacheEntry:
+        if image is images_data[0]:
+            time.sleep(0.2)
+        return CacheEntry(len(image.title))
+
+    mocker.patch("thread_mode.main.get_and_process_image", side_effect=get_and_process)
+
+    results = list(iter_processed_images(RunPlan(images_data), 3, 1, ByteBudget()))
+
+    assert [index for index, _ in results][-1] == 0
+    assert sorted(results) == [
+        (index, CacheEntry(len(image.title))) for index, image in enumerate(images_data)
+    ]
+
+
+def test_iter_processed_images_cancels_on_abandon(
+    images_data: List[NasaImage], mocker: MockerFixture
+):
+    """Test that the pictures not launched yet are cancelled when the iteration is abandoned.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+    """
+
+    def get_and_process(image: NasaImage, *args) -> CacheEntry:
+        if image is not images_data[0]:
+            time.sleep(0.2)
+        return CacheEntry(1)
+
+    get_mock = mocker.patch("thread_mode.main.get_and_process_image", side_effect=get_and_process)
+    plan = RunPlan(images_data)
+    results = iter_processed_images(plan, 1, 1, ByteBudget())
+
+    assert next(results) == (0, CacheEntry(1))
+    results.close()
+
+    assert get_mock.call_count <= 2
+    assert plan.remaining >= 1
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_main_ordered(images_data: List[NasaImage], mocker: MockerFixture, ordered: bool):
+    """Test that the results are written as they complete, or in date order if requested.
+
+    Args:
+        images_data: A list of NASA image objects.
+        mocker: Mocking fixture.
+        ordered: Whether the results are written in date order.
+    """
+
+    def get_and_process(image: NasaImage, *args) -> CacheEntry:
+        if image is images_data[0]:
+            time.sleep(0.2)
+        return CacheEntry(1)
+
+    mocker.patch("thread_mode.main.get_and_process_image", side_effect=get_and_process)
+    sink = MagicMock()
+
+    main(
+        "http://test.com/",
+        "2022-02-10",
+        "2022-02-13",
+        RunOptions(io_workers=3, sink=sink, ordered=ordered),
+        images=images_data,
+    )
+
+    dates = [call.args[0].date for call in sink.write.call_args_list]
+    if ordered:
+        assert dates == [image.date for image in images_data]
+    else:
+        assert dates[-1] == images_data[0].date
+        assert sorted(dates) == [image.date for image in images_data]
@@ -1,33 +1,55 @@
 """Includes the functions for getting and processing Nasa images in threading mode."""
 
-import io
+import sys
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+from contextlib import closing
+from multiprocessing import cpu_count
 from threading import Thread
-from typing import Dict, List, Set
+from typing import Dict, Iterator, List, Set, Tuple
 
 import requests
-from PIL import Image
 
-from image import NasaImage
+from cache import NOT_MODIFIED, CacheEntry, ResponseCache, metadata_cache
+from colors import count_colors, decode_image
+from image import CHUNK_SIZE, DEFAULT_SPILL_THRESHOLD, BodyBuffer, NasaImage
+from memtrack import track_stage
+from metadata import fetch_metadata
+from options import RunOptions
+from planner import RunPlan, bound_workers
+from profiling import ProfiledCall, profile_block
+from resolution import URL, resolve_url
+from scheduler import ByteBudget, parse_content_length
+from sinks import make_writer
 
 
 class MetadataThread(Thread):
     """Class for spawning a thread to retrieve images metadata."""
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, cache: ResponseCache | None = None):
         """Initialize the thread object with the required data.
 
         Args:
             url (str): URL of the metadata endpoint.
+            cache (ResponseCache | None): Cache of the metadata responses, revalidated if given.
         """
         Thread.__init__(self)
         self.value: List[Dict] = []
         self.url = url
+        self.cache = cache
 
     def run(self):
         """Request the url of the metadata endpoint and sets the json response."""
-        response = requests.get(self.url)
-        if response.status_code == 200:
-            self.value = response.json()
+        with profile_block(), track_stage("metadata", "metadata"):
+            self.value = fetch_metadata(self.url, self.cache)
+
+
+def report(message: str):
+    """Print a message in a single write, so the lines printed by several threads do not mix.
+
+    Args:
+        message (str): The message.
+    """
+    sys.stdout.write(f"{message}\n")
 
 
 def process_metadata(data: List[Dict[str, str]]) -> List[NasaImage]:
@@ -40,60 +62,193 @@ def process_metadata(data: List[Dict[str, str]]) -> List[NasaImage]:
         List[NasaImage]: Returns a list of NASA images objects.
     """
     return [
-        NasaImage(url=p["url"], media_type=p["media_type"], title=p["title"], date=p["date"])
+        NasaImage(
+            url=p["url"],
+            media_type=p["media_type"],
+            title=p["title"],
+            date=p["date"],
+            hdurl=p.get("hdurl"),
+        )
         for p in data
     ]
 
 
-def get_image_binary(image: NasaImage):
-    """Get the binary content of a set of images using their URL.
+def get_and_process_image(
+    image: NasaImage,
+    budget: ByteBudget,
+    counter: Executor,
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+    resolution: str = URL,
+    preview_scale: int = 1,
+    cached: CacheEntry | None = None,
+) -> CacheEntry | None:
+    """Get the binary content of an image within a memory budget and count its colors.
+
+    The binary content is streamed into a buffer and set to the image bytes attribute. Bodies
+    larger than the spill threshold are buffered in a memory-mapped temporary file. The room
+    reserved for the body is held until the colors are counted and the buffer is dropped, so
+    the budget bounds the memory used by all the threads. An image with a cached entry is
+    requested with the entry validators, and its cached count is reused if the server answers
+    that it has not been modified.
 
-    The binary content is loaded using an in-memory buffer and set to the image bytes attribute.
+    The colors are counted by the counter executor, which is sized to the CPU cores while the
+    download threads are sized to the network concurrency.
 
     Args:
         image (NasaImage): A NASA image object.
-    """
-    response = requests.get(image.url)
-    if response.status_code == 200:
-        image.bytes = io.BytesIO(response.content)
-        return
-    print(f"Cannot get the content for image: {image}")
-
+        budget (ByteBudget): Memory budget shared by the download threads.
+        counter (Executor): Executor that decodes the images and counts their colors.
+        spill_threshold (int): Size in bytes above which the body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        preview_scale (int): Divisor of the width and height of the decoded image.
+        cached (CacheEntry | None): Cached entry of the image to revalidate.
 
-def get_content(images: List[NasaImage]):
-    """Span a set of threads for getting the binary contet of a list of images.
+    Returns:
+        The number of unique colors of the image and the validators of its response, or None
+        if it could not be counted.
+    """
+    if image.media_type != "image":
+        return process_image(image)
+
+    headers = cached.validators.conditional_headers() if cached is not None else None
+    response = requests.get(resolve_url(image, resolution), stream=True, headers=headers)
+    with closing(response):
+        if cached is not None and response.status_code == NOT_MODIFIED:
+            report(f"Not modified: {image}")
+            return cached.revalidated(response.headers)
+        if response.status_code != 200:
+            report(f"Cannot get the content for image: {image}")
+            return None
+
+        content_length = parse_content_length(response.headers)
+        with budget.reserve(content_length):
+            with track_stage(image.date, "download"):
+                body = BodyBuffer(spill_threshold, content_length)
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    body.write(chunk)
+            budget.observe(body.size)
+            image.bytes = body.getbuffer()
+            try:
+                colors = counter.submit(ProfiledCall(process_image), image, preview_scale).result()
+            finally:
+                image.bytes = None
+    return CacheEntry.from_response(colors, response.headers)
+
+
+def get_and_process_images(
+    images: List[NasaImage],
+    io_workers: int | None,
+    cpu_workers: int | None,
+    budget: ByteBudget,
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+    resolution: str = URL,
+    preview_scale: int = 1,
+) -> List[int | None]:
+    """Span a set of threads for getting and counting the colors of a list of images.
 
     Args:
         images (List[NasaImage]): A list of NASA images objects.
-    """
-    threads = []
-    for image in images:
-        t = Thread(target=get_image_binary, args=(image,))
-        t.start()
-        threads.append(t)
-
-    for thread in threads:
-        thread.join()
+        io_workers (int | None): Maximum number of download threads. One per image if None.
+        cpu_workers (int | None): Number of counting threads. One per CPU core if None.
+        budget (ByteBudget): Memory budget shared by the download threads.
+        spill_threshold (int): Size in bytes above which a body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        preview_scale (int): Divisor of the width and height of the decoded images.
 
+    Returns:
+        The number of unique colors of each image.
+    """
+    counts: List[int | None] = [None] * len(images)
+    for index, entry in iter_processed_images(
+        RunPlan(images), io_workers, cpu_workers, budget, spill_threshold, resolution, preview_scale
+    ):
+        counts[index] = None if entry is None else entry.colors
+    return counts
+
+
+def iter_processed_images(
+    plan: RunPlan,
+    io_workers: int | None,
+    cpu_workers: int | None,
+    budget: ByteBudget,
+    spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+    resolution: str = URL,
+    preview_scale: int = 1,
+) -> Iterator[Tuple[int, CacheEntry | None]]:
+    """Get and count the colors of the pictures of a plan, yielding each count as it completes.
+
+    Each download thread asks the plan for the next picture when it is free. The pictures with
+    a stale cached entry are revalidated. The pending work is cancelled if the iteration is
+    abandoned.
 
-def process_image(image: NasaImage) -> int | None:
+    Args:
+        plan (RunPlan): Plan of the pictures to launch.
+        io_workers (int | None): Maximum number of download threads. One per picture if None.
+        cpu_workers (int | None): Number of counting threads. One per CPU core if None.
+        budget (ByteBudget): Memory budget shared by the download threads.
+        spill_threshold (int): Size in bytes above which a body is written to disk.
+        resolution (str): Resolution policy, one of ``url``, ``hdurl`` or ``auto``.
+        preview_scale (int): Divisor of the width and height of the decoded images.
+
+    Yields:
+        The index of each launched picture in the plan, and its number of unique colors with
+        the validators of its response, in completion order.
+    """
+    launches = plan.remaining
+    counter = ThreadPoolExecutor(cpu_workers or cpu_count(), thread_name_prefix="counter")
+    downloader = ThreadPoolExecutor(io_workers or max(launches, 1), thread_name_prefix="download")
+    with counter, downloader:
+
+        def launch() -> Tuple[int, CacheEntry | None] | None:
+            index = plan.next()
+            if index is None:
+                return None
+            image = plan.images[index]
+            return index, get_and_process_image(
+                image,
+                budget,
+                counter,
+                spill_threshold,
+                resolution,
+                preview_scale,
+                plan.stale.get(index),
+            )
+
+        futures = [downloader.submit(ProfiledCall(launch)) for _ in range(launches)]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if result is not None:
+                    yield result
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def process_image(image: NasaImage, preview_scale: int = 1) -> int | None:
     """Process a given image.
 
     This function takes an image, checks for the valid media type and count the unique colors.
 
     Args:
         image (NasaImage): An image object.
+        preview_scale (int): Divisor of the width and height of the decoded image.
 
     Returns:
         The number of unique colors of the image.
     """
     if image.media_type != "image":
-        print(f"Invalid media type for {image}")
+        report(f"Invalid media type for {image}")
         return  # type: ignore
 
-    print(f"Processing image: {image}")
-    img = Image.open(image.bytes)
-    return get_color_count(set(img.getdata()))
+    report(f"Processing image: {image}")
+    with track_stage(image.date, "decode"):
+        img = decode_image(image.bytes, preview_scale)  # type: ignore
+    with track_stage(image.date, "count"):
+        count = count_colors(img)
+        if count is not None:
+            return count
+        return get_color_count(set(img.getdata()))
 
 
 def get_color_count(unique_pixels: Set):
@@ -108,34 +263,53 @@ def get_color_count(unique_pixels: Set):
     return len(unique_pixels)
 
 
-def process_images(images: List[NasaImage]):
-    """Process a set NASA's APOD images.
-
-    Args:
-        images (List[NasaImage]): List of NASA images objects.
-    """
-    for image in images:
-        print(process_image(image))
-
-
-def main(api_url: str, start_date: str, end_date: str):
+def main(
+    api_url: str,
+    start_date: str,
+    end_date: str,
+    options: RunOptions = RunOptions(),
+    images: List[NasaImage] | None = None,
+):
     """Run the process for processing images in a date range.
 
     Args:
         api_url (str): URL of the image metadata API endpoint.
         start_date (str): Start date of the date range.
         end_date (str): End date of the date range.
+        options (RunOptions): Tuning options. Uses ``io_workers`` to bound the download threads,
+            ``cpu_workers`` to size the counting threads and ``memory_budget`` to bound the
+            bytes they hold. Bodies larger than ``spill_threshold`` are buffered on disk. The
+            pictures are downloaded with the ``resolution`` policy and decoded at
+            ``preview_scale``. Pictures cached in ``cache_dir`` are not downloaded again,
+            unless they are within the last ``revalidate_days`` and have been modified, and no
+            picture is launched past the ``deadline``. The results are written to ``sink``
+            as the images complete, or in date order if ``ordered`` is set.
+        images (List[NasaImage] | None): Pictures of the date range, when their metadata has
+            already been processed. The metadata is fetched if None.
     """
-    url = f"{api_url}&start_date={start_date}&end_date={end_date}"
-    t = MetadataThread(url=url)
-    t.start()
-    t.join()
-    data = t.value
-
-    if not data:
-        print("An error ocurred retrieving the pictures metadata.")
-        return
-
-    images = process_metadata(data)
-    get_content(images)
-    process_images(images)
+    if images is None:
+        url = f"{api_url}&start_date={start_date}&end_date={end_date}"
+        t = MetadataThread(url=url, cache=metadata_cache(options.cache_dir))
+        t.start()
+        t.join()
+        data = t.value
+
+        if not data:
+            print("An error ocurred retrieving the pictures metadata.")
+            return
+
+        images = process_metadata(data)
+    budget = ByteBudget(options.memory_budget)
+    io_workers = bound_workers(options.io_workers, options)
+    plan = RunPlan(images, options, make_writer(options.sink, options.ordered), workers=io_workers)
+    for index, entry in iter_processed_images(
+        plan,
+        io_workers,
+        options.cpu_workers,
+        budget,
+        options.spill_threshold,
+        options.resolution,
+        options.preview_scale,
+    ):
+        plan.complete(index, entry)
+    plan.finish()